@@ -0,0 +1,106 @@
+"""
+
+  benchmarks.bench_ftp:  measure fs.expose.ftp serving
+
+This serves a MemoryFS and a TempFS with pyftpdlib through fs.expose.ftp
+and, with an ftplib client, times LIST and MLSD of a large directory and
+a RETR of a large file.  Each is run with the per-session stat cache
+switched off (so every listed entry is stat'ed on its own) and on.  The
+served FS can be given a delay per call, as a remote FS would have, and
+the calls that reach it are counted, e.g.:
+
+    python benchmarks/bench_ftp.py --entries 5000 --size 67108864 --latency 0.001
+
+"""
+
+import sys
+import time
+import ftplib
+import logging
+import threading
+import optparse
+
+from pyftpdlib.authorizers import DummyAuthorizer
+from pyftpdlib.servers import FTPServer
+
+from fs.tempfs import TempFS
+from fs.memoryfs import MemoryFS
+from fs.expose import ftp
+
+from benchutil import SlowFS
+
+
+def start_server(fs):
+    class Handler(ftp.FTPFSHandler):
+        authorizer = DummyAuthorizer()
+        abstracted_fs = ftp.FTPFSFactory(fs)
+    Handler.authorizer.add_anonymous("/")
+    server = FTPServer(("127.0.0.1", 0), Handler)
+    server.serving = True
+    def serve():
+        # The server's IOLoop must only be used from this thread.
+        while server.serving:
+            server.serve_forever(timeout=0.05, blocking=False)
+        server.close_all()
+    server.thread = threading.Thread(target=serve)
+    server.thread.start()
+    return server
+
+
+def fill(fs, entries, size):
+    fs.makedir("big")
+    for i in xrange(entries):
+        fs.setcontents("big/file%06d.txt" % (i,), "x" * (i % 100))
+    fs.setcontents("large.bin", "x" * size)
+
+
+def timed(fs, func):
+    calls = fs.total_calls()
+    start = time.time()
+    func()
+    return (time.time() - start, fs.total_calls() - calls)
+
+
+def run(fs):
+    server = start_server(fs)
+    client = ftplib.FTP()
+    client.connect("127.0.0.1", server.address[1])
+    client.login()
+    def retr():
+        client.retrbinary("RETR /large.bin", lambda data: None, 1024 * 1024)
+    try:
+        return [timed(fs, lambda: client.retrlines("LIST /big", lambda line: None)),
+                timed(fs, lambda: client.retrlines("MLSD /big", lambda line: None)),
+                timed(fs, retr)]
+    finally:
+        client.close()
+        server.serving = False
+        server.thread.join()
+
+
+def main(argv):
+    parser = optparse.OptionParser()
+    parser.add_option("--entries", type="int", default=5000)
+    parser.add_option("--size", type="int", default=64 * 1024 * 1024)
+    parser.add_option("--latency", type="float", default=0.0)
+    (options, args) = parser.parse_args(argv)
+    logging.getLogger("pyftpdlib").setLevel(logging.CRITICAL)
+    print "%10s %8s %18s %18s %10s" % ("fs", "caching", "LIST ms/calls",
+                                       "MLSD ms/calls", "RETR MB/s")
+    for (name, fs_class) in (("memoryfs", MemoryFS), ("tempfs", TempFS)):
+        for (caching, stat_timeout) in (("off", 0), ("on", 1.0)):
+            ftp.FTPFS.stat_timeout = stat_timeout
+            #  The server closes the FS when the client disconnects.
+            fs = fs_class()
+            fill(fs, options.entries, options.size)
+            fs = SlowFS(fs, options.latency,
+                        ("getinfo", "listdirinfo", "isdir"))
+            ((list_time, list_calls), (mlsd_time, mlsd_calls),
+             (retr_time, retr_calls)) = run(fs)
+            print "%10s %8s %11.1f/%-6d %11.1f/%-6d %10.1f" % (
+                name, caching, list_time * 1000, list_calls, mlsd_time * 1000,
+                mlsd_calls, options.size / (1024.0 * 1024) / retr_time)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
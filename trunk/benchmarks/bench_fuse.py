@@ -0,0 +1,115 @@
+"""
+
+  benchmarks.bench_fuse:  measure throughput through a FUSE mount
+
+This mounts a TempFS-backed OSFS and a MemoryFS with fs.expose.fuse, then
+writes and reads a file through each mount with dd-style block sizes, and
+has several threads read the file at once, reporting MB/sec, e.g.:
+
+    python benchmarks/bench_fuse.py --size 268435456 --block 4096 --block 1048576
+
+Pass --no-big-writes to see the effect of 4K write requests.
+
+"""
+
+import os
+import sys
+import time
+import tempfile
+import threading
+import optparse
+
+from fs.osfs import OSFS
+from fs.memoryfs import MemoryFS
+from fs.expose import fuse
+
+
+def write_file(path, size, block_size):
+    block = "x" * block_size
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+    start = time.time()
+    try:
+        written = 0
+        while written < size:
+            written += os.write(fd, block)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return size / (1024.0 * 1024) / (time.time() - start)
+
+
+def read_file(path, block_size, offset=0, length=None):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.lseek(fd, offset, os.SEEK_SET)
+        total = 0
+        while length is None or total < length:
+            data = os.read(fd, block_size)
+            if not data:
+                break
+            total += len(data)
+    finally:
+        os.close(fd)
+    return total
+
+
+def parallel_read(path, size, block_size, num_threads):
+    part = size // num_threads
+    threads = [threading.Thread(target=read_file,
+                                args=(path, block_size, n * part, part))
+               for n in xrange(num_threads)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return size / (1024.0 * 1024) / (time.time() - start)
+
+
+def main(argv):
+    parser = optparse.OptionParser()
+    parser.add_option("--size", type="int", default=128 * 1024 * 1024)
+    parser.add_option("--block", type="int", action="append", default=[])
+    parser.add_option("--threads", type="int", default=4)
+    parser.add_option("--no-big-writes", action="store_true", default=False)
+    (options, args) = parser.parse_args(argv)
+    block_sizes = options.block or [4096, 128 * 1024, 1024 * 1024]
+    root = tempfile.mkdtemp()
+    backing = os.path.join(root, "backing")
+    mount_point = os.path.join(root, "mount")
+    os.mkdir(backing)
+    os.mkdir(mount_point)
+    fuse_opts = {}
+    if options.no_big_writes:
+        fuse_opts["big_writes"] = False
+    print "%10s %10s %10s %10s %12s" % ("fs", "block", "write MB/s", "read MB/s",
+                                       "%d thr MB/s" % (options.threads,))
+    try:
+        for (name, fs) in (("osfs", OSFS(backing)), ("memoryfs", MemoryFS())):
+            mp = fuse.mount(fs, mount_point, **fuse_opts)
+            try:
+                path = os.path.join(mount_point, "data.bin")
+                for block_size in block_sizes:
+                    write_speed = write_file(path, options.size, block_size)
+                    start = time.time()
+                    read_file(path, block_size)
+                    read_speed = options.size / (1024.0 * 1024) / (time.time() - start)
+                    threaded = parallel_read(path, options.size, block_size,
+                                             options.threads)
+                    print "%10s %10d %10.1f %10.1f %12.1f" % (name, block_size,
+                                                              write_speed, read_speed,
+                                                              threaded)
+                os.remove(path)
+            finally:
+                mp.unmount()
+    finally:
+        for dirpath in (os.path.join(backing, "data.bin"),):
+            if os.path.exists(dirpath):
+                os.remove(dirpath)
+        os.rmdir(backing)
+        os.rmdir(mount_point)
+        os.rmdir(root)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,103 @@
+"""
+
+  benchmarks.bench_fuse_writes:  measure write coalescing in fs.expose.fuse
+
+This feeds FSOperations.write() the stream of small requests the kernel
+sends for a file written through a FUSE mount, without mounting anything,
+and counts the writes that reach the FS's file objects for different
+write buffer sizes.  It uses a TempFS and a MemoryFS whose files are
+RemoteFileBuffers, as a remote FS's are, e.g.:
+
+    python benchmarks/bench_fuse_writes.py --size 67108864 --request 4096
+
+A buffer size of 0 writes each request straight through, as before.
+
+"""
+
+import os
+import sys
+import time
+import optparse
+
+from fs.tempfs import TempFS
+from fs.memoryfs import MemoryFS
+from fs.wrapfs import WrapFS
+from fs.remote import RemoteFileBuffer
+from fs.expose.fuse import FSOperations
+
+
+class FileInfo(object):
+    """Stands in for the fuse_file_info structure FUSE passes."""
+
+    def __init__(self, flags):
+        self.flags = flags
+        self.fh = None
+        self.keep_cache = 0
+
+
+class CountingFile(object):
+    """Wraps a file object, counting the calls to its write() method."""
+
+    def __init__(self, f):
+        self.f = f
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        return self.f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+
+class RemoteMemoryFS(WrapFS):
+    """MemoryFS opening files through a RemoteFileBuffer."""
+
+    def __init__(self):
+        super(RemoteMemoryFS, self).__init__(MemoryFS())
+
+    def open(self, path, mode="r", **kwds):
+        if "w" in mode and not self.exists(path):
+            self.wrapped_fs.setcontents(path, "")
+        return RemoteFileBuffer(self, path, mode, self.wrapped_fs.getcontents(path))
+
+    def setcontents(self, path, data="", **kwds):
+        return self.wrapped_fs.setcontents(path, data, **kwds)
+
+
+def write_file(ops, path, size, request_size):
+    fi = FileInfo(os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+    ops.create(path, 0644, fi)
+    (f, _, lock) = ops._files_by_handle[fi.fh]
+    counting = CountingFile(f)
+    ops._files_by_handle[fi.fh] = (counting, path, lock)
+    data = "x" * request_size
+    start = time.time()
+    for offset in xrange(0, size, request_size):
+        ops.write(path, data, offset, fi)
+    ops.flush(path, fi)
+    ops.release(path, fi)
+    return (time.time() - start, counting.writes)
+
+
+def main(argv):
+    parser = optparse.OptionParser()
+    parser.add_option("--size", type="int", default=64 * 1024 * 1024)
+    parser.add_option("--request", type="int", default=4096)
+    parser.add_option("--buffer", type="int", action="append", default=[])
+    (options, args) = parser.parse_args(argv)
+    buffer_sizes = options.buffer or [0, 128 * 1024, 1024 * 1024]
+    print "%10s %10s %10s %10s" % ("fs", "buffer", "MB/sec", "writes")
+    for (name, fs) in (("tempfs", TempFS()), ("remote", RemoteMemoryFS())):
+        for buffer_size in buffer_sizes:
+            ops = FSOperations(fs, write_buffer_size=buffer_size)
+            (elapsed, writes) = write_file(ops, "/data.bin", options.size,
+                                           options.request)
+            mbytes = options.size / (1024.0 * 1024) / elapsed
+            print "%10s %10d %10.1f %10d" % (name, buffer_size, mbytes, writes)
+            fs.remove("data.bin")
+        fs.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,115 @@
+"""
+
+  benchmarks.bench_http:  measure fs.expose.http serving
+
+This serves a TempFS with fs.expose.http.FSHTTPServer and times fetching
+small files over one kept-alive connection versus a new connection per
+request, several clients fetching at once, and downloading a large file
+with different copy buffer sizes, e.g.:
+
+    python benchmarks/bench_http.py --clients 8 --buffer 16384 --buffer 262144
+
+"""
+
+import sys
+import time
+import httplib
+import threading
+import optparse
+
+from fs.tempfs import TempFS
+from fs.expose.http import FSHTTPServer, FSHTTPRequestHandler
+
+
+class QuietHandler(FSHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def start_server(fs, buffer_size):
+    server = FSHTTPServer(fs, ("127.0.0.1", 0), QuietHandler, buffer_size=buffer_size)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def fetch(conn, path):
+    conn.request("GET", path)
+    response = conn.getresponse()
+    size = 0
+    while True:
+        data = response.read(1024 * 1024)
+        if not data:
+            break
+        size += len(data)
+    return size
+
+
+def small_files(port, requests, keep_alive):
+    conn = httplib.HTTPConnection("127.0.0.1", port)
+    start = time.time()
+    for i in xrange(requests):
+        if not keep_alive:
+            conn = httplib.HTTPConnection("127.0.0.1", port)
+        fetch(conn, "/small/f%d.txt" % (i % 100,))
+        if not keep_alive:
+            conn.close()
+    conn.close()
+    return requests / (time.time() - start)
+
+
+def concurrent(port, clients, requests):
+    def client():
+        conn = httplib.HTTPConnection("127.0.0.1", port)
+        for i in xrange(requests):
+            fetch(conn, "/small/f%d.txt" % (i % 100,))
+        conn.close()
+    threads = [threading.Thread(target=client) for _ in xrange(clients)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return clients * requests / (time.time() - start)
+
+
+def main(argv):
+    parser = optparse.OptionParser()
+    parser.add_option("--requests", type="int", default=1000)
+    parser.add_option("--clients", type="int", default=8)
+    parser.add_option("--size", type="int", default=128 * 1024 * 1024)
+    parser.add_option("--buffer", type="int", action="append", default=[])
+    (options, args) = parser.parse_args(argv)
+    fs = TempFS()
+    fs.makedir("small")
+    for i in xrange(100):
+        fs.setcontents("small/f%d.txt" % (i,), "x" * 1024)
+    fs.setcontents("big.bin", "x" * options.size)
+
+    server = start_server(fs, 256 * 1024)
+    port = server.server_address[1]
+    print "small files, new connections: %8.1f req/sec" % (
+        small_files(port, options.requests, False),)
+    print "small files, keep-alive:      %8.1f req/sec" % (
+        small_files(port, options.requests, True),)
+    print "small files, %3d clients:     %8.1f req/sec" % (
+        options.clients, concurrent(port, options.clients, options.requests // options.clients))
+    server.shutdown()
+    server.server_close()
+
+    for buffer_size in options.buffer or [16 * 1024, 256 * 1024, 1024 * 1024]:
+        server = start_server(fs, buffer_size)
+        conn = httplib.HTTPConnection("127.0.0.1", server.server_address[1])
+        start = time.time()
+        fetch(conn, "/big.bin")
+        mbytes = options.size / (1024.0 * 1024) / (time.time() - start)
+        print "large file, %8d buffer:   %8.1f MB/sec" % (buffer_size, mbytes)
+        conn.close()
+        server.shutdown()
+        server.server_close()
+    fs.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,103 @@
+"""
+
+  benchmarks.bench_importhook:  measure imports through fs.expose.importhook
+
+This writes a package tree of many modules into a ZipFS and a TempFS and
+times importing all of it through an FSImportHook, then failing to find
+as many names again (as happens for every implicit relative import).  It
+does so looking modules up with an isfile() call per suffix, as the hook
+used to, with the directory index, and with the index and a warm bytecode
+cache.  The FS can be given a delay per call, as a remote FS would have,
+and the calls that reach it are counted, e.g.:
+
+    python benchmarks/bench_importhook.py --packages 20 --modules 50 --latency 0.001
+
+"""
+
+import sys
+import imp
+import time
+import optparse
+
+from fs.tempfs import TempFS
+from fs.memoryfs import MemoryFS
+from fs.zipfs import ZipFS
+from fs.expose.importhook import FSImportHook
+
+from benchutil import SlowFS
+
+
+class IsFileImportHook(FSImportHook):
+    """FSImportHook looking for each suffix in turn, without the index."""
+
+    def _find_module_file(self, prefix):
+        for (suffix, mode, type) in imp.get_suffixes():
+            if type in self._VALID_MODULE_TYPES:
+                if self.fs.isfile(prefix + suffix):
+                    return (prefix + suffix, type)
+        return (None, None)
+
+
+SOURCE = "".join("def func%d(a, b=%d):\n    return [a + b * i for i in range(%d)]\n"
+                 % (i, i, i) for i in xrange(50))
+
+
+def fill(fs, packages, modules):
+    for i in xrange(packages):
+        fs.makedir("bench_pkg%d" % (i,))
+        fs.setcontents("bench_pkg%d/__init__.py" % (i,), "")
+        for j in xrange(modules):
+            fs.setcontents("bench_pkg%d/mod%d.py" % (i, j), SOURCE)
+
+
+def run(hook, packages, modules):
+    names = ["bench_pkg%d.mod%d" % (i, j) for i in xrange(packages)
+                                         for j in xrange(modules)]
+    sys.meta_path.insert(0, hook)
+    start = time.time()
+    try:
+        for name in names:
+            __import__(name)
+        for name in names:
+            assert hook.find_module(name + "x") is None
+    finally:
+        sys.meta_path.remove(hook)
+        for name in sys.modules.keys():
+            if name.startswith("bench_pkg"):
+                del sys.modules[name]
+    return time.time() - start
+
+
+def main(argv):
+    parser = optparse.OptionParser()
+    parser.add_option("--packages", type="int", default=20)
+    parser.add_option("--modules", type="int", default=50)
+    parser.add_option("--latency", type="float", default=0.0)
+    (options, args) = parser.parse_args(argv)
+    tmp = TempFS()
+    zip_path = tmp.getsyspath("bench.zip")
+    zfs = ZipFS(zip_path, "w")
+    fill(zfs, options.packages, options.modules)
+    zfs.close()
+    tempfs = TempFS()
+    fill(tempfs, options.packages, options.modules)
+    print "%10s %16s %10s %10s" % ("fs", "lookup", "ms", "calls")
+    for (name, base_fs) in (("zipfs", ZipFS(zip_path, "r")), ("tempfs", tempfs)):
+        fs = SlowFS(base_fs, options.latency,
+                    ("isfile", "getinfo", "listdirinfo", "getcontents"))
+        cache = MemoryFS()
+        #  The first run with the cache fills it, the second uses it.
+        for (lookup, hook) in (("isfile", IsFileImportHook(fs)),
+                               ("index", FSImportHook(fs)),
+                               ("index+bytecode", FSImportHook(fs, bytecode_fs=cache)),
+                               ("index+bytecode", FSImportHook(fs, bytecode_fs=cache))):
+            calls = fs.total_calls()
+            elapsed = run(hook, options.packages, options.modules)
+            print "%10s %16s %10.1f %10d" % (name, lookup, elapsed * 1000,
+                                             fs.total_calls() - calls)
+        fs.close()
+    tmp.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,88 @@
+"""
+
+  benchmarks.bench_importhook_startup:  measure startup from an FS bundle
+
+This writes a large package tree into zip files, one with just the sources
+and one also holding a bundle made by fs.expose.importhook.make_bundle(),
+and times a fresh interpreter putting each on sys.path through
+FSImportHook and importing every module.  The time for an interpreter that
+only installs the hook is given for comparison, e.g.:
+
+    python benchmarks/bench_importhook_startup.py --packages 50 --modules 40
+
+"""
+
+import os
+import sys
+import time
+import optparse
+import subprocess
+
+from fs.tempfs import TempFS
+from fs.zipfs import ZipFS
+from fs.expose.importhook import make_bundle
+
+
+SOURCE = "".join("def func%d(a, b=%d):\n    return [a + b * i for i in range(%d)]\n"
+                 % (i, i, i) for i in xrange(50))
+
+SCRIPT = """
+import sys
+from fs.expose.importhook import FSImportHook
+FSImportHook.install()
+sys.path.insert(0, "zip://" + sys.argv[1])
+for name in sys.argv[2:]:
+    __import__(name)
+"""
+
+
+def fill(fs, packages, modules):
+    for i in xrange(packages):
+        fs.makedir("bench_pkg%d" % (i,))
+        fs.setcontents("bench_pkg%d/__init__.py" % (i,), "from bench_pkg%d import mod0\n" % (i,))
+        for j in xrange(modules):
+            fs.setcontents("bench_pkg%d/mod%d.py" % (i, j), SOURCE)
+
+
+def startup(zip_path, names, repeat):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(sys.path)
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        subprocess.check_call([sys.executable, "-c", SCRIPT, zip_path] + names, env=env)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(argv):
+    parser = optparse.OptionParser()
+    parser.add_option("--packages", type="int", default=50)
+    parser.add_option("--modules", type="int", default=40)
+    parser.add_option("--repeat", type="int", default=5)
+    (options, args) = parser.parse_args(argv)
+    tmp = TempFS()
+    src = TempFS()
+    fill(src, options.packages, options.modules)
+    plain_path = tmp.getsyspath("plain.zip")
+    zfs = ZipFS(plain_path, "w")
+    fill(zfs, options.packages, options.modules)
+    zfs.close()
+    bundle_path = tmp.getsyspath("bundle.zip")
+    make_bundle(src, ZipFS(bundle_path, "w")).close()
+    names = ["bench_pkg%d.mod%d" % (i, j) for i in xrange(options.packages)
+                                         for j in xrange(options.modules)]
+    print "%10s %10s %10s" % ("zip", "modules", "ms")
+    for (name, zip_path, imported) in (("none", plain_path, []),
+                                       ("sources", plain_path, names),
+                                       ("bundle", bundle_path, names)):
+        elapsed = startup(zip_path, imported, options.repeat)
+        print "%10s %10d %10.1f" % (name, len(imported), elapsed * 1000)
+    src.close()
+    tmp.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,85 @@
+"""
+
+  benchmarks.bench_packetstream:  measure fs.expose.serve.packetstream speed
+
+This encodes a stream of packets with the given header and payload sizes,
+then times feeding it through a Decoder in socket-sized chunks and reports
+the throughput in MB/sec and packets/sec, e.g.:
+
+    python benchmarks/bench_packetstream.py --payload 0 --payload 65536
+
+"""
+
+import sys
+import time
+import optparse
+
+from fs.expose.serve import packetstream
+
+
+def make_stream(num_packets, header_size, payload_size):
+    header = "h" * header_size
+    payload = "p" * payload_size
+    packet = "".join(packetstream.encode_vector(header, payload))
+    return "pyfs/1.0\n" + packet * num_packets
+
+
+def bench_decode(stream, chunk_size, repeat):
+    chunks = [stream[i:i+chunk_size] for i in xrange(0, len(stream), chunk_size)]
+    best = None
+    for _ in xrange(repeat):
+        decoder = packetstream.Decoder()
+        count = 0
+        start = time.time()
+        for chunk in chunks:
+            for packet in decoder.feed(chunk):
+                count += 1
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return (count, best)
+
+
+def bench_encode(num_packets, header_size, payload_size, repeat):
+    header = "h" * header_size
+    payload = "p" * payload_size
+    encode_vector = packetstream.encode_vector
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        for _ in xrange(num_packets):
+            encode_vector(header, payload)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(argv):
+    parser = optparse.OptionParser()
+    parser.add_option("--payload", type="int", action="append", default=[])
+    parser.add_option("--header", type="int", default=60)
+    parser.add_option("--chunk", type="int", default=64 * 1024)
+    parser.add_option("--megabytes", type="int", default=64)
+    parser.add_option("--repeat", type="int", default=3)
+    (options, args) = parser.parse_args(argv)
+    payload_sizes = options.payload or [0, 100, 4096, 65536, 1024 * 1024]
+    print "%10s %10s %10s %12s %10s %12s" % ("payload", "packets", "dec MB/s",
+                                             "dec pkt/s", "enc MB/s", "enc pkt/s")
+    for payload_size in payload_sizes:
+        packet_size = options.header + payload_size
+        num_packets = max(options.megabytes * 1024 * 1024 // packet_size, 1)
+        num_packets = min(num_packets, 500000)
+        stream = make_stream(num_packets, options.header, payload_size)
+        mbytes = len(stream) / (1024.0 * 1024)
+        (count, elapsed) = bench_decode(stream, options.chunk, options.repeat)
+        assert count == num_packets
+        enc_elapsed = bench_encode(num_packets, options.header, payload_size,
+                                   options.repeat)
+        print "%10d %10d %10.1f %12.0f %10.1f %12.0f" % (
+            payload_size, num_packets, mbytes / elapsed, num_packets / elapsed,
+            mbytes / enc_elapsed, num_packets / enc_elapsed)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
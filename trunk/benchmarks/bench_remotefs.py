@@ -0,0 +1,90 @@
+"""
+
+  benchmarks.bench_remotefs:  compare RemoteFS with RPCFS
+
+This serves the same MemoryFS both with fs.expose.serve (accessed through
+fs.remotefs.RemoteFS) and with the threaded XML-RPC server (accessed through
+fs.rpcfs.RPCFS), then has several threads read and write files through each
+and compares their throughput, e.g.:
+
+    python benchmarks/bench_remotefs.py --threads 1 --threads 8 --size 1048576
+
+"""
+
+import sys
+import time
+import threading
+import optparse
+
+from fs.memoryfs import MemoryFS
+from fs.remotefs import RemoteFS
+from fs.rpcfs import RPCFS
+from fs.expose.serve.server import Server
+from fs.expose.xmlrpc import ThreadedRPCFSServer
+
+
+def start_servers(fs):
+    serve_server = Server("127.0.0.1", 0, fs=fs)
+    serve_server.listen()
+    rpc_server = ThreadedRPCFSServer(fs, ("127.0.0.1", 0), logRequests=False)
+    threads = []
+    for server in (serve_server, rpc_server):
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    return (serve_server, rpc_server, threads[0])
+
+
+def run(fs, num_threads, num_files, file_size):
+    data = "x" * file_size
+    def worker(n):
+        dirpath = "/bench%d" % (n,)
+        fs.makedir(dirpath, allow_recreate=True)
+        for i in xrange(num_files):
+            path = "%s/file%d" % (dirpath, i)
+            with fs.open(path, "wb") as f:
+                f.write(data)
+            with fs.open(path, "rb") as f:
+                f.read()
+            fs.getinfo(path)
+        fs.removedir(dirpath, force=True)
+    threads = [threading.Thread(target=worker, args=(n,))
+               for n in xrange(num_threads)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    ops = num_threads * num_files * 3
+    mbytes = num_threads * num_files * file_size * 2 / (1024.0 * 1024)
+    return (elapsed, ops / elapsed, mbytes / elapsed)
+
+
+def main(argv):
+    parser = optparse.OptionParser()
+    parser.add_option("--threads", type="int", action="append", default=[])
+    parser.add_option("--files", type="int", default=20)
+    parser.add_option("--size", type="int", default=64 * 1024)
+    (options, args) = parser.parse_args(argv)
+    thread_counts = options.threads or [1, 4, 16]
+    (serve_server, rpc_server, serve_thread) = start_servers(MemoryFS())
+    clients = [("remotefs", RemoteFS("127.0.0.1", serve_server.port)),
+               ("rpcfs", RPCFS("http://%s:%d" % rpc_server.server_address))]
+    print "%8s %8s %8s %10s %8s" % ("client", "threads", "secs", "ops/sec", "MB/sec")
+    for (name, fs) in clients:
+        for num_threads in thread_counts:
+            (elapsed, ops, mbytes) = run(fs, num_threads, options.files,
+                                         options.size)
+            print "%8s %8d %8.2f %10.1f %8.2f" % (name, num_threads,
+                                                  elapsed, ops, mbytes)
+        fs.close()
+    serve_server.shutdown()
+    serve_thread.join()
+    rpc_server.serve_more_requests = False
+    rpc_server.server_close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
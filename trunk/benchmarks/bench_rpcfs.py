@@ -0,0 +1,93 @@
+"""
+
+  benchmarks.bench_rpcfs:  measure throughput of RPCFS under load
+
+This starts a local XML-RPC server (fs.expose.xmlrpc) exposing a MemoryFS,
+then has many threads, each with its own RPCFS client, read and write files
+and list directories concurrently.  Compare the single-threaded server with
+the threaded keep-alive one, with and without gzip, e.g.:
+
+    python benchmarks/bench_rpcfs.py --server simple --server threaded
+    python benchmarks/bench_rpcfs.py --clients 32 --no-compress
+
+"""
+
+import sys
+import time
+import threading
+import optparse
+
+from fs.memoryfs import MemoryFS
+from fs.rpcfs import RPCFS
+from fs.expose.xmlrpc import RPCFSServer, ThreadedRPCFSServer
+
+
+def start_server(kind, compress, max_workers):
+    if kind == "threaded":
+        server = ThreadedRPCFSServer(MemoryFS(), ("127.0.0.1", 0),
+                                     logRequests=False, compress=compress,
+                                     max_workers=max_workers)
+    else:
+        server = RPCFSServer(MemoryFS(), ("127.0.0.1", 0),
+                             logRequests=False, compress=compress)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def run(server, num_clients, num_files, file_size, compress):
+    uri = "http://%s:%d" % server.server_address
+    data = "x" * file_size
+    def worker(n):
+        fs = RPCFS(uri, compress=compress)
+        dirpath = "/bench%d" % (n,)
+        fs.makedir(dirpath, allow_recreate=True)
+        for i in xrange(num_files):
+            path = "%s/file%d" % (dirpath, i)
+            fs.setcontents(path, data)
+            fs.getcontents(path, "rb")
+            fs.getinfo(path)
+        fs.listdirinfo(dirpath)
+        fs.removedir(dirpath, force=True)
+        fs.close()
+    threads = [threading.Thread(target=worker, args=(n,))
+               for n in xrange(num_clients)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    ops = num_clients * num_files * 3
+    mbytes = num_clients * num_files * file_size * 2 / (1024.0 * 1024)
+    return (elapsed, ops / elapsed, mbytes / elapsed)
+
+
+def main(argv):
+    parser = optparse.OptionParser()
+    parser.add_option("--server", action="append", default=[],
+                      choices=["simple", "threaded"])
+    parser.add_option("--clients", type="int", action="append", default=[])
+    parser.add_option("--files", type="int", default=20)
+    parser.add_option("--size", type="int", default=64 * 1024)
+    parser.add_option("--workers", type="int", default=16)
+    parser.add_option("--no-compress", action="store_false", dest="compress",
+                      default=True)
+    (options, args) = parser.parse_args(argv)
+    kinds = options.server or ["simple", "threaded"]
+    client_counts = options.clients or [1, 4, 16]
+    print "%8s %8s %8s %10s %8s" % ("server", "clients", "secs", "ops/sec", "MB/sec")
+    for kind in kinds:
+        server = start_server(kind, options.compress, options.workers)
+        for num_clients in client_counts:
+            (elapsed, ops, mbytes) = run(server, num_clients, options.files,
+                                         options.size, options.compress)
+            print "%8s %8d %8.2f %10.1f %8.2f" % (kind, num_clients,
+                                                  elapsed, ops, mbytes)
+        server.serve_more_requests = False
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
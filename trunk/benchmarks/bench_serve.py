@@ -0,0 +1,90 @@
+"""
+
+  benchmarks.bench_serve:  compare fs.expose.serve server modes
+
+This opens many idle connections to a Server (a thread per connection) and
+to an EventLoopServer (one thread for all connections), then has a number
+of busy RemoteFS clients read and write small files through each, and
+reports their throughput and the number of threads running, e.g.:
+
+    python benchmarks/bench_serve.py --idle 5000 --busy 100
+
+"""
+
+import sys
+import time
+import socket
+import resource
+import threading
+import optparse
+
+from fs.memoryfs import MemoryFS
+from fs.remotefs import RemoteFS
+from fs.expose.serve.server import Server, EventLoopServer
+
+
+def raise_file_limit(num_files):
+    (soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < num_files:
+        if hard != resource.RLIM_INFINITY:
+            num_files = min(num_files, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (num_files, hard))
+
+
+def run(server_class, num_idle, num_busy, num_ops, file_size):
+    server = server_class("127.0.0.1", 0, fs=MemoryFS())
+    server.listen()
+    serve_thread = threading.Thread(target=server.serve_forever)
+    serve_thread.start()
+    start = time.time()
+    idle = [socket.create_connection(("127.0.0.1", server.port))
+            for _ in xrange(num_idle)]
+    connect_time = time.time() - start
+    clients = [RemoteFS("127.0.0.1", server.port) for _ in xrange(num_busy)]
+    threads_used = threading.active_count()
+    data = "x" * file_size
+    def worker(n, fs):
+        path = "/file%d" % (n,)
+        for i in xrange(num_ops // 3):
+            fs.setcontents(path, data)
+            fs.getcontents(path)
+            fs.getinfo(path)
+    workers = [threading.Thread(target=worker, args=(n, fs))
+               for (n, fs) in enumerate(clients)]
+    start = time.time()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.time() - start
+    for fs in clients:
+        fs.close()
+    for sock in idle:
+        sock.close()
+    server.shutdown()
+    serve_thread.join()
+    ops = num_busy * (num_ops // 3) * 3
+    return (connect_time, threads_used, elapsed, ops / elapsed)
+
+
+def main(argv):
+    parser = optparse.OptionParser()
+    parser.add_option("--idle", type="int", default=2000)
+    parser.add_option("--busy", type="int", default=100)
+    parser.add_option("--ops", type="int", default=60)
+    parser.add_option("--size", type="int", default=4096)
+    (options, args) = parser.parse_args(argv)
+    raise_file_limit(2 * (options.idle + options.busy) + 100)
+    print "%10s %8s %8s %10s %8s %8s %10s" % ("server", "idle", "busy", "connect s",
+                                             "threads", "secs", "ops/sec")
+    for (name, server_class) in (("threaded", Server), ("eventloop", EventLoopServer)):
+        (connect_time, threads, elapsed, ops) = run(server_class, options.idle,
+                                                    options.busy, options.ops,
+                                                    options.size)
+        print "%10s %8d %8d %10.2f %8d %8.2f %10.1f" % (name, options.idle,
+                                                      options.busy, connect_time,
+                                                      threads, elapsed, ops)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,110 @@
+"""
+
+  benchmarks.bench_sftp:  measure fs.expose.sftp serving
+
+This serves a MemoryFS and a TempFS with fs.expose.sftp.BaseSFTPServer and,
+through an SFTPFS client, times listing a large directory, listing it and
+then getting the info of every entry, and reading a large file with the
+client's pipelined reads.  Each is run with the server's attribute cache
+and read-ahead switched off and on.  The served FS can be given a delay
+per call, as a remote FS would have, and the calls that reach it are
+counted, e.g.:
+
+    python benchmarks/bench_sftp.py --entries 5000 --size 67108864 --latency 0.001
+
+"""
+
+import sys
+import time
+import logging
+import threading
+import optparse
+
+from fs.tempfs import TempFS
+from fs.memoryfs import MemoryFS
+from fs.sftpfs import SFTPFS
+from fs.expose import sftp
+
+from benchutil import SlowFS
+
+
+def start_server(fs, attr_timeout, read_ahead):
+    class RequestHandler(sftp.SFTPRequestHandler):
+        def setup(self):
+            sftp.SFTPRequestHandler.setup(self)
+            self.transport.set_subsystem_handler("sftp", sftp.SFTPServer,
+                                                 sftp.SFTPServerInterface, fs,
+                                                 attr_timeout=attr_timeout,
+                                                 read_ahead=read_ahead)
+    server = sftp.BaseSFTPServer(("127.0.0.1", 0), fs,
+                                 RequestHandlerClass=RequestHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def fill(fs, entries, size):
+    fs.makedir("big")
+    for i in xrange(entries):
+        fs.setcontents("big/file%06d.txt" % (i,), "x" * (i % 100))
+    fs.setcontents("large.bin", "x" * size)
+
+
+def timed(func):
+    start = time.time()
+    func()
+    return time.time() - start
+
+
+def run(fs, attr_timeout, read_ahead, size):
+    server = start_server(fs, attr_timeout, read_ahead)
+    client = SFTPFS(server.server_address, no_auth=True)
+    results = []
+    def stat_all():
+        for name in client.listdir("big"):
+            client.getinfo("big/" + name)
+    def read():
+        f = client.open("large.bin", "rb-")
+        try:
+            while f.read(1024 * 1024):
+                pass
+        finally:
+            f.close()
+    try:
+        for func in (lambda: client.listdirinfo("big"), stat_all, read):
+            calls = fs.total_calls()
+            results.append((timed(func), fs.total_calls() - calls))
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def main(argv):
+    parser = optparse.OptionParser()
+    parser.add_option("--entries", type="int", default=5000)
+    parser.add_option("--size", type="int", default=64 * 1024 * 1024)
+    parser.add_option("--latency", type="float", default=0.0)
+    (options, args) = parser.parse_args(argv)
+    logging.getLogger("paramiko").setLevel(logging.ERROR)
+    print "%10s %8s %18s %18s %18s" % ("fs", "caching", "listdir ms/calls",
+                                       "list+stat ms/calls", "read MB/s/calls")
+    for (name, fs_class) in (("memoryfs", MemoryFS), ("tempfs", TempFS)):
+        for (caching, attr_timeout, read_ahead) in (("off", 0, 0),
+                                                   ("on", 1.0, 256 * 1024)):
+            #  The server closes the FS when the client disconnects.
+            fs = fs_class()
+            fill(fs, options.entries, options.size)
+            fs = SlowFS(fs, options.latency,
+                        ("getinfo", "listdirinfo", "open", "read"))
+            ((listing, listing_calls), (stat, stat_calls),
+             (read, read_calls)) = run(fs, attr_timeout, read_ahead, options.size)
+            print "%10s %8s %11.1f/%-6d %11.1f/%-6d %11.1f/%-6d" % (
+                name, caching, listing * 1000, listing_calls, stat * 1000,
+                stat_calls, options.size / (1024.0 * 1024) / read, read_calls)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,82 @@
+"""
+
+  benchmarks.bench_sftpfs:  measure concurrent throughput of SFTPFS
+
+This starts a local SFTP server (fs.expose.sftp.BaseSFTPServer) exposing a
+MemoryFS, then has several threads read and write files through a single
+SFTPFS instance.  Run it with different thread and transport counts to see
+how well the per-thread channels scale, e.g.:
+
+    python benchmarks/bench_sftpfs.py --threads 1 --threads 8 --transports 4
+
+"""
+
+import sys
+import time
+import threading
+import logging
+import optparse
+
+from fs.memoryfs import MemoryFS
+from fs.sftpfs import SFTPFS
+from fs.expose.sftp import BaseSFTPServer
+
+
+def start_server():
+    server = BaseSFTPServer(("127.0.0.1", 0), MemoryFS())
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def run(server, num_threads, num_transports, num_files, file_size):
+    fs = SFTPFS(server.server_address, no_auth=True,
+                num_transports=num_transports)
+    data = "x" * file_size
+    def worker(n):
+        dirpath = "/bench%d" % (n,)
+        fs.makedir(dirpath, allow_recreate=True)
+        for i in xrange(num_files):
+            path = "%s/file%d" % (dirpath, i)
+            fs.setcontents(path, data)
+            fs.getcontents(path, "rb")
+            fs.getinfo(path)
+        fs.removedir(dirpath, force=True)
+    threads = [threading.Thread(target=worker, args=(n,))
+               for n in xrange(num_threads)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    fs.close()
+    ops = num_threads * num_files * 3
+    mbytes = num_threads * num_files * file_size * 2 / (1024.0 * 1024)
+    return (elapsed, ops / elapsed, mbytes / elapsed)
+
+
+def main(argv):
+    parser = optparse.OptionParser()
+    parser.add_option("--threads", type="int", action="append", default=[])
+    parser.add_option("--transports", type="int", action="append", default=[])
+    parser.add_option("--files", type="int", default=50)
+    parser.add_option("--size", type="int", default=64 * 1024)
+    (options, args) = parser.parse_args(argv)
+    thread_counts = options.threads or [1, 2, 4, 8]
+    transport_counts = options.transports or [1, 4]
+    logging.getLogger("paramiko").setLevel(logging.ERROR)
+    server = start_server()
+    print "%8s %10s %8s %10s %8s" % ("threads", "transports", "secs", "ops/sec", "MB/sec")
+    for num_transports in transport_counts:
+        for num_threads in thread_counts:
+            (elapsed, ops, mbytes) = run(server, num_threads, num_transports,
+                                         options.files, options.size)
+            print "%8d %10d %8.2f %10.1f %8.2f" % (num_threads, num_transports,
+                                                  elapsed, ops, mbytes)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
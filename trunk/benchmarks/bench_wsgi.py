@@ -0,0 +1,99 @@
+"""
+
+  benchmarks.bench_wsgi:  measure fs.expose.wsgi file serving
+
+This serves a file from a TempFS (which has system paths, so whole files go
+through wsgi.file_wrapper) and from a MemoryFS with wsgiref, then times
+downloading the whole file, fetching random ranges of it, and revalidating
+it with If-None-Match.  MemoryFS copies a file's contents to find its size
+in getinfo(), which dominates its per-request times for large files.  E.g.:
+
+    python benchmarks/bench_wsgi.py --size 67108864 --range 65536
+
+"""
+
+import sys
+import time
+import random
+import httplib
+import threading
+import optparse
+import SocketServer
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+
+from fs.tempfs import TempFS
+from fs.memoryfs import MemoryFS
+from fs.expose.wsgi import serve_fs
+
+
+class ThreadingWSGIServer(SocketServer.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def get(port, headers={}):
+    conn = httplib.HTTPConnection("127.0.0.1", port)
+    conn.request("GET", "/data.bin", headers=headers)
+    response = conn.getresponse()
+    size = 0
+    while True:
+        data = response.read(1024 * 1024)
+        if not data:
+            break
+        size += len(data)
+    conn.close()
+    return (response, size)
+
+
+def bench(port, file_size, range_size, requests):
+    start = time.time()
+    (response, size) = get(port)
+    assert size == file_size
+    full = file_size / (1024.0 * 1024) / (time.time() - start)
+    etag = response.getheader("ETag")
+
+    start = time.time()
+    for _ in xrange(requests):
+        offset = random.randint(0, file_size - range_size)
+        (response, size) = get(port, {"Range": "bytes=%d-%d" % (offset, offset + range_size - 1)})
+        assert response.status == 206 and size == range_size
+    ranges = requests / (time.time() - start)
+
+    start = time.time()
+    for _ in xrange(requests):
+        (response, size) = get(port, {"If-None-Match": etag})
+        assert response.status == 304
+    revalidate = requests / (time.time() - start)
+    return (full, ranges, revalidate)
+
+
+def main(argv):
+    parser = optparse.OptionParser()
+    parser.add_option("--size", type="int", default=64 * 1024 * 1024)
+    parser.add_option("--range", type="int", default=64 * 1024)
+    parser.add_option("--requests", type="int", default=200)
+    (options, args) = parser.parse_args(argv)
+    data = "".join(chr(random.getrandbits(8)) for _ in xrange(1024 * 1024))
+    data = (data * (options.size // len(data) + 1))[:options.size]
+    print "%10s %10s %12s %14s" % ("fs", "full MB/s", "ranges/sec", "revalidate/s")
+    for (name, fs) in (("tempfs", TempFS()), ("memoryfs", MemoryFS())):
+        fs.setcontents("data.bin", data)
+        httpd = make_server("127.0.0.1", 0, serve_fs(fs),
+                            server_class=ThreadingWSGIServer,
+                            handler_class=QuietHandler)
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+        (full, ranges, revalidate) = bench(httpd.server_port, options.size,
+                                           options.range, options.requests)
+        print "%10s %10.1f %12.1f %14.1f" % (name, full, ranges, revalidate)
+        httpd.shutdown()
+        fs.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
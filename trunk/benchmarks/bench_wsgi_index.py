@@ -0,0 +1,68 @@
+"""
+
+  benchmarks.bench_wsgi_index:  measure fs.expose.wsgi directory indexes
+
+This fills a directory with many entries and times requesting its index
+page from a WSGIServer: rendered all at once without caching (as every
+request used to be), the first page when nothing is cached, and pages
+served from the listing cache, e.g.:
+
+    python benchmarks/bench_wsgi_index.py --entries 50000
+
+"""
+
+import sys
+import time
+import optparse
+
+from fs.memoryfs import MemoryFS
+from fs.expose.wsgi import serve_fs
+
+from benchutil import SlowFS
+
+
+def request(app, query=""):
+    environ = dict(PATH_INFO="/big", REQUEST_METHOD="GET", QUERY_STRING=query)
+    size = 0
+    for data in app(environ, lambda status, headers: None):
+        size += len(data)
+    return size
+
+
+def timed(app, fs, query="", repeat=1):
+    calls = fs.total_calls()
+    start = time.time()
+    for _ in xrange(repeat):
+        size = request(app, query)
+    return ((time.time() - start) / repeat, size, fs.total_calls() - calls)
+
+
+def main(argv):
+    parser = optparse.OptionParser()
+    parser.add_option("--entries", type="int", default=50000)
+    parser.add_option("--page-size", type="int", default=1000)
+    (options, args) = parser.parse_args(argv)
+    fs = SlowFS(MemoryFS(), 0, ("listdirinfo", "isdir"))
+    fs.makedir("big")
+    for i in xrange(options.entries):
+        if i % 10:
+            fs.setcontents("big/file%06d.txt" % (i,), "")
+        else:
+            fs.makedir("big/dir%06d" % (i,))
+    print "%-24s %10s %12s %10s" % ("request", "ms", "bytes", "fs calls")
+    results = [
+        ("whole, uncached", serve_fs(fs, page_size=0, cache_size=0), "", 1),
+        ("first page, cold", serve_fs(fs, page_size=options.page_size), "", 1),
+    ]
+    cached = results[-1][1]
+    for (name, app, query, repeat) in results:
+        (elapsed, size, calls) = timed(app, fs, query, repeat)
+        print "%-24s %10.1f %12d %10d" % (name, elapsed * 1000, size, calls)
+    for (name, query, repeat) in (("other page, cached list", "page=2", 1),
+                                  ("first page, cached", "", 20)):
+        (elapsed, size, calls) = timed(cached, fs, query, repeat)
+        print "%-24s %10.1f %12d %10d" % (name, elapsed * 1000, size, calls)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,43 @@
+"""
+
+  benchmarks.benchutil:  helpers shared by the benchmarks
+
+The benchmarks run as scripts from the benchmarks directory, so they import
+this module as "benchutil".  It builds on the test helpers in fs.tests, so
+the benchmarks that use it need that package importable as well as fs
+itself.  It is installed along with fs, and needs nothing else.
+
+"""
+
+from fs.filelike import FileWrapper
+from fs.tests import CountingFS
+
+
+class SlowFS(CountingFS):
+    """Wraps an FS, adding a delay to some of its calls and counting them.
+
+    This is fs.tests.CountingFS with the delay given up front.  If "read"
+    is in 'methods', reads from the files it opens are delayed and counted
+    too, as they would be for a remote FS.
+    """
+
+    def __init__(self, fs, latency, methods=("getinfo", "listdirinfo")):
+        super(SlowFS, self).__init__(fs, methods, latency)
+
+    def open(self, path, mode="r", **kwds):
+        f = super(SlowFS, self).open(path, mode, **kwds)
+        if "read" in self.methods:
+            f = SlowFile(self, f)
+        return f
+
+
+class SlowFile(FileWrapper):
+    """Wraps a file opened from a SlowFS, counting reads against it."""
+
+    def __init__(self, owner, f):
+        super(SlowFile, self).__init__(f)
+        self.owner = owner
+
+    def _read(self, size=-1):
+        self.owner._count("read")
+        return super(SlowFile, self)._read(size)
@@ -654,6 +654,36 @@ class FS(object):
         """
         raise UnsupportedError("remove resource")
 
+    def removemany(self, paths, ignore_errors=False):
+        """Remove several files from the filesystem.
+
+        Every path is attempted, even if removing some of them fails.  The
+        default implementation calls :meth:`remove` for each path in turn;
+        filesystems that can remove many files in a single request (such as
+        S3FS) may override it to do so.
+
+        :param paths: an iterable of paths of files to remove
+        :param ignore_errors: if True, files that could not be removed will not
+            raise an error
+        :type ignore_errors: bool
+
+        :returns: a list of (path, error) tuples for the files that could not
+            be removed
+        :raises `fs.errors.FSError`: the error for the first file that could not
+            be removed, once all paths have been attempted (unless `ignore_errors`
+            is True)
+
+        """
+        failures = []
+        for path in paths:
+            try:
+                self.remove(path)
+            except FSError, e:
+                failures.append((path, e))
+        if failures and not ignore_errors:
+            raise failures[0][1]
+        return failures
+
     def removedir(self, path, recursive=False, force=False):
         """Remove a directory from the filesystem
 
@@ -795,6 +825,32 @@ class FS(object):
             if f is not None:
                 f.close()
 
+    def download(self, path, dst_file, chunk_size=1024 * 64):
+        """Writes the contents of a file to a file-like object.
+
+        The data is written to `dst_file` sequentially, so it need not be
+        seekable.  The default implementation reads the file a chunk at a time;
+        filesystems that can fetch a file faster (such as S3FS, with parallel
+        ranged requests) may override it.
+
+        :param path: A path of file to read
+        :param dst_file: A file-like object to write the contents to
+        :param chunk_size: Number of bytes to read at a time
+
+        """
+        f = None
+        try:
+            f = self.open(path, 'rb')
+            read = f.read
+            write = dst_file.write
+            chunk = read(chunk_size)
+            while chunk:
+                write(chunk)
+                chunk = read(chunk_size)
+        finally:
+            if f is not None:
+                f.close()
+
     def _setcontents(self,
                      path,
                      data,
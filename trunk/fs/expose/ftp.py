@@ -13,6 +13,12 @@ $ fsserve -t 'ftp' $HOME
 
 The above will serve your home directory in read-only mode via anonymous FTP on the
 loopback address.
+
+Directory listings are built from a single listdirinfo() call, and each
+session keeps the stat results it has seen for a second or so, so that
+pyftpdlib's per-entry stat() calls don't each reach the FS.  Files that
+have a system path are downloaded straight from the OS file, using
+sendfile() when pyftpdlib can.
 """
 
 import os
@@ -25,7 +31,7 @@ from pyftpdlib import ftpserver
 
 from fs.path import *
 from fs.osfs import OSFS
-from fs.errors import convert_fs_errors
+from fs.errors import convert_fs_errors, FSError
 from fs import iotools
 
 from six import text_type as unicode
@@ -78,10 +84,18 @@ class FTPFS(ftpserver.AbstractedFS):
     encoding = 'utf8'
     "Sets the encoding to use for paths."
 
+    stat_timeout = 1.0
+    "Seconds a stat result is reused for; 0 to disable the cache."
+
+    stat_cache_size = 10000
+    "Most stat results kept by each session."
+
     def __init__(self, fs, root, cmd_channel, encoding=None):
         self.fs = fs
         if encoding is not None:
             self.encoding = encoding
+        # Stat results by path, with the time they expire.
+        self._stat_cache = {}
         super(FTPFS, self).__init__(root, cmd_channel)
 
     def close(self):
@@ -97,10 +111,22 @@ class FTPFS(ftpserver.AbstractedFS):
         except:
             return False
 
+    def open(self, path, mode, **kwargs):
+        if mode == 'rb':
+            # Download straight from the OS file, so sendfile() can be used.
+            if isinstance(path, str):
+                path = path.decode(self.encoding)
+            syspath = self.fs.getsyspath(path, allow_none=True)
+            if syspath is not None:
+                return open(syspath, mode)
+        else:
+            self._stat_cache.clear()
+        return self._open(path, mode, **kwargs)
+
     @convert_fs_errors
     @decode_args
     @iotools.filelike_to_stream
-    def open(self, path, mode, **kwargs):
+    def _open(self, path, mode, **kwargs):
         return self.fs.open(path, mode, **kwargs)
 
     @convert_fs_errors
@@ -129,26 +155,79 @@ class FTPFS(ftpserver.AbstractedFS):
     @convert_fs_errors
     @decode_args
     def mkdir(self, path):
+        self._stat_cache.clear()
         self.fs.makedir(path)
 
     @convert_fs_errors
-    @decode_args
     def listdir(self, path):
-        return map(lambda x: x.encode(self.encoding), self.fs.listdir(path))
+        # Pyftpdlib 1.x wants unicode names back, 0.7.x wants str.
+        if isinstance(path, unicode):
+            return [name for (name, st) in self._listdirinfo(path)]
+        path = path.decode(self.encoding)
+        return [name.encode(self.encoding) for (name, st) in self._listdirinfo(path)]
+
+    def _listdirinfo(self, path):
+        """List a directory as (name, stat) pairs, caching the stats."""
+        listing = []
+        now = time.time()
+        for (name, info) in self.fs.listdirinfo(path):
+            st = self._info_to_stat(pathjoin(path, name), info)
+            listing.append((name, st))
+        if self.stat_timeout > 0:
+            cache = self._stat_cache
+            if len(cache) + len(listing) > self.stat_cache_size:
+                cache.clear()
+            expires = now + self.stat_timeout
+            for (name, st) in listing[:self.stat_cache_size]:
+                cache[pathjoin(path, name)] = (expires, st)
+        return listing
+
+    def _prefetch(self, basedir, listing):
+        """Stat the entries of a listing with one listdirinfo() call."""
+        if len(listing) < 2 or self.stat_timeout <= 0:
+            return
+        if isinstance(basedir, str):
+            basedir = basedir.decode(self.encoding)
+        cache = self._stat_cache
+        now = time.time()
+        for name in listing:
+            if isinstance(name, str):
+                name = name.decode(self.encoding)
+            entry = cache.get(pathjoin(basedir, name))
+            if entry is None or entry[0] < now:
+                break
+        else:
+            return
+        try:
+            self._listdirinfo(basedir)
+        except FSError:
+            # Leave it to stat() to report errors for each entry.
+            pass
+
+    def format_list(self, basedir, listing, ignore_err=True):
+        self._prefetch(basedir, listing)
+        return super(FTPFS, self).format_list(basedir, listing, ignore_err)
+
+    def format_mlsx(self, basedir, listing, perms, facts, ignore_err=True):
+        self._prefetch(basedir, listing)
+        return super(FTPFS, self).format_mlsx(basedir, listing, perms, facts, ignore_err)
 
     @convert_fs_errors
     @decode_args
     def rmdir(self, path):
+        self._stat_cache.clear()
         self.fs.removedir(path)
 
     @convert_fs_errors
     @decode_args
     def remove(self, path):
+        self._stat_cache.clear()
         self.fs.remove(path)
 
     @convert_fs_errors
     @decode_args
     def rename(self, src, dst):
+        self._stat_cache.clear()
         self.fs.rename(src, dst)
 
     @convert_fs_errors
@@ -159,7 +238,21 @@ class FTPFS(ftpserver.AbstractedFS):
     @convert_fs_errors
     @decode_args
     def stat(self, path):
-        info = self.fs.getinfo(path)
+        path = abspath(normpath(path))
+        entry = self._stat_cache.get(path)
+        if entry is not None:
+            if entry[0] >= time.time():
+                return entry[1]
+            del self._stat_cache[path]
+        st = self._info_to_stat(path, self.fs.getinfo(path))
+        if self.stat_timeout > 0:
+            if len(self._stat_cache) >= self.stat_cache_size:
+                self._stat_cache.clear()
+            self._stat_cache[path] = (time.time() + self.stat_timeout, st)
+        return st
+
+    def _info_to_stat(self, path, info):
+        """Build a FakeStat from the info dict for a path."""
         kwargs = {
             'st_size': info.get('size'),
         }
@@ -232,16 +325,32 @@ class FTPFS(ftpserver.AbstractedFS):
         return True
 
 
+class FTPFSDTPHandler(ftpserver.DTPHandler):
+    """
+    A DTPHandler class that only uses sendfile() for OS files.
+    """
+
+    def _use_sendfile(self, producer):
+        if not ftpserver.DTPHandler._use_sendfile(self, producer):
+            return False
+        try:
+            producer.file.fileno()
+        except (AttributeError, EnvironmentError, ValueError, NotImplementedError):
+            return False
+        return True
+
+
 class FTPFSHandler(ftpserver.FTPHandler):
     """
     An FTPHandler class that closes the filesystem when done.
     """
+    dtp_handler = FTPFSDTPHandler
 
     def close(self):
         # Close the FTPFS instance, it will close the pyfs file system.
         if self.fs:
             self.fs.close()
-        super(FTPFSHandler, self).close()
+        ftpserver.FTPHandler.close(self)
 
 
 class FTPFSFactory(object):
@@ -116,13 +116,84 @@ def handle_fs_errors(func):
     return wrapper
 
 
+class _SysFile(object):
+    """Read-only file opened by its system path, read with pread().
+
+    FSOperations.read() calls pread() on any file that has one, without
+    taking the handle's lock, so concurrent reads of one handle don't queue
+    up behind each other.
+    """
+
+    def __init__(self, syspath):
+        self.fd = os.open(syspath, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        self._lock = threading.Lock()
+
+    if hasattr(os, "pread"):
+        def pread(self, size, offset):
+            return os.pread(self.fd, size, offset)
+    else:
+        def pread(self, size, offset):
+            self._lock.acquire()
+            try:
+                os.lseek(self.fd, offset, os.SEEK_SET)
+                return os.read(self.fd, size)
+            finally:
+                self._lock.release()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
 class FSOperations(Operations):
-    """FUSE Operations interface delegating all activities to an FS object."""
+    """FUSE Operations interface delegating all activities to an FS object.
+
+    File attributes are cached for 'attr_timeout' seconds, filled both by
+    getattr() and by the listdirinfo() results of readdir(), and the
+    absence of a file is remembered for 'negative_timeout' seconds.  Any
+    change made through the mount invalidates the affected entries.  Files
+    that haven't changed since they were last opened keep the kernel's page
+    cache.
+
+    Requests from FUSE may arrive on many threads at once.  Each handle has
+    a lock, but reads of files that support positional reads don't need
+    it; files opened read-only that have a system path are read that way.
+    Sequential reads and writes don't seek.
+
+    Adjacent writes to a handle are gathered into a single write of up to
+    'write_buffer_size' bytes, which is passed on when a write doesn't
+    follow on from the last one, when the buffer fills, and before the
+    handle is read, truncated, flushed, synced or released.  Errors from a
+    buffered write are reported by whichever of those passed it on.  A
+    'write_buffer_size' of zero writes everything straight through.
+    """
 
-    def __init__(self, fs, on_init=None, on_destroy=None):
+    def __init__(self, fs, on_init=None, on_destroy=None, attr_timeout=1.0, negative_timeout=0.0, write_buffer_size=1024*1024):
         self.fs = fs
         self._on_init = on_init
         self._on_destroy = on_destroy
+        self.attr_timeout = attr_timeout
+        self.negative_timeout = negative_timeout
+        self.write_buffer_size = write_buffer_size
+        #  Cached stat dicts (or None for missing files) and their expiry
+        #  times, indexed by path.
+        self._attr_cache = {}
+        self._attr_lock = threading.Lock()
+        #  The (size, mtime) of each file when it was last opened, to tell
+        #  whether the kernel's cached pages for it are still good.
+        self._open_stamps = {}
+        #  Handles that have been written to.
+        self._written = set()
+        #  The offset each handle's file was left at by the last read or
+        #  write, so sequential requests needn't seek.
+        self._positions = {}
+        #  Writes not yet passed on to each handle's file, as an
+        #  (offset, list of strings, total size) tuple.
+        self._pending = {}
         self._files_by_handle = {}
         self._files_lock = threading.Lock()
         self._next_handle = 1
@@ -156,12 +227,47 @@ class FSOperations(Operations):
         self._files_lock.acquire()
         try:
             (f,path,lock) = self._files_by_handle.pop(fh.fh)
+            self._positions.pop(fh.fh, None)
+            self._pending.pop(fh.fh, None)
             del self._files_size_written[path][fh.fh]
             if not self._files_size_written[path]:
                 del self._files_size_written[path]
         finally:
             self._files_lock.release()
 
+    def _flush_pending(self, fh, file):
+        """Pass on the writes buffered for handle number fh.
+
+        The handle's lock must be held.
+        """
+        pending = self._pending.pop(fh, None)
+        if pending is not None:
+            (offset, chunks, size) = pending
+            if self._positions.get(fh) != offset:
+                self._positions.pop(fh, None)
+                file.seek(offset)
+            if len(chunks) == 1:
+                file.write(chunks[0])
+            else:
+                file.write("".join(chunks))
+            self._positions[fh] = offset + size
+
+    def _flush_path(self, path, skip=None):
+        """Pass on the writes buffered for any handle open on a path."""
+        self._files_lock.acquire()
+        try:
+            handles = [(fh, f, lock) for (fh, (f, p, lock)) in self._files_by_handle.iteritems()
+                       if p == path and fh in self._pending and fh != skip]
+        finally:
+            self._files_lock.release()
+        for (fh, file, lock) in handles:
+            lock.acquire()
+            try:
+                self._flush_pending(fh, file)
+                file.flush()
+            finally:
+                lock.release()
+
     def init(self, conn):
         if self._on_init:
             self._on_init()
@@ -170,6 +276,72 @@ class FSOperations(Operations):
         if self._on_destroy:
             self._on_destroy()
 
+    def _get_cached_attrs(self, path):
+        """Get the cached stat dict for a path, or None if not cached."""
+        with self._attr_lock:
+            try:
+                (expires, info) = self._attr_cache[path]
+            except KeyError:
+                return None
+            if expires < time.time():
+                self._attr_cache.pop(path, None)
+                return None
+        if info is None:
+            raise ResourceNotFoundError(path)
+        return info
+
+    def _cache_attrs(self, path, info, now=None):
+        if now is None:
+            now = time.time()
+        with self._attr_lock:
+            if info is None:
+                if self.negative_timeout > 0:
+                    self._attr_cache[path] = (now + self.negative_timeout, None)
+            elif self.attr_timeout > 0:
+                self._attr_cache[path] = (now + self.attr_timeout, info)
+
+    def _invalidate(self, path, recursive=False):
+        """Forget cached attributes of a path and its parent directory.
+
+        If 'recursive' is true, everything below the path is forgotten too.
+        """
+        path = abspath(path)
+        with self._attr_lock:
+            self._open_stamps.pop(path, None)
+            self._attr_cache.pop(path, None)
+            self._attr_cache.pop(dirname(path), None)
+            if recursive:
+                prefix = path.rstrip("/") + "/"
+                for cache in (self._attr_cache, self._open_stamps):
+                    for p in [p for p in cache if p.startswith(prefix)]:
+                        cache.pop(p, None)
+
+    def _keep_cache(self, path):
+        """Check whether the kernel can keep its cached pages of a file.
+
+        This asks the FS rather than the attribute cache, which could hide
+        a change.  Pages are only kept if the file's modified time is known
+        to below a second, so that a change of the same size is noticed.
+        """
+        try:
+            info = self.fs.getinfo(path)
+        except FSError:
+            return 0
+        mtime = info.get("st_mtime")
+        if mtime is None and info.get("modified_time") is not None:
+            modified_time = info["modified_time"]
+            mtime = time.mktime(modified_time.timetuple()) + modified_time.microsecond / 1e6
+        self._fill_stat_dict(path, info)
+        self._cache_attrs(path, info)
+        if mtime is None or mtime == int(mtime):
+            stamp = None
+        else:
+            stamp = (info.get("st_size"), mtime)
+        with self._attr_lock:
+            keep = stamp is not None and self._open_stamps.get(path) == stamp
+            self._open_stamps[path] = stamp
+        return int(keep)
+
     @handle_fs_errors
     def chmod(self, path, mode):
         raise UnsupportedError("chmod")
@@ -186,6 +358,7 @@ class FSOperations(Operations):
         # Go with the most permissive option.
         mode = flags_to_mode(fi.flags)
         fh = self._reg_file(self.fs.open(path, mode), path)
+        self._invalidate(path)
         fi.fh = fh
         fi.keep_cache = 0
 
@@ -194,14 +367,20 @@ class FSOperations(Operations):
         (file, _, lock) = self._get_file(fh)
         lock.acquire()
         try:
+            self._flush_pending(fh.fh, file)
             file.flush()
         finally:
             lock.release()
 
+    @handle_fs_errors
+    def fsync(self, path, datasync, fh):
+        return self.flush(path, fh)
+
     @handle_fs_errors
     def getattr(self, path, fh=None):
-        attrs = self._get_stat_dict(path.decode(NATIVE_ENCODING))
-        return attrs
+        path = path.decode(NATIVE_ENCODING)
+        attrs = self._get_stat_dict(path)
+        return self._with_written_size(path, attrs)
 
     @handle_fs_errors
     def getxattr(self, path, name, position=0):
@@ -235,6 +414,7 @@ class FSOperations(Operations):
             self.fs.makedir(path, recursive=True)
         except TypeError:
             self.fs.makedir(path)
+        self._invalidate(path)
 
     @handle_fs_errors
     def mknod(self, path, mode, dev):
@@ -244,17 +424,41 @@ class FSOperations(Operations):
     def open(self, path, fi):
         path = path.decode(NATIVE_ENCODING)
         mode = flags_to_mode(fi.flags)
-        fi.fh = self._reg_file(self.fs.open(path, mode), path)
-        fi.keep_cache = 0
+        f = None
+        if self._pending:
+            self._flush_path(path)
+        if "w" in mode or "a" in mode or "+" in mode:
+            self._invalidate(path)
+            keep_cache = 0
+        else:
+            keep_cache = self._keep_cache(path)
+            syspath = self.fs.getsyspath(path, allow_none=True)
+            if syspath is not None:
+                try:
+                    f = _SysFile(syspath)
+                except OSError:
+                    pass
+        if f is None:
+            f = self.fs.open(path, mode)
+        fi.fh = self._reg_file(f, path)
+        fi.keep_cache = keep_cache
         return 0
 
     @handle_fs_errors
     def read(self, path, size, offset, fh):
-        (file, _, lock) = self._get_file(fh)
+        (file, path, lock) = self._get_file(fh)
+        if self._pending:
+            self._flush_path(path, skip=fh.fh)
+        pread = getattr(file, "pread", None)
+        if pread is not None:
+            return pread(size, offset)
         lock.acquire()
         try:
-            file.seek(offset)
+            self._flush_pending(fh.fh, file)
+            if self._positions.get(fh.fh) != offset:
+                file.seek(offset)
             data = file.read(size)
+            self._positions[fh.fh] = offset + len(data)
             return data
         finally:
             lock.release()
@@ -263,8 +467,11 @@ class FSOperations(Operations):
     def readdir(self, path, fh=None):
         path = path.decode(NATIVE_ENCODING)
         entries = ['.', '..']
+        now = time.time()
         for (nm, info) in self.fs.listdirinfo(path):
-            self._fill_stat_dict(pathjoin(path, nm), info)
+            entry_path = pathjoin(path, nm)
+            self._fill_stat_dict(entry_path, info)
+            self._cache_attrs(entry_path, dict(info), now)
             entries.append((nm.encode(NATIVE_ENCODING), info, 0))
         return entries
 
@@ -274,11 +481,18 @@ class FSOperations(Operations):
 
     @handle_fs_errors
     def release(self, path, fh):
-        (file, _, lock) = self._get_file(fh)
+        (file, path, lock) = self._get_file(fh)
         lock.acquire()
         try:
-            file.close()
-            self._del_file(fh)
+            try:
+                self._flush_pending(fh.fh, file)
+                file.close()
+            finally:
+                self._del_file(fh)
+                if fh.fh in self._written:
+                    #  Sizes and times may change as buffered writes land.
+                    self._written.discard(fh.fh)
+                    self._invalidate(path)
         finally:
             lock.release()
 
@@ -296,17 +510,22 @@ class FSOperations(Operations):
         old = old.decode(NATIVE_ENCODING)
         new = new.decode(NATIVE_ENCODING)
         try:
-            self.fs.rename(old, new)
-        except FSError:
-            if self.fs.isdir(old):
-                self.fs.movedir(old, new)
-            else:
-                self.fs.move(old, new)
+            try:
+                self.fs.rename(old, new)
+            except FSError:
+                if self.fs.isdir(old):
+                    self.fs.movedir(old, new)
+                else:
+                    self.fs.move(old, new)
+        finally:
+            self._invalidate(old, recursive=True)
+            self._invalidate(new, recursive=True)
 
     @handle_fs_errors
     def rmdir(self, path):
         path = path.decode(NATIVE_ENCODING)
         self.fs.removedir(path)
+        self._invalidate(path, recursive=True)
 
     @handle_fs_errors
     def setxattr(self, path, name, value, options, position=0):
@@ -324,6 +543,8 @@ class FSOperations(Operations):
     @handle_fs_errors
     def truncate(self, path, length, fh=None):
         path = path.decode(NATIVE_ENCODING)
+        if fh is None:
+            self._flush_path(path)
         if fh is None and length == 0:
             self.fs.open(path, "wb").close()
         else:
@@ -338,7 +559,9 @@ class FSOperations(Operations):
                 try:
                     if not hasattr(file, "truncate"):
                         raise UnsupportedError("truncate")
+                    self._flush_pending(fh.fh, file)
                     file.truncate(length)
+                    self._positions.pop(fh.fh, None)
                 finally:
                     lock.release()
         self._files_lock.acquire()
@@ -352,11 +575,13 @@ class FSOperations(Operations):
                     size_written[k] = length
         finally:
             self._files_lock.release()
+        self._invalidate(path)
 
     @handle_fs_errors
     def unlink(self, path):
         path = path.decode(NATIVE_ENCODING)
         self.fs.remove(path)
+        self._invalidate(path)
 
     @handle_fs_errors
     def utimens(self, path, times=None):
@@ -367,14 +592,27 @@ class FSOperations(Operations):
         if modified_time is not None:
             modified_time = datetime.datetime.fromtimestamp(modified_time)
         self.fs.settimes(path, accessed_time, modified_time)
+        self._invalidate(path)
 
     @handle_fs_errors
     def write(self, path, data, offset, fh):
         (file, path, lock) = self._get_file(fh)
         lock.acquire()
         try:
-            file.seek(offset)
-            file.write(data)
+            pending = self._pending.get(fh.fh)
+            if pending is not None and pending[0] + pending[2] == offset:
+                (start, chunks, size) = pending
+                chunks.append(data)
+                self._pending[fh.fh] = (start, chunks, size + len(data))
+            else:
+                self._flush_pending(fh.fh, file)
+                self._pending[fh.fh] = (offset, [data], len(data))
+            if self._pending[fh.fh][2] >= self.write_buffer_size:
+                self._flush_pending(fh.fh, file)
+            self._written.add(fh.fh)
+            with self._attr_lock:
+                self._open_stamps.pop(path, None)
+                self._attr_cache.pop(path, None)
             if self._files_size_written[path][fh.fh] < offset + len(data):
                 self._files_size_written[path][fh.fh] = offset + len(data)
             return len(data)
@@ -382,9 +620,32 @@ class FSOperations(Operations):
             lock.release()
 
     def _get_stat_dict(self, path):
-        """Build a 'stat' dictionary for the given file."""
-        info = self.fs.getinfo(path)
+        """Build a 'stat' dictionary for the given file.
+
+        The result comes from the attribute cache if possible, and must not
+        be modified.
+        """
+        info = self._get_cached_attrs(path)
+        if info is not None:
+            return info
+        try:
+            info = self.fs.getinfo(path)
+        except ResourceNotFoundError:
+            self._cache_attrs(path, None)
+            raise
         self._fill_stat_dict(path, info)
+        self._cache_attrs(path, info)
+        return info
+
+    def _with_written_size(self, path, info):
+        """Get a copy of 'info' reflecting writes that haven't landed yet."""
+        info = dict(info)
+        try:
+            written_sizes = self._files_size_written[path]
+        except KeyError:
+            pass
+        else:
+            info["st_size"] = max(written_sizes.values() + [info["st_size"]])
         return info
 
     def _fill_stat_dict(self, path, info):
@@ -402,14 +663,18 @@ class FSOperations(Operations):
         info.setdefault("st_blksize", 1024)
         info.setdefault("st_blocks", 1)
         #  The interesting stuff
+        isdir = None
         if 'st_mode' not in info:
-            if self.fs.isdir(path):
+            isdir = self.fs.isdir(path)
+            if isdir:
                 info['st_mode'] = 0755
             else:
                 info['st_mode'] = 0666
         mode = info['st_mode']
         if not statinfo.S_ISDIR(mode) and not statinfo.S_ISREG(mode):
-            if self.fs.isdir(path):
+            if isdir is None:
+                isdir = self.fs.isdir(path)
+            if isdir:
                 info["st_mode"] = mode | statinfo.S_IFDIR
                 info.setdefault("st_nlink", 2)
             else:
@@ -421,18 +686,13 @@ class FSOperations(Operations):
                     info[key1] = time.mktime(info[key2].timetuple())
                 else:
                     info[key1] = STARTUP_TIME
-        #  Ensure the reported size reflects any writes performed, even if
-        #  they haven't been flushed to the filesystem yet.
         if "size" in info:
             info["st_size"] = info["size"]
         elif "st_size" not in info:
             info["st_size"] = 0
-        try:
-            written_sizes = self._files_size_written[path]
-        except KeyError:
-            pass
-        else:
-            info["st_size"] = max(written_sizes.values() + [info["st_size"]])
+        #  Ensure the reported size reflects any writes performed, even if
+        #  they haven't been flushed to the filesystem yet.
+        info.update(self._with_written_size(path, info))
         return info
 
 
@@ -454,11 +714,35 @@ def mount(fs, path, foreground=False, ready_callback=None, unmount_callback=None
 
         * nothreads Switch off threading in the FUSE event loop
         * fsname Name to display in the mount info table
+        * big_writes Allow writes larger than 4K (on by default on Linux)
+        * max_write Largest write request, in bytes
+        * max_readahead Most bytes the kernel reads ahead of a reader
+        * direct_io Bypass the kernel's page cache
+        * attr_timeout Seconds file attributes are cached (default 1.0)
+        * entry_timeout Seconds name lookups are cached (default 1.0)
+        * negative_timeout Seconds missing names are cached (default 0)
+        * write_buffer_size Bytes of adjacent writes gathered into one
+          write to the FS (default 1MB, 0 to write straight through)
 
     """
     path = os.path.expanduser(path)
+    if sys.platform.startswith("linux"):
+        #  Without this, the kernel splits writes into 4K requests.
+        kwds.setdefault("big_writes", True)
+    #  Options set to False or None are left out, so defaults can be
+    #  switched off.
+    for (name, value) in kwds.items():
+        if value is False or value is None:
+            del kwds[name]
     if foreground:
-        op = FSOperations(fs, on_init=ready_callback, on_destroy=unmount_callback)
+        #  The kernel's cache timeouts also apply to our own caches.
+        cache_opts = {}
+        for name in ("attr_timeout", "negative_timeout"):
+            if name in kwds:
+                cache_opts[name] = float(kwds[name])
+        if "write_buffer_size" in kwds:
+            cache_opts["write_buffer_size"] = int(kwds.pop("write_buffer_size"))
+        op = FSOperations(fs, on_init=ready_callback, on_destroy=unmount_callback, **cache_opts)
         return FUSE(op, path, raw_fi=True, foreground=foreground, **kwds)
     else:
         mp = MountProcess(fs, path, kwds)
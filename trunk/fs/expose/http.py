@@ -1,9 +1,14 @@
-__all__ = ["serve_fs"]
+__all__ = ["serve_fs", "FSHTTPServer", "FSHTTPRequestHandler"]
 
+import stat
 import SimpleHTTPServer
+import BaseHTTPServer
 import SocketServer
 from fs.path import pathjoin, dirname
 from fs.errors import FSError
+from fs.expose.httputil import http_date, last_modified, make_etag, not_modified, \
+                               if_range_matches, parse_range, content_range, \
+                               make_boundary, multipart_ranges
 from time import mktime
 from cStringIO import StringIO
 import cgi
@@ -18,7 +23,24 @@ def _datetime_to_epoch(d):
 
 class FSHTTPRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
 
-    """A hacked together version of SimpleHTTPRequestHandler"""
+    """A hacked together version of SimpleHTTPRequestHandler
+
+    Speaks HTTP/1.1, so clients can keep connections open between requests,
+    and supports HEAD, conditional GETs (ETag and Last-Modified) and byte
+    ranges.  File data is copied in 'buffer_size' pieces, reading files
+    that have a system path directly rather than through the FS.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    #  Seconds an idle keep-alive connection is kept open.
+    timeout = 30
+
+    #  Headers and body are written separately; don't let Nagle's algorithm
+    #  hold the body back on a kept-alive connection.
+    disable_nagle_algorithm = True
+
+    buffer_size = 256 * 1024
 
     def __init__(self, fs, request, client_address, server):
         self._fs = fs
@@ -26,60 +48,159 @@ class FSHTTPRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
 
     def do_GET(self):
         """Serve a GET request."""
-        f = None
-        try:
-            f = self.send_head()
-            if f:
-                try:
-                    self.copyfile(f, self.wfile)
-                except socket.error:
-                    pass
-        finally:
-            if f is not None:
+        body = self.send_head()
+        if body is not None:
+            (f, parts, closing) = body
+            try:
+                self.copy_parts(f, parts, closing)
+            except socket.error:
+                self.close_connection = 1
+            finally:
                 f.close()
 
+    def do_HEAD(self):
+        """Serve a HEAD request."""
+        body = self.send_head()
+        if body is not None:
+            body[0].close()
+
     def send_head(self):
         """Common code for GET and HEAD commands.
 
         This sends the response code and MIME headers.
 
-        Return value is either a file object (which has to be copied
-        to the outputfile by the caller unless the command was HEAD,
-        and must be closed by the caller under all circumstances), or
-        None, in which case the caller has nothing further to do.
+        Return value is either a tuple (f, parts, closing), or None, in
+        which case the caller has nothing further to do.  'parts' is a list
+        of (header, start, stop) tuples: each header and that range of the
+        file f are to be copied to the output, followed by 'closing', unless
+        the command was HEAD.  f must be closed by the caller under all
+        circumstances.
 
         """
         path = self.translate_path(self.path)
-        f = None
-        if self._fs.isdir(path):
-            if not self.path.endswith('/'):
+        try:
+            info = self._fs.getinfo(path)
+        except FSError, e:
+            self.send_error(404, str(e))
+            return None
+        if self._isdir(path, info):
+            if not self.path.split('?', 1)[0].endswith('/'):
                 # redirect browser - doing basically what apache does
                 self.send_response(301)
                 self.send_header("Location", self.path + "/")
+                self.send_header("Content-Length", "0")
                 self.end_headers()
                 return None
             for index in ("index.html", "index.htm"):
                 index = pathjoin(path, index)
-                if self._fs.exists(index):
-                    path = index
-                    break
+                try:
+                    info = self._fs.getinfo(index)
+                except FSError:
+                    continue
+                path = index
+                break
             else:
-                return self.list_directory(path)
+                f = self.list_directory(path)
+                if f is None:
+                    return None
+                return (f, [('', 0, len(f.getvalue()))], '')
+
         ctype = self.guess_type(path)
+        size = info.get('size')
+        if size is None:
+            size = self._fs.getsize(path)
+        validators = [("Accept-Ranges", "bytes")]
+        etag = make_etag(info)
+        if etag is not None:
+            validators.append(("ETag", etag))
+        mtime = last_modified(info)
+        if mtime is not None:
+            validators.append(("Last-Modified", http_date(mtime)))
+
+        if not_modified(info,
+                        self.headers.get("If-None-Match"),
+                        self.headers.get("If-Modified-Since")):
+            self.send_response(304)
+            for (name, value) in validators:
+                self.send_header(name, value)
+            self.end_headers()
+            return None
+
+        ranges = None
+        if if_range_matches(info, self.headers.get("If-Range")):
+            ranges = parse_range(self.headers.get("Range"), size)
+        if ranges is not None and not ranges:
+            self.send_response(416)
+            self.send_header("Content-Range", "bytes */%d" % (size,))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+
         try:
-            info = self._fs.getinfo(path)
-            f = self._fs.open(path, 'rb')
-        except FSError, e:
+            syspath = self._fs.getsyspath(path, allow_none=True)
+            if syspath is not None:
+                f = open(syspath, 'rb')
+            else:
+                f = self._fs.open(path, 'rb')
+        except (FSError, EnvironmentError), e:
             self.send_error(404, str(e))
             return None
-        self.send_response(200)
-        self.send_header("Content-type", ctype)
-        self.send_header("Content-Length", str(info['size']))
-        if 'modified_time' in info:
-            self.send_header("Last-Modified", self.date_time_string(_datetime_to_epoch(info['modified_time'])))
+
+        closing = ''
+        if not ranges:
+            self.send_response(200)
+            self.send_header("Content-type", ctype)
+            self.send_header("Content-Length", str(size))
+            parts = [('', 0, size)]
+        elif len(ranges) == 1:
+            (start, stop) = ranges[0]
+            self.send_response(206)
+            self.send_header("Content-type", ctype)
+            self.send_header("Content-Length", str(stop - start))
+            self.send_header("Content-Range", content_range(start, stop, size))
+            parts = [('', start, stop)]
+        else:
+            boundary = make_boundary()
+            (parts, closing, length) = multipart_ranges(ranges, size, ctype, boundary)
+            self.send_response(206)
+            self.send_header("Content-type", "multipart/byteranges; boundary=" + boundary)
+            self.send_header("Content-Length", str(length))
+        for (name, value) in validators:
+            self.send_header(name, value)
         self.end_headers()
-        return f
+        return (f, parts, closing)
+
+    def _isdir(self, path, info):
+        if 'st_mode' in info:
+            return stat.S_ISDIR(info['st_mode'])
+        return self._fs.isdir(path)
 
+    def copy_parts(self, f, parts, closing):
+        """Copy the parts of a file laid out by send_head() to the output."""
+        pos = 0
+        for (header, start, stop) in parts:
+            if header:
+                self.wfile.write(header)
+            if start != pos:
+                f.seek(start)
+            self.copy_range(f, start, stop)
+            pos = stop
+        if closing:
+            self.wfile.write(closing)
+
+    def copy_range(self, f, start, stop):
+        """Copy bytes start to stop of f, which is positioned at start."""
+        read = f.read
+        write = self.wfile.write
+        buffer_size = getattr(self.server, 'buffer_size', self.buffer_size)
+        while start < stop:
+            data = read(min(buffer_size, stop - start))
+            if not data:
+                #  The file shrank, so the Content-Length was wrong.
+                self.close_connection = 1
+                break
+            write(data)
+            start += len(data)
 
     def list_directory(self, path):
         """Helper to produce a directory listing (absent index.html).
@@ -90,13 +211,18 @@ class FSHTTPRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
 
         """
         try:
-            dir_paths = self._fs.listdir(path, dirs_only=True)
-            file_paths = self._fs.listdir(path, files_only=True)
+            entries = self._fs.listdirinfo(path)
         except FSError:
             self.send_error(404, "No permission to list directory")
             return None
+        dir_paths = []
+        file_paths = []
+        for (name, info) in entries:
+            if self._isdir(pathjoin(path, name), info):
+                dir_paths.append(name)
+            else:
+                file_paths.append(name)
         paths = [p+'/' for p in sorted(dir_paths, key=lambda p:p.lower())] + sorted(file_paths, key=lambda p:p.lower())
-        #list.sort(key=lambda a: a.lower())
         f = StringIO()
         displaypath = cgi.escape(urllib.unquote(self.path))
         f.write('<!DOCTYPE html PUBLIC "-//W3C//DTD HTML 3.2 Final//EN">')
@@ -128,26 +254,41 @@ class FSHTTPRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
         return path
 
 
-def serve_fs(fs, address='', port=8000):
+class FSHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    """HTTP server exposing an FS, with a thread for each connection
+
+    File data is copied in pieces of 'buffer_size' bytes.
+
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 64
+
+    def __init__(self, fs, server_address, handler_class=FSHTTPRequestHandler,
+                 buffer_size=256*1024, bind_and_activate=True):
+        self.fs = fs
+        self.buffer_size = buffer_size
+        BaseHTTPServer.HTTPServer.__init__(self, server_address, handler_class,
+                                           bind_and_activate)
+
+    def finish_request(self, request, client_address):
+        self.RequestHandlerClass(self.fs, request, client_address, self)
+
+
+def serve_fs(fs, address='', port=8000, buffer_size=256*1024):
 
     """Serve an FS instance over http
 
     :param fs: an FS object
     :param address: IP address to serve on
     :param port: port number
+    :param buffer_size: size of the pieces file data is copied in
 
     """
 
-    def Handler(request, client_address, server):
-        return FSHTTPRequestHandler(fs, request, client_address, server)
-
-    #class ThreadedTCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
-    #    pass
-    httpd = SocketServer.TCPServer((address, port), Handler, bind_and_activate=False)
-    #httpd = ThreadedTCPServer((address, port), Handler, bind_and_activate=False)
-    httpd.allow_reuse_address = True
-    httpd.server_bind()
-    httpd.server_activate()
+    httpd = FSHTTPServer(fs, (address, port), buffer_size=buffer_size)
 
     server_thread = threading.Thread(target=httpd.serve_forever)
     server_thread.start()
@@ -160,4 +301,4 @@ def serve_fs(fs, address='', port=8000):
 if __name__ == "__main__":
 
     from fs.osfs import OSFS
-    serve_fs(OSFS('~/'))
\ No newline at end of file
+    serve_fs(OSFS('~/'))
@@ -0,0 +1,181 @@
+"""
+fs.expose.httputil
+==================
+
+HTTP helpers shared by the exposers in fs.expose.wsgi and fs.expose.http:
+validators (ETag and Last-Modified) derived from an FS info dict,
+conditional request checks, and parsing of byte 'Range' headers.
+
+"""
+
+import time
+import random
+from email.utils import formatdate, parsedate_tz, mktime_tz
+
+#  More ranges than this in one request are ignored and the whole file
+#  is sent instead, so a client can't make a tiny request cost many reads.
+MAX_RANGES = 32
+
+
+def http_date(timestamp):
+    """Format a timestamp as an HTTP date."""
+    return formatdate(timestamp, usegmt=True)
+
+
+def parse_http_date(value):
+    """Parse an HTTP date into a timestamp, or None if it isn't valid."""
+    if not value:
+        return None
+    try:
+        date = parsedate_tz(value)
+        if date is None:
+            return None
+        return mktime_tz(date)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def last_modified(info):
+    """Get the modified time from an info dict as an integer timestamp."""
+    modified_time = info.get('modified_time')
+    if modified_time is None:
+        return None
+    try:
+        return int(time.mktime(modified_time.timetuple()))
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+
+def make_etag(info):
+    """Get a quoted ETag for a file from its info dict.
+
+    An 'etag' reported by the FS itself (as DAVFS does) is used if there
+    is one; otherwise the tag is made from the size and modified time.
+    Returns None if there is nothing to base a tag on.
+    """
+    etag = info.get('etag')
+    if etag:
+        if not etag.endswith('"'):
+            etag = '"%s"' % (etag,)
+        return etag
+    mtime = last_modified(info)
+    if mtime is None:
+        return None
+    return '"%x-%x"' % (mtime, info.get('size', 0))
+
+
+def etag_matches(etag, if_none_match):
+    """Check an ETag against an 'If-None-Match' header (a weak match)."""
+    tags = [tag.strip() for tag in if_none_match.split(',') if tag.strip()]
+    if '*' in tags:
+        return True
+    weak = lambda tag: tag[2:] if tag.startswith('W/') else tag
+    return weak(etag) in [weak(tag) for tag in tags]
+
+
+def not_modified(info, if_none_match=None, if_modified_since=None):
+    """Check whether a conditional GET can be answered with '304'.
+
+    'if_none_match' and 'if_modified_since' are the values of the request
+    headers of the same names, or None.  If-None-Match takes precedence,
+    as RFC 7232 requires.
+    """
+    if if_none_match:
+        etag = make_etag(info)
+        if etag is None:
+            return False
+        return etag_matches(etag, if_none_match)
+    if if_modified_since:
+        since = parse_http_date(if_modified_since)
+        mtime = last_modified(info)
+        if since is None or mtime is None:
+            return False
+        return mtime <= since
+    return False
+
+
+def if_range_matches(info, if_range):
+    """Check whether an 'If-Range' header lets a Range request through."""
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('W/'):
+        #  If-Range needs a strong match.
+        return False
+    if if_range.startswith('"'):
+        return if_range == make_etag(info)
+    since = parse_http_date(if_range)
+    return since is not None and last_modified(info) == since
+
+
+def parse_range(value, size):
+    """Parse a 'Range' header for a file of 'size' bytes.
+
+    Returns None if the header should be ignored (it is missing, invalid,
+    or asks for more than MAX_RANGES ranges), in which case the whole file
+    is sent.  Otherwise returns a list of (start, stop) pairs, with 'stop'
+    exclusive; the list is empty if no range can be satisfied, which calls
+    for a '416' response.
+    """
+    if not value:
+        return None
+    (unit, _, specs) = value.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    specs = [spec.strip() for spec in specs.split(',') if spec.strip()]
+    if not specs or len(specs) > MAX_RANGES:
+        return None
+    ranges = []
+    for spec in specs:
+        (first, sep, last) = spec.partition('-')
+        if not sep:
+            return None
+        try:
+            if not first:
+                #  A suffix range: the last 'last' bytes.
+                suffix = int(last)
+                if suffix < 0:
+                    return None
+                if suffix == 0:
+                    continue
+                ranges.append((max(size - suffix, 0), size))
+                continue
+            start = int(first)
+            stop = int(last) + 1 if last else max(size, start + 1)
+        except ValueError:
+            return None
+        if start < 0 or stop <= start:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, min(stop, size)))
+    return ranges
+
+
+def content_range(start, stop, size):
+    """Get the 'Content-Range' header value for a range of a file."""
+    return 'bytes %d-%d/%d' % (start, stop - 1, size)
+
+
+def make_boundary():
+    """Make a boundary for a multipart/byteranges response."""
+    return '%032x' % (random.getrandbits(128),)
+
+
+def multipart_ranges(ranges, size, content_type, boundary):
+    """Lay out a multipart/byteranges body.
+
+    Returns a list of (part_header, start, stop) tuples, the closing
+    delimiter, and the total length of the body, so the body can be
+    produced by writing each part header followed by that range of the
+    file, then the closing delimiter.
+    """
+    parts = []
+    length = 0
+    for (start, stop) in ranges:
+        header = '\r\n--%s\r\nContent-Type: %s\r\nContent-Range: %s\r\n\r\n' % (
+            boundary, content_type, content_range(start, stop, size))
+        parts.append((header, start, stop))
+        length += len(header) + stop - start
+    closing = '\r\n--%s--\r\n' % (boundary,)
+    return (parts, closing, length + len(closing))
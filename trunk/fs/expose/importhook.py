@@ -30,19 +30,54 @@ an SFTP server::
     >>> FSImportHook.install()
     >>> sys.path.append("sftp://some.remote.machine/mypath/")
 
+Modules are found using an index of the files in each directory searched,
+so looking for a module (or failing to find one) doesn't need a call to
+the FS for every possible suffix.  Source code can also be compiled once
+and the bytecode kept in a writable FS, so later imports skip compiling::
+
+    >>> sys.meta_path.append(FSImportHook(m, bytecode_fs=OSFS("/var/cache/myapp")))
+
+Code that is deployed as a whole, such as an archive read with ZipFS, can
+be made into a bundle with make_bundle().  This writes the compiled code
+of every module into a single file next to the sources, together with a
+manifest of where to find it.  FSImportHook then finds modules from the
+manifest and loads each with one read, without looking at the sources::
+
+    >>> from fs.expose.importhook import make_bundle
+    >>> make_bundle(OSFS("myapp/src"), ZipFS("myapp.zip", "w")).close()
+    >>> sys.path.append("zip://myapp.zip")
+
 """
 
 import os
 import sys
 import imp
+import time
+import struct
 import marshal
+import threading
+
+import stat as statinfo
 
 from fs.base import FS
 from fs.opener import fsopendir, OpenerError
 from fs.errors import *
 from fs.path import *
 
-from six import b
+from six import b, BytesIO
+
+#  The file holding a bundle's manifest and code, in the root of the FS.
+BUNDLE_FILE = "__fsimport__.bundle"
+
+def _isdir(info):
+    """Check whether the info from a listing is known to be a directory's."""
+    return statinfo.S_ISDIR(info.get("st_mode",0))
+
+
+def _isfile(info):
+    """Check whether the info from a listing is known to be a file's."""
+    return statinfo.S_ISREG(info.get("st_mode",0))
+
 
 class FSImportHook(object):
     """PEP-302-compliant module finder and loader for FS objects.
@@ -53,11 +88,25 @@ class FSImportHook(object):
 
     For easy use with sys.path, FSImportHook will also accept a filesystem
     URL, which is automatically opened using fs.opener.
+
+    The files in each directory are listed once and reused, including the
+    fact that a name isn't there.  After 'index_ttl' seconds a listing is
+    made again, unless the FS is backed by the OS and the directory's
+    modified time hasn't changed.  If 'watch' is true and the FS supports watchers (see
+    fs.watch), listings are instead kept until a change is reported.
+
+    If 'bytecode_fs' is given, the code compiled from each source file is
+    stored in it, and reused for as long as the source's modified time and
+    size match.
+
+    If the FS holds a bundle written by make_bundle() and 'use_bundle' is
+    true, the modules in it are found and loaded from the bundle alone.
     """
 
     _VALID_MODULE_TYPES = set((imp.PY_SOURCE,imp.PY_COMPILED))
 
-    def __init__(self,fs_or_url):
+    def __init__(self,fs_or_url,index_ttl=1.0,watch=False,bytecode_fs=None,
+                 use_bundle=True):
         #  If given a string, try to open it as an FS url.
         #  Don't open things on the local filesystem though.
         if isinstance(fs_or_url,basestring):
@@ -76,6 +125,40 @@ class FSImportHook(object):
                 raise ImportError
             self.fs = fs_or_url
             self.path = None
+        self.index_ttl = index_ttl
+        self.bytecode_fs = bytecode_fs
+        #  The files in each directory searched, indexed by path, as a list
+        #  [time checked, directory modified time, {name: info}].
+        self._index = {}
+        #  Only the OS reliably updates a directory's modified time when
+        #  its contents change; elsewhere listings are simply redone.
+        try:
+            self._dir_mtimes = self.fs.getsyspath("/",allow_none=True) is not None
+        except FSError:
+            self._dir_mtimes = False
+        self._watcher = None
+        if watch:
+            try:
+                self._watcher = self.fs.add_watcher(self._on_change,"/")
+            except (AttributeError,FSError):
+                pass
+        self.use_bundle = use_bundle
+        #  The bundle's manifest, mapping module names to a tuple
+        #  (path,type,ispkg,offset,length), or None if there's no bundle.
+        #  Offsets are from the start of the code, after the manifest.
+        self._manifest = None
+        self._bundle_file = None
+        self._bundle_start = 0
+        self._bundle_lock = threading.Lock()
+        self._bundle_checked = False
+
+    def _on_change(self,event):
+        """Drop directory listings affected by a change to the FS."""
+        if event.path is None:
+            self._index.clear()
+        else:
+            self._index.pop(abspath(event.path),None)
+            self._index.pop(dirname(abspath(event.path)),None)
 
     @classmethod
     def install(cls):
@@ -134,6 +217,12 @@ class FSImportHook(object):
         its filepath, file type and whether it's a package.  Otherwise,
         it raise ImportError.
         """
+        manifest = self._get_manifest()
+        if manifest is not None:
+            try:
+                return manifest[fullname][:3]
+            except KeyError:
+                raise ImportError(fullname)
         prefix = fullname.replace(".","/")
         #  Is it a regular module?
         (path,type) = self._find_module_file(prefix)
@@ -154,13 +243,86 @@ class FSImportHook(object):
         in turn and returning the first match found.  It returns a two-tuple
         (path,type) or (None,None) if there's no module.
         """
+        (dirpath,name) = pathsplit(prefix)
+        entries = self._list_dir(dirpath)
         for (suffix,mode,type) in imp.get_suffixes():
             if type in self._VALID_MODULE_TYPES:
-                path = prefix + suffix
-                if self.fs.isfile(path):
-                    return (path,type)
+                info = entries.get(name + suffix)
+                if info is not None and not _isdir(info):
+                    return (prefix + suffix,type)
         return (None,None)
 
+    def _get_manifest(self):
+        """Get the manifest of the FS's bundle, or None if it has none."""
+        if not self._bundle_checked:
+            self._bundle_checked = True
+            if self.use_bundle and BUNDLE_FILE in self._list_dir("/"):
+                self._manifest = self._open_bundle()
+        return self._manifest
+
+    def _open_bundle(self):
+        """Open the FS's bundle and read its manifest.
+
+        The bundle is kept open to read code from.  If its file can't seek,
+        as with members of a ZipFS, it is read into memory instead.
+        """
+        try:
+            f = self.fs.open(BUNDLE_FILE,"rb")
+        except FSError:
+            return None
+        try:
+            f.seek(0)
+        except (IOError,ValueError):
+            data = f.read()
+            f.close()
+            f = BytesIO(data)
+        header = f.read(8)
+        if len(header) < 8 or header[:4] != imp.get_magic():
+            f.close()
+            return None
+        (size,) = struct.unpack("<I",header[4:])
+        manifest = marshal.loads(f.read(size))
+        self._bundle_file = f
+        self._bundle_start = 8 + size
+        return manifest
+
+    def _list_dir(self,dirpath):
+        """Get a dict mapping the names in a directory to their info.
+
+        Listings are taken from the index if they're still valid.  A
+        directory that doesn't exist is empty; it is looked for in the
+        listing of its parent before asking the FS.
+        """
+        dirpath = abspath(dirpath)
+        entry = self._index.get(dirpath)
+        now = time.time()
+        if entry is not None:
+            if self._watcher is not None or now - entry[0] < self.index_ttl:
+                return entry[2]
+        if dirpath != "/":
+            (parent,name) = pathsplit(dirpath)
+            info = self._list_dir(parent).get(name)
+            if info is None or _isfile(info):
+                self._index[dirpath] = [now,None,{}]
+                return {}
+        mtime = None
+        if self._watcher is None and self._dir_mtimes:
+            try:
+                mtime = self.fs.getinfo(dirpath).get("modified_time")
+            except FSError:
+                pass
+            if entry is not None and mtime is not None and mtime == entry[1]:
+                entry[0] = now
+                return entry[2]
+        entries = {}
+        try:
+            for (name,info) in self.fs.listdirinfo(dirpath):
+                entries[name] = info
+        except FSError:
+            pass
+        self._index[dirpath] = [now,mtime,entries]
+        return entries
+
     def load_module(self,fullname):
         """Load the specified module.
 
@@ -180,15 +342,16 @@ class FSImportHook(object):
         mod = imp.new_module(fullname)
         mod.__file__ = "<loading>"
         mod.__loader__ = self
+        #  Packages need __path__ while they run, to import submodules.
+        if self.is_package(fullname,info):
+            if self.path is None:
+                mod.__path__ = []
+            else:
+                mod.__path__ = [self.path]
         sys.modules[fullname] = mod
         try:
             exec code in mod.__dict__
             mod.__file__ = self.get_filename(fullname,info)
-            if self.is_package(fullname,info):
-                if self.path is None:
-                    mod.__path__ = []
-                else:
-                    mod.__path__ = [self.path]
             return mod
         except Exception:
             sys.modules.pop(fullname,None)
@@ -206,10 +369,24 @@ class FSImportHook(object):
         if info is None:
             info = self._get_module_info(fullname)
         (path,type,ispkg) = info
+        if self._get_manifest() is not None:
+            (offset,length) = self._manifest[fullname][3:]
+            with self._bundle_lock:
+                self._bundle_file.seek(self._bundle_start + offset)
+                return marshal.loads(self._bundle_file.read(length))
+        if type == imp.PY_SOURCE and self.bytecode_fs is not None:
+            header = self._bytecode_header(path)
+            if header is not None:
+                code = self._get_cached_code(path,header)
+                if code is not None:
+                    return code
         code = self.fs.getcontents(path, 'rb')
         if type == imp.PY_SOURCE:
             code = code.replace(b("\r\n"),b("\n"))
-            return compile(code,path,"exec")
+            code = compile(code,path,"exec")
+            if self.bytecode_fs is not None and header is not None:
+                self._cache_code(path,header,code)
+            return code
         elif type == imp.PY_COMPILED:
             if code[:4] != imp.get_magic():
                 return None
@@ -218,6 +395,48 @@ class FSImportHook(object):
             return None
         return code
 
+    def _bytecode_header(self,path):
+        """Get the header identifying cached bytecode for a source file.
+
+        This is made from the magic number and the source's modified time
+        and size, or is None if they're not known.
+        """
+        info = self._list_dir(dirname(path)).get(basename(path))
+        if info is None:
+            return None
+        size = info.get("size")
+        mtime = info.get("st_mtime")
+        if mtime is None:
+            #  ZipFS gives the date of its members as their created_time.
+            mtime = info.get("modified_time") or info.get("created_time")
+            if mtime is not None:
+                mtime = time.mktime(mtime.timetuple())
+        if size is None or mtime is None:
+            return None
+        return imp.get_magic() + struct.pack("<II",int(mtime) & 0xFFFFFFFF,
+                                                   size & 0xFFFFFFFF)
+
+    def _get_cached_code(self,path,header):
+        """Get code cached in bytecode_fs for a source file, if still valid."""
+        try:
+            data = self.bytecode_fs.getcontents(path + ".code", "rb")
+        except FSError:
+            return None
+        if data[:len(header)] != header:
+            return None
+        try:
+            return marshal.loads(data[len(header):])
+        except (EOFError,ValueError,TypeError):
+            return None
+
+    def _cache_code(self,path,header,code):
+        """Store the code compiled from a source file in bytecode_fs."""
+        try:
+            self.bytecode_fs.makedir(dirname(path),recursive=True,allow_recreate=True)
+            self.bytecode_fs.setcontents(path + ".code", header + marshal.dumps(code))
+        except FSError:
+            pass
+
     def get_source(self,fullname,info=None):
         """Get the sourcecode for the specified module, if present."""
         if info is None:
@@ -241,3 +460,42 @@ class FSImportHook(object):
         (path,type,ispkg) = info
         return path
  
+
+
+def make_bundle(src_fs,dst_fs=None):
+    """Make a bundle of the modules in an FS, for FSImportHook.
+
+    The compiled code of every module found in 'src_fs' is written to a
+    bundle file, along with a manifest giving each module's path, type and
+    the position of its code.  If 'dst_fs' is given, all files in 'src_fs'
+    are copied into it and the bundle is written there.  Returns the FS
+    holding the bundle.
+    """
+    if dst_fs is None:
+        dst_fs = src_fs
+    hook = FSImportHook(src_fs,use_bundle=False)
+    manifest = {}
+    code = []
+    offset = 0
+    for path in sorted(src_fs.walkfiles()):
+        if dst_fs is not src_fs:
+            dst_fs.makedir(dirname(path),recursive=True,allow_recreate=True)
+            dst_fs.setcontents(path,src_fs.getcontents(path,"rb"))
+        (prefix,ext) = os.path.splitext(relpath(path))
+        if basename(prefix) == "__init__":
+            prefix = dirname(prefix)
+        fullname = prefix.replace("/",".")
+        if not fullname or fullname in manifest:
+            continue
+        try:
+            info = hook._get_module_info(fullname)
+        except ImportError:
+            continue
+        data = marshal.dumps(hook.get_code(fullname,info))
+        manifest[fullname] = info + (offset,len(data))
+        code.append(data)
+        offset += len(data)
+    manifest_data = marshal.dumps(manifest)
+    header = imp.get_magic() + struct.pack("<I",len(manifest_data))
+    dst_fs.setcontents(BUNDLE_FILE,header + manifest_data + b("").join(code))
+    return dst_fs
@@ -8,38 +8,58 @@ except ImportError:
     from StringIO import StringIO
 
 
+#  Payloads up to this size are joined with their header when encoding.
+SMALL_PAYLOAD = 16 * 1024
+
+
+def _size_prefix(header, payload):
+    """The 'headersize,payloadsize:' prefix of a packet, with '' for zero."""
+    return ''.join((header and str(len(header)) or '', ',',
+                    payload and str(len(payload)) or '', ':'))
+
+
 def encode(header='', payload=''):
-    def textsize(s):
-        if s:
-            return str(len(s))
-        return ''    
-    return '%i,%i:%s%s' % (textsize(header), textsize(payload), header, payload)
+    return ''.join((_size_prefix(header, payload), header, payload))
+
+
+def encode_vector(header='', payload=''):
+    """Encode a packet as a list of strings to be written out in order.
+
+    Small packets are joined into a single string; larger payloads are
+    left as a separate item so they are never copied.
+    """
+    if len(payload) <= SMALL_PAYLOAD:
+        return [''.join((_size_prefix(header, payload), header, payload))]
+    return [''.join((_size_prefix(header, payload), header)), payload]
 
 
 class FileEncoder(object):
-    
+    """Write packets to a file-like object.
+
+    If the object has a 'writev' method it is given each packet as a list
+    of strings, as from encode_vector(); otherwise they are written in turn.
+    """
+
     def __init__(self, f):
         self.f = f
-        
+        self._writev = getattr(f, 'writev', None)
+
     def write(self, header='', payload=''):
-        fwrite = self.f.write
-        def textsize(s):
-            if s:
-                return str(len(s))
-            return ''        
-        fwrite('%s,%s:' % (textsize(header), textsize(payload)))
-        if header:
-            fwrite(header)
-        if payload:
-            fwrite(payload)
+        parts = encode_vector(header, payload)
+        if self._writev is not None:
+            self._writev(parts)
+        else:
+            fwrite = self.f.write
+            for part in parts:
+                fwrite(part)
 
 
 class JSONFileEncoder(FileEncoder):
-    
+
     def write(self, header=None, payload=''):
         if header is None:
             super(JSONFileEncoder, self).write('', payload)
-        else:         
+        else:
             header_json = dumps(header, separators=(',', ':'))
             super(JSONFileEncoder, self).write(header_json, payload)
 
@@ -51,157 +71,150 @@ class PreludeError(DecoderError):
     pass
 
 class Decoder(object):
-    
-    STAGE_PRELUDE, STAGE_SIZE, STAGE_HEADER, STAGE_PAYLOAD = range(4)
+    """Incrementally decode a stream of packets.
+
+    Complete packets are sliced straight out of the data passed to feed(),
+    so each header and payload is copied exactly once.  Only an incomplete
+    packet at the end of the data is kept, in a single bytearray that the
+    next feed() extends and parses through a memoryview.  A payload of LARGE_PAYLOAD
+    bytes or more that hasn't fully arrived is instead collected as a list
+    of the data strings as received, and joined once it is complete.
+    """
+
+    STAGE_PRELUDE, STAGE_SIZE, STAGE_BODY = range(3)
     MAX_PRELUDE = 255
-        
+    MAX_SIZE_PREFIX = 64
+    MAX_HEADER_SIZE = 16 * 1024 * 1024
+    MAX_PAYLOAD_SIZE = 256 * 1024 * 1024
+    LARGE_PAYLOAD = 64 * 1024
+
     def __init__(self, no_prelude=False, prelude_callback=None):
-        
+
         self.prelude_callback = prelude_callback
         self.stream_broken = False
-        self.expecting_bytes = None
         self.stage = self.STAGE_PRELUDE
-        self._prelude = []
-        self._size = []
-        self._expecting_bytes = None
-        
+
         self.header_size = None
         self.payload_size = None
-        
-        self._header_bytes = None
-        self._payload_bytes = None
-        
-        self._header_data = []
-        self._payload_data = []
-        
+
         self.header = None
         self.payload = None
-        
+
+        self._buffer = bytearray()
+        self._payload_parts = None
+        self._payload_needed = 0
+
         if no_prelude:
             self.stage = self.STAGE_SIZE
-    
-    
+
+    def _broken(self, error):
+        self.stream_broken = True
+        raise error
+
     def feed(self, data):
-        
+        """Add data to the stream, yielding (header, payload) for each packet
+        it completes."""
+
         if self.stream_broken:
             raise DecoderError('Stream is broken')
-        
-        STAGE_PRELUDE, STAGE_SIZE, STAGE_HEADER, STAGE_PAYLOAD = range(4)
-                
-        size_append = self._size.append
-        header_append = self._header_data.append
-        payload_append = self._payload_data.append
-        datafind = data.find
-        
-        def reset_packet():
-            self.expecting_bytes = None
-            del self._header_data[:]
-            del self._payload_data[:]
-            self.header = None
-            self.payload = None
-            
-        data_len = len(data)
-        data_pos = 0
-        expecting_bytes = self.expecting_bytes        
+
+        pos = 0
+        if self._payload_parts is not None:
+            #  Part way through a large payload.
+            needed = self._payload_needed
+            if len(data) < needed:
+                self._payload_parts.append(data)
+                self._payload_needed -= len(data)
+                return
+            self._payload_parts.append(data[:needed])
+            payload = ''.join(self._payload_parts)
+            self._payload_parts = None
+            self.stage = self.STAGE_SIZE
+            yield self.header, payload
+            pos = needed
+
+        buf = self._buffer
+        if buf:
+            buf += memoryview(data)[pos:]
+            source = buf
+            pos = 0
+            view = memoryview(buf)
+            def cut(start, stop):
+                return view[start:stop].tobytes()
+        else:
+            source = data
+            cut = data.__getslice__
+        end = len(source)
+        find = source.find
         stage = self.stage
-        
-        if stage == STAGE_PRELUDE:
-            max_find = min(len(data), data_pos + self.MAX_PRELUDE)           
-            cr_pos = datafind('\n', data_pos, max_find)
-            if cr_pos == -1:
-                self._prelude.append(data[data_pos:])
-                data_pos = max_find
-                if sum(len(s) for s in self._prelude) > self.MAX_PRELUDE:
-                    self.stream_broken = True
-                    raise PreludeError('Prelude not found')
-            else:
-                self._prelude.append(data[data_pos:cr_pos])
-                if sum(len(s) for s in self._prelude) > self.MAX_PRELUDE:
-                    self.stream_broken = True
-                    raise PreludeError('Prelude not found')
-                data_pos = cr_pos + 1                                
-                prelude = ''.join(self._prelude)
-                del self._prelude[:]
-                reset_packet()
-                if not self.on_prelude(prelude):
-                    self.broken = True
-                    return
-                stage = STAGE_SIZE        
-        
-        while data_pos < data_len:
-            
-            if stage == STAGE_HEADER:
-                bytes_to_read = min(data_len - data_pos, expecting_bytes)
-                header_append(data[data_pos:data_pos + bytes_to_read])
-                data_pos += bytes_to_read
-                expecting_bytes -= bytes_to_read 
-                if not expecting_bytes:                    
-                    self.header = ''.join(self._header_data)                                    
-                    if not self.payload_size:
-                        yield self.header, ''
-                        reset_packet()
-                        expecting_bytes = None
-                        stage = STAGE_SIZE
-                    else:                        
-                        stage = STAGE_PAYLOAD
-                        expecting_bytes = self.payload_size
-                                        
-            elif stage == STAGE_PAYLOAD:
-                bytes_to_read = min(data_len - data_pos, expecting_bytes)                
-                payload_append(data[data_pos:data_pos + bytes_to_read])
-                data_pos += bytes_to_read
-                expecting_bytes -= bytes_to_read 
-                if not expecting_bytes:                    
-                    self.payload = ''.join(self._payload_data)
-                    yield self.header, self.payload
-                    reset_packet()
-                    stage = STAGE_SIZE
-                    expecting_bytes = None
-                
-            elif stage == STAGE_SIZE:
-                term_pos = datafind(':', data_pos)
+
+        while pos < end:
+
+            if stage == self.STAGE_SIZE:
+                term_pos = find(':', pos, pos + self.MAX_SIZE_PREFIX)
                 if term_pos == -1:
-                    size_append(data[data_pos:])                    
+                    if end - pos >= self.MAX_SIZE_PREFIX:
+                        self._broken(DecoderError('Packet size not found'))
                     break
-                else:
-                    size_append(data[data_pos:term_pos])
-                    data_pos = term_pos + 1                    
-
-                size = ''.join(self._size)
-                del self._size[:]
-                if ',' in size:
-                    header_size, payload_size = size.split(',', 1)
-                else:
-                    header_size = size
-                    payload_size = ''                    
+                size = cut(pos, term_pos)
+                header_size, _, payload_size = size.partition(',')
                 try:
-                    self.header_size = int(header_size or '0')
-                    self.payload_size = int(payload_size or '0')
+                    header_size = int(header_size or '0')
+                    payload_size = int(payload_size or '0')
                 except ValueError:
-                    self.stream_broken = False
-                    raise DecoderError('Invalid size in packet (%s)' % size)
-                
-                if self.header_size:
-                    expecting_bytes = self.header_size                        
-                    stage = STAGE_HEADER
-                elif self.payload_size:
-                    expecting_bytes = self.payload_size                        
-                    stage = STAGE_PAYLOAD
+                    self._broken(DecoderError('Invalid size in packet (%s)' % size))
+                if not (0 <= header_size <= self.MAX_HEADER_SIZE and
+                        0 <= payload_size <= self.MAX_PAYLOAD_SIZE):
+                    self._broken(DecoderError('Invalid size in packet (%s)' % size))
+                pos = term_pos + 1
+                self.header_size = header_size
+                self.payload_size = payload_size
+                stage = self.STAGE_BODY
+
+            if stage == self.STAGE_BODY:
+                header_size = self.header_size
+                header_end = pos + header_size
+                packet_end = header_end + self.payload_size
+                if packet_end <= end:
+                    header = cut(pos, header_end)
+                    payload = cut(header_end, packet_end)
+                    pos = packet_end
+                    stage = self.STAGE_SIZE
+                    yield header, payload
+                elif self.payload_size >= self.LARGE_PAYLOAD and header_end <= end:
+                    self.header = cut(pos, header_end)
+                    self._payload_parts = [cut(header_end, end)]
+                    self._payload_needed = packet_end - end
+                    pos = end
+                    break
                 else:
-                    # A completely empty packet, permitted, if a little odd
-                    yield '', ''
-                    reset_packet()                        
-                    expecting_bytes = None
+                    break
+
+            elif stage == self.STAGE_PRELUDE:
+                cr_pos = find('\n', pos, pos + self.MAX_PRELUDE + 1)
+                if cr_pos == -1:
+                    if end - pos > self.MAX_PRELUDE:
+                        self._broken(PreludeError('Prelude not found'))
+                    break
+                prelude = cut(pos, cr_pos)
+                pos = cr_pos + 1
+                if not self.on_prelude(prelude):
+                    self.stream_broken = True
+                    return
+                stage = self.STAGE_SIZE
 
-        self.expecting_bytes = expecting_bytes                
         self.stage = stage
-                
-                        
+        #  Keep any incomplete packet for next time.
+        if source is buf:
+            #  Release the memoryview so that the bytearray can be resized.
+            view = cut = None
+            del buf[:pos]
+        elif pos < end:
+            buf += memoryview(data)[pos:]
+
     def on_prelude(self, prelude):
         if self.prelude_callback and not self.prelude_callback(self, prelude):
             return False
-        #pass
-        #print "Prelude:", prelude
         return True
 
 
@@ -210,7 +223,10 @@ class JSONDecoder(Decoder):
     def feed(self, data):
         for header, payload in Decoder.feed(self, data):
             if header:
-                header = loads(header)
+                try:
+                    header = loads(header)
+                except ValueError:
+                    self._broken(DecoderError('Invalid packet header'))
             else:
                 header = {}
             yield header, payload
@@ -0,0 +1,104 @@
+"""
+fs.expose.serve.protocol
+========================
+
+Values shared by the server in fs.expose.serve.server and the client in
+fs.remotefs, and helpers to send things that JSON can't represent directly
+(datetimes and exceptions) in packet headers.
+
+"""
+
+import time
+from datetime import datetime
+
+from fs import errors
+
+import six
+from six.moves import builtins
+
+
+#  Sent by each end when a connection is opened.
+PRELUDE = 'pyfs/1.0\n'
+
+#  Files are read and written in packets of at most this many bytes.
+CHUNK_SIZE = 64 * 1024
+
+#  Amount of data to read from a socket at once.
+READ_SIZE = 64 * 1024
+
+_json_types = (six.string_types, six.integer_types, float, bool, type(None))
+
+
+def encode_time(dt):
+    """Convert a datetime to a timestamp, passing None through."""
+    if dt is None:
+        return None
+    return time.mktime(dt.timetuple()) + dt.microsecond / 1000000.0
+
+
+def decode_time(t):
+    """Convert a timestamp back to a datetime, passing None through."""
+    if t is None:
+        return None
+    return datetime.fromtimestamp(t)
+
+
+def encode_info(info):
+    """Prepare an info dict for sending, dropping values JSON can't hold."""
+    encoded = {}
+    for (k, v) in info.iteritems():
+        if isinstance(v, datetime):
+            encoded[k] = encode_time(v)
+        elif isinstance(v, _json_types):
+            encoded[k] = v
+    return encoded
+
+
+def decode_info(info):
+    """Restore the datetimes in an info dict created by encode_info."""
+    for (k, v) in info.iteritems():
+        if k.endswith("_time") and isinstance(v, (six.integer_types, float)):
+            info[k] = decode_time(v)
+    return info
+
+
+def encode_error(e):
+    """Describe an exception so that decode_error can re-create it."""
+    if isinstance(e, errors.FSError):
+        state = dict((k, v) for (k, v) in e.__dict__.iteritems()
+                     if isinstance(v, _json_types))
+        if e.details is not None:
+            state["details"] = str(e.details)
+        return dict(name=e.__class__.__name__, fs_error=True, state=state)
+    try:
+        msg = six.text_type(e)
+    except UnicodeError:
+        msg = repr(e)
+    return dict(name=e.__class__.__name__, fs_error=False, msg=msg)
+
+
+def decode_error(error):
+    """Re-create an exception described by encode_error.
+
+    FSError subclasses are restored with their attributes, in the same way
+    as they are unpickled; builtin exceptions are created from their
+    message, if they can be; anything else becomes an OperationFailedError.
+    """
+    name = error.get("name", "")
+    if error.get("fs_error"):
+        cls = getattr(errors, name, None)
+        if not isinstance(cls, type) or not issubclass(cls, errors.FSError):
+            cls = errors.FSError
+        e = cls.__new__(cls)
+        e.__dict__.update(msg=cls.default_message, details=None)
+        e.__dict__.update(error.get("state", {}))
+        return e
+    cls = getattr(builtins, name, None)
+    if isinstance(cls, type) and issubclass(cls, Exception):
+        #  Some, such as UnicodeEncodeError, need more than a message.
+        try:
+            return cls(error.get("msg", ""))
+        except Exception:
+            pass
+    msg = "%s: " % (name,) + error.get("msg", "").replace("%", "%%")
+    return errors.OperationFailedError(name, msg=msg)
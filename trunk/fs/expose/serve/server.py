@@ -1,191 +1,851 @@
 from __future__ import with_statement
 
+import errno
+import select
 import socket
 import threading
-from packetstream import JSONDecoder, JSONFileEncoder
+from collections import deque
+
+from fs.errors import ResourceNotFoundError
+from packetstream import JSONDecoder, JSONFileEncoder, DecoderError
+from threadpool import ThreadPool
+from protocol import PRELUDE, READ_SIZE, encode_info, encode_error, decode_time
 
 
 
 class _SocketFile(object):
     def __init__(self, socket):
         self.socket = socket
-        
+
     def read(self, size):
         try:
             return self.socket.recv(size)
         except socket.error:
             return ''
-    
+
     def write(self, data):
         self.socket.sendall(data)
 
+    def writev(self, buffers):
+        for data in buffers:
+            self.socket.sendall(data)
 
-def remote_call(method_name=None):
-    method = method_name    
+
+def remote_call(method_name=None, payload=False, serial=False):
+    """Mark a method of a ConnectionHandlerBase as callable by the client.
+
+    If 'payload' is true, the payload of the request is passed to the method
+    as the keyword argument 'data'.  If 'serial' is true, calls with the same
+    first argument (e.g. a file handle) are run one at a time in the order
+    they were received; other calls may run concurrently.
+    """
+    method = method_name
     def deco(f):
         if not hasattr(f, '_remote_call_names'):
-            f._remote_call_names = []        
+            f._remote_call_names = []
         f._remote_call_names.append(method or f.__name__)
-        return f      
+        f._remote_call_payload = payload
+        f._remote_call_serial = serial
+        return f
     return deco
 
 
 class RemoteResponse(Exception):
+    """A response with a payload.
+
+    Remote methods can return (or raise) one of these to send binary data
+    back to the client; 'header' is merged into the response header.
+    """
     def __init__(self, header, payload):
         self.header = header
         self.payload = payload
 
 class ConnectionHandlerBase(threading.Thread):
-    
-    _methods = {}
-    
-    def __init__(self, server, connection_id, socket, address):
+    """Thread that reads requests from one client connection.
+
+    Requests are run on the server's thread pool, so many requests from one
+    client may be in progress at once; each response carries the
+    'client_ref' of its request so the client can match them up.  If
+    'transport' is given, responses are written to it instead of directly
+    to the socket.
+    """
+
+    def __init__(self, server, connection_id, socket, address, transport=None):
         super(ConnectionHandlerBase, self).__init__()
+        self.daemon = True
         self.server = server
-        self.connection_id = connection_id        
+        self.connection_id = connection_id
         self.socket = socket
-        self.transport = _SocketFile(socket)
-        self.address = address        
+        if transport is None:
+            transport = _SocketFile(socket)
+        self.transport = transport
+        self.address = address
         self.encoder = JSONFileEncoder(self.transport)
-        self.decoder = JSONDecoder(prelude_callback=self.on_stream_prelude)        
-    
+        self.decoder = JSONDecoder(prelude_callback=self.on_stream_prelude)
+
         self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._serial_jobs = {}
         self.socket_error = None
-          
-        if not self._methods:  
-            for method_name in dir(self):
-                method = getattr(self, method_name)
-                if callable(method) and hasattr(method, '_remote_call_names'):
-                    for name in method._remote_call_names:
-            
-                        self._methods[name] = method
-                        
-        print self._methods
-            
-        self.fs = None        
-    
+
+        self._methods = {}
+        for method_name in dir(self):
+            method = getattr(self, method_name)
+            if callable(method) and hasattr(method, '_remote_call_names'):
+                for name in method._remote_call_names:
+                    self._methods[name] = method
+
+        self.fs = None
+
     def run(self):
-        self.transport.write('pyfs/1.0\n')
-        while True:
-            try:
-                data = self.transport.read(4096)
-            except socket.error, socket_error:
-                print socket_error
-                self.socket_error = socket_error
-                break
-            print "data", repr(data)
-            if data: 
-                for packet in self.decoder.feed(data):                            
-                    print repr(packet)
-                    self.on_packet(*packet)
-            else:
-                break            
-        self.on_connection_close()
-            
+        try:
+            self.transport.write(PRELUDE)
+            while True:
+                data = self.transport.read(READ_SIZE)
+                if not data:
+                    break
+                for header, payload in self.decoder.feed(data):
+                    self.on_packet(header, payload)
+        except (socket.error, DecoderError), socket_error:
+            self.socket_error = socket_error
+        finally:
+            self.on_connection_close()
+
     def close(self):
         with self._lock:
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
             self.socket.close()
-    
+
     def on_connection_close(self):
-        self.socket.shutdown(socket.SHUT_RDWR)
-        self.socket.close()
+        self.close()
         self.server.on_connection_close(self.connection_id)
-    
+
     def on_stream_prelude(self, packet_stream, prelude):
-        print "prelude", prelude
         return True
-    
+
     def on_packet(self, header, payload):
-        print '-' * 30
-        print repr(header)
-        print repr(payload)
-        if header['type'] == 'rpc':
-            method = header['method']
-            args = header['args']
-            kwargs = header['kwargs']
-            method_callable = self._methods[method]
-            remote = dict(type='rpcresult',
-                          client_ref = header['client_ref'])
-            try:
-                response = method_callable(*args, **kwargs)
+        if header.get('type') != 'rpc':
+            return
+        client_ref = header.get('client_ref')
+        args = header.get('args', [])
+        kwargs = header.get('kwargs', {})
+        try:
+            method = self._methods[header['method']]
+        except KeyError:
+            error = ValueError("unknown method: %r" % (header.get('method'),))
+            self.send_packet(dict(type='rpcerror',
+                                  client_ref=client_ref,
+                                  error=encode_error(error)))
+            return
+        if method._remote_call_payload:
+            kwargs['data'] = payload
+        if method._remote_call_serial and args:
+            self._dispatch_serial(args[0], client_ref, method, args, kwargs)
+        else:
+            self.server.pool.job(self._call, client_ref, method, args, kwargs)
+
+    def _dispatch_serial(self, key, *call):
+        with self._lock:
+            jobs = self._serial_jobs.get(key)
+            if jobs is not None:
+                jobs.append(call)
+                return
+            self._serial_jobs[key] = deque([call])
+        self.server.pool.job(self._run_serial, key)
+
+    def _run_serial(self, key):
+        while True:
+            with self._lock:
+                jobs = self._serial_jobs[key]
+                if not jobs:
+                    del self._serial_jobs[key]
+                    return
+                call = jobs.popleft()
+            self._call(*call)
+
+    def _call(self, client_ref, method, args, kwargs):
+        remote = dict(type='rpcresult',
+                      client_ref=client_ref)
+        payload = ''
+        try:
+            response = method(*args, **kwargs)
+        except RemoteResponse, response:
+            remote.update(response.header)
+            payload = response.payload
+        except Exception, e:
+            remote['type'] = 'rpcerror'
+            remote['error'] = encode_error(e)
+        else:
+            if isinstance(response, RemoteResponse):
+                remote.update(response.header)
+                payload = response.payload
+            else:
                 remote['response'] = response
-                self.encoder.write(remote, '')
-            except RemoteResponse, response:
-                self.encoder.write(response.header, response.payload)                                
+        try:
+            self.send_packet(remote, payload)
+        except (TypeError, ValueError), e:
+            #  The response couldn't be encoded as JSON.
+            self.send_packet(dict(type='rpcerror',
+                                  client_ref=client_ref,
+                                  error=encode_error(e)))
+
+    def send_packet(self, header, payload=''):
+        with self._write_lock:
+            try:
+                self.encoder.write(header, payload)
+            except socket.error, socket_error:
+                self.socket_error = socket_error
+
 
 class RemoteFSConnection(ConnectionHandlerBase):
+    """Connection exposing the FS operations of the server's 'fs'.
+
+    Paths are sent as JSON strings, info dicts and times are converted by
+    fs.expose.serve.protocol, and file contents travel in packet payloads.
+    Open files are referred to by integer handles, and calls on the same
+    handle are run in the order they were sent.
+    """
+
+    def __init__(self, server, connection_id, socket, address, transport=None):
+        super(RemoteFSConnection, self).__init__(server, connection_id, socket, address, transport)
+        self.fs = server.fs
+        self._files = {}
+        self._next_handle = 1
+
+    def on_connection_close(self):
+        with self._lock:
+            files = self._files.values()
+            self._files.clear()
+        for f in files:
+            try:
+                f.close()
+            except Exception:
+                pass
+        super(RemoteFSConnection, self).on_connection_close()
 
     @remote_call()
     def auth(self, username, password, resource):
         self.username = username
         self.password = password
         self.resource = resource
-        from fs.memoryfs import MemoryFS
-        self.fs = MemoryFS()
-        
+        if self.fs is None:
+            from fs.memoryfs import MemoryFS
+            self.fs = MemoryFS()
+
+    @remote_call(payload=True)
+    def ping(self, data=''):
+        return RemoteResponse({}, data)
+
+    @remote_call()
+    def getmeta(self, meta_name, *default):
+        return self.fs.getmeta(meta_name, *default)
+
+    @remote_call()
+    def hasmeta(self, meta_name):
+        return self.fs.hasmeta(meta_name)
+
+    @remote_call()
+    def exists(self, path):
+        return self.fs.exists(path)
+
+    @remote_call()
+    def isdir(self, path):
+        return self.fs.isdir(path)
+
+    @remote_call()
+    def isfile(self, path):
+        return self.fs.isfile(path)
+
+    @remote_call()
+    def listdir(self, path="./", wildcard=None, full=False, absolute=False, dirs_only=False, files_only=False):
+        return self.fs.listdir(path, wildcard, full, absolute, dirs_only, files_only)
+
+    @remote_call()
+    def listdirinfo(self, path="./", wildcard=None, full=False, absolute=False, dirs_only=False, files_only=False):
+        entries = self.fs.listdirinfo(path, wildcard, full, absolute, dirs_only, files_only)
+        return [[e, encode_info(info)] for (e, info) in entries]
+
+    @remote_call()
+    def walk(self, path="/", wildcard=None, dir_wildcard=None, search="breadth", ignore_errors=False):
+        return list(self.fs.walk(path, wildcard, dir_wildcard, search, ignore_errors))
+
+    @remote_call()
+    def makedir(self, path, recursive=False, allow_recreate=False):
+        self.fs.makedir(path, recursive, allow_recreate)
+
+    @remote_call()
+    def remove(self, path):
+        self.fs.remove(path)
+
+    @remote_call()
+    def removedir(self, path, recursive=False, force=False):
+        self.fs.removedir(path, recursive, force)
+
+    @remote_call()
+    def rename(self, src, dst):
+        self.fs.rename(src, dst)
+
+    @remote_call()
+    def settimes(self, path, accessed_time=None, modified_time=None):
+        self.fs.settimes(path, decode_time(accessed_time), decode_time(modified_time))
+
+    @remote_call()
+    def getinfo(self, path):
+        return encode_info(self.fs.getinfo(path))
+
+    @remote_call()
+    def getinfo_many(self, paths):
+        infos = []
+        for path in paths:
+            try:
+                infos.append(encode_info(self.fs.getinfo(path)))
+            except ResourceNotFoundError:
+                infos.append(None)
+        return infos
+
+    @remote_call()
+    def desc(self, path):
+        return self.fs.desc(path)
+
+    @remote_call()
+    def copy(self, src, dst, overwrite=False):
+        self.fs.copy(src, dst, overwrite)
+
+    @remote_call()
+    def move(self, src, dst, overwrite=False):
+        self.fs.move(src, dst, overwrite)
+
+    @remote_call()
+    def copydir(self, src, dst, overwrite=False, ignore_errors=False):
+        self.fs.copydir(src, dst, overwrite, ignore_errors)
+
+    @remote_call()
+    def movedir(self, src, dst, overwrite=False, ignore_errors=False):
+        self.fs.movedir(src, dst, overwrite, ignore_errors)
+
+    @remote_call()
+    def getcontents(self, path):
+        return RemoteResponse({}, self.fs.getcontents(path, "rb"))
+
+    @remote_call(payload=True)
+    def setcontents(self, path, data=''):
+        self.fs.setcontents(path, data)
+
+    @remote_call()
+    def open_file(self, path, mode="r"):
+        """Open a file, returning a handle and the file's current size."""
+        mode = mode.replace("t", "").replace("-", "")
+        if "b" not in mode:
+            mode += "b"
+        f = self.fs.open(path, mode)
+        try:
+            f.seek(0, 2)
+            size = f.tell()
+            if "a" not in mode:
+                f.seek(0)
+        except Exception:
+            f.close()
+            raise
+        with self._lock:
+            handle = self._next_handle
+            self._next_handle += 1
+            self._files[handle] = f
+        return [handle, size]
+
+    def _get_file(self, handle):
+        try:
+            return self._files[handle]
+        except KeyError:
+            raise ValueError("invalid file handle: %r" % (handle,))
+
+    @remote_call(serial=True)
+    def read_file(self, handle, offset, size):
+        f = self._get_file(handle)
+        f.seek(offset)
+        return RemoteResponse({}, f.read(size))
+
+    @remote_call(payload=True, serial=True)
+    def write_file(self, handle, offset, data=''):
+        f = self._get_file(handle)
+        f.seek(offset)
+        f.write(data)
+
+    @remote_call(serial=True)
+    def truncate_file(self, handle, size):
+        self._get_file(handle).truncate(size)
+
+    @remote_call(serial=True)
+    def flush_file(self, handle):
+        self._get_file(handle).flush()
+
+    @remote_call(serial=True)
+    def close_file(self, handle):
+        with self._lock:
+            f = self._files.pop(handle, None)
+        if f is not None:
+            f.close()
+
+
 class Server(object):
-    
-    def __init__(self, addr='', port=3000, connection_factory=RemoteFSConnection):
+    """Serve an FS over the fs.expose.serve packet protocol.
+
+    Each connection gets a thread reading its requests, which are run on a
+    pool of 'num_threads' threads.  Use fs.remotefs.RemoteFS to connect.
+    If 'fs' is None, each connection gets its own MemoryFS.
+    """
+
+    request_queue_size = 64
+
+    def __init__(self, addr='127.0.0.1', port=3000, connection_factory=RemoteFSConnection, fs=None, num_threads=8):
         self.addr = addr
         self.port = port
         self.connection_factory = connection_factory
+        self.fs = fs
+        self.num_threads = num_threads
         self.socket = None
+        self.pool = None
         self.connection_id = 0
         self.threads = {}
         self._lock = threading.RLock()
-    
-    def serve_forever(self):
+        self._closing = False
+
+    def listen(self):
+        """Open the listening socket, setting 'port' to the port in use."""
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        sock.bind((self.addr, self.port))        
-        
-        sock.listen(5)
-        
+        sock.bind((self.addr, self.port))
+        sock.listen(self.request_queue_size)
+        self.socket = sock
+        self.port = sock.getsockname()[1]
+
+    def serve_forever(self):
+        if self.socket is None:
+            self.listen()
+        self.pool = ThreadPool(self.num_threads, name='fs.expose.serve')
+
         try:
-            while True:
-                clientsocket, address = sock.accept()
+            while not self._closing:
+                try:
+                    clientsocket, address = self.socket.accept()
+                except socket.error:
+                    if self._closing:
+                        break
+                    raise
                 self.on_connect(clientsocket, address)
         except KeyboardInterrupt:
             pass
-        
+
         try:
             self._close_graceful()
         except KeyboardInterrupt:
             self._close_harsh()
-        
+        self.pool.quit()
+
+    def shutdown(self):
+        """Stop serve_forever() and close all connections."""
+        self._closing = True
+        if self.socket is not None:
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            self.socket.close()
+
     def _close_graceful(self):
         """Tell all threads to exit and wait for them"""
         with self._lock:
-            for connection in self.threads.itervalues():
-                connection.close()        
-            for connection in self.threads.itervalues():
-                connection.join()
+            connections = self.threads.values()
+        for connection in connections:
+            connection.close()
+        for connection in connections:
+            connection.join()
+        with self._lock:
             self.threads.clear()
-            
+
     def _close_harsh(self):
         with self._lock:
             for connection in self.threads.itervalues():
                 connection.close()
             self.threads.clear()
-                          
+
     def on_connect(self, clientsocket, address):
-        print "Connection from", address
+        clientsocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         with self._lock:
             self.connection_id += 1
             thread = self.connection_factory(self,
                                              self.connection_id,
                                              clientsocket,
-                                             address)            
-            self.threads[self.connection_id] = thread            
-            thread.start()            
-        
+                                             address)
+            self.threads[self.connection_id] = thread
+            thread.start()
+
     def on_connection_close(self, connection_id):
-        pass
-        #with self._lock:
-        #    self.threads[connection_id].join()
-        #    del self.threads[connection_id]
-            
+        with self._lock:
+            self.threads.pop(connection_id, None)
+
+#  Event masks used by _Poller; these are the poll() values, which epoll
+#  shares.
+_READ = 0x001
+_WRITE = 0x004
+_ERROR = 0x008 | 0x010 | 0x020
+
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+
+def _socketpair():
+    """Get a pair of connected sockets.
+
+    Unlike a pipe, these can be watched with select() on any platform.
+    """
+    if hasattr(socket, 'socketpair'):
+        return socket.socketpair()
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.connect(listener.getsockname())
+        (server, address) = listener.accept()
+    finally:
+        listener.close()
+    return (server, client)
+
+
+class _Poller(object):
+    """Wait for events on many file descriptors.
+
+    Uses epoll where available, then poll, then select.
+    """
+
+    def __init__(self):
+        self._events = {}
+        if hasattr(select, 'epoll'):
+            self._poll = select.epoll()
+        elif hasattr(select, 'poll'):
+            self._poll = select.poll()
+        else:
+            self._poll = None
+
+    def register(self, fd, events):
+        self._events[fd] = events
+        if self._poll is not None:
+            self._poll.register(fd, events)
+
+    def modify(self, fd, events):
+        self._events[fd] = events
+        if self._poll is not None:
+            self._poll.modify(fd, events)
+
+    def unregister(self, fd):
+        del self._events[fd]
+        if self._poll is not None:
+            self._poll.unregister(fd)
+
+    def poll(self):
+        """Wait for events, returning a list of (fd, events) pairs."""
+        try:
+            if self._poll is not None:
+                return self._poll.poll()
+            return self._select()
+        except (select.error, EnvironmentError), e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+
+    def _select(self):
+        readers = [fd for (fd, events) in self._events.iteritems() if events & _READ]
+        writers = [fd for (fd, events) in self._events.iteritems() if events & _WRITE]
+        (readable, writable, failed) = select.select(readers, writers, self._events.keys())
+        ready = {}
+        for (fds, event) in ((readable, _READ), (writable, _WRITE), (failed, _ERROR)):
+            for fd in fds:
+                ready[fd] = ready.get(fd, 0) | event
+        return ready.items()
+
+    def close(self):
+        if hasattr(self._poll, 'close'):
+            self._poll.close()
+
+
+class _LoopConnection(object):
+    """Non-blocking transport for a connection of an EventLoopServer.
+
+    Responses written by the pool threads are sent straight away if the
+    socket will take them; whatever is left is queued and sent by the
+    event loop when the socket becomes writable.
+    """
+
+    def __init__(self, server, sock):
+        self.server = server
+        self.socket = sock
+        self.fileno = sock.fileno()
+        self.handler = None
+        self.lock = threading.Lock()
+        self.outgoing = deque([PRELUDE])
+        self.outgoing_size = len(PRELUDE)
+        self.offset = 0
+        self.in_flight = 0
+        self.reading = True
+        self.events = 0
+        self.closed = False
+        self.error = None
+
+    def write(self, data):
+        self.writev([data])
+
+    def writev(self, buffers):
+        #  Every response answers one request.
+        with self.lock:
+            if self.closed:
+                return
+            self.in_flight -= 1
+            for data in buffers:
+                if data:
+                    self.outgoing.append(data)
+                    self.outgoing_size += len(data)
+            self.send()
+            wake = self.error is not None or self.wanted_events() != self.events
+        if wake:
+            self.server._wake(self)
+
+    def send(self):
+        """Send as much queued data as the socket will take.
+
+        Must be called with 'lock' held.  Small responses are joined so they
+        go out in one call.
+        """
+        outgoing = self.outgoing
+        while outgoing and self.error is None:
+            data = outgoing[0]
+            if not self.offset and len(outgoing) > 1 and len(data) < READ_SIZE:
+                parts = []
+                size = 0
+                while outgoing and size + len(outgoing[0]) <= READ_SIZE:
+                    parts.append(outgoing.popleft())
+                    size += len(parts[-1])
+                data = ''.join(parts)
+                outgoing.appendleft(data)
+            try:
+                if self.offset:
+                    sent = self.socket.send(buffer(data, self.offset))
+                else:
+                    sent = self.socket.send(data)
+            except socket.error, e:
+                if e.args[0] not in _WOULD_BLOCK:
+                    self.error = e
+                return
+            self.outgoing_size -= sent
+            self.offset += sent
+            if self.offset < len(data):
+                return
+            outgoing.popleft()
+            self.offset = 0
+
+    def wanted_events(self):
+        """Get the events the event loop should wait for.
+
+        Must be called with 'lock' held.  Reading stops while too many
+        requests are outstanding or too much output is queued, and starts
+        again once both have dropped to half their limits.
+        """
+        server = self.server
+        if self.reading:
+            if self.in_flight >= server.max_in_flight or self.outgoing_size > server.max_outgoing:
+                self.reading = False
+        elif self.in_flight <= server.max_in_flight // 2 and self.outgoing_size <= server.max_outgoing // 2:
+            self.reading = True
+        events = 0
+        if self.reading:
+            events |= _READ
+        if self.outgoing:
+            events |= _WRITE
+        return events
+
+
+class EventLoopServer(Server):
+    """Server handling all of its connections on a single thread.
+
+    Rather than a thread per connection, client sockets are non-blocking
+    and watched with epoll (or poll or select where epoll is missing), so
+    thousands of mostly idle connections cost little more than their
+    sockets.  Requests are still run on the pool of 'num_threads' threads.
+
+    A connection isn't read from while it has 'max_in_flight' requests
+    outstanding or more than 'max_outgoing' bytes of responses waiting to
+    be sent, so a client that doesn't read its responses can't make the
+    server queue work or buffer output without limit.
+    """
+
+    request_queue_size = 1024
+    max_in_flight = 64
+    max_outgoing = 4 * 1024 * 1024
+
+    def __init__(self, *args, **kwds):
+        super(EventLoopServer, self).__init__(*args, **kwds)
+        self.connections = {}
+        self._poller = None
+        self._wakeups = set()
+        self._wake_pending = False
+        self._wake_lock = threading.Lock()
+        (self._wake_r, self._wake_w) = _socketpair()
+        for sock in (self._wake_r, self._wake_w):
+            sock.setblocking(0)
+
+    def serve_forever(self):
+        if self.socket is None:
+            self.listen()
+        self.socket.setblocking(0)
+        self.pool = ThreadPool(self.num_threads, name='fs.expose.serve')
+        self._poller = poller = _Poller()
+        listen_fd = self.socket.fileno()
+        poller.register(listen_fd, _READ)
+        wake_fd = self._wake_r.fileno()
+        poller.register(wake_fd, _READ)
+
+        try:
+            while not self._closing:
+                for (fd, events) in poller.poll():
+                    if fd == listen_fd:
+                        self._accept()
+                    elif fd == wake_fd:
+                        self._handle_wakeups()
+                    else:
+                        connection = self.connections.get(fd)
+                        if connection is not None:
+                            self._handle_events(connection, events)
+        except KeyboardInterrupt:
+            pass
+
+        for connection in self.connections.values():
+            self._close_connection(connection)
+        with self._wake_lock:
+            #  Stop anyone writing to the closed socket.
+            self._wake_pending = True
+        poller.close()
+        self.socket.close()
+        self._wake_r.close()
+        self._wake_w.close()
+        self.pool.quit()
+
+    def shutdown(self):
+        """Stop serve_forever() and close all connections."""
+        self._closing = True
+        self._wake()
+
+    def _wake(self, connection=None):
+        """Wake the event loop, to update the events of 'connection'."""
+        with self._wake_lock:
+            if connection is not None:
+                self._wakeups.add(connection)
+            if self._wake_pending:
+                return
+            self._wake_pending = True
+        try:
+            self._wake_w.send('x')
+        except socket.error:
+            pass
+
+    def _handle_wakeups(self):
+        try:
+            self._wake_r.recv(4096)
+        except socket.error:
+            pass
+        with self._wake_lock:
+            connections = self._wakeups
+            self._wakeups = set()
+            self._wake_pending = False
+        for connection in connections:
+            self._update(connection)
+
+    def _accept(self):
+        while True:
+            try:
+                (clientsocket, address) = self.socket.accept()
+            except socket.error, e:
+                if e.args[0] in _WOULD_BLOCK or e.args[0] in (errno.ECONNABORTED, errno.EMFILE, errno.ENFILE):
+                    return
+                raise
+            clientsocket.setblocking(0)
+            clientsocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = _LoopConnection(self, clientsocket)
+            with self._lock:
+                self.connection_id += 1
+                connection_id = self.connection_id
+            connection.handler = self.connection_factory(self,
+                                                         connection_id,
+                                                         clientsocket,
+                                                         address,
+                                                         transport=connection)
+            with connection.lock:
+                connection.send()
+                connection.events = connection.wanted_events()
+            self.connections[connection.fileno] = connection
+            self._poller.register(connection.fileno, connection.events)
+
+    def _handle_events(self, connection, events):
+        if events & _ERROR:
+            self._close_connection(connection)
+            return
+        if events & _WRITE:
+            with connection.lock:
+                connection.send()
+        if events & _READ:
+            self._read(connection)
+        self._update(connection)
+
+    def _read(self, connection):
+        handler = connection.handler
+        try:
+            data = connection.socket.recv(READ_SIZE)
+        except socket.error, e:
+            if e.args[0] not in _WOULD_BLOCK:
+                connection.error = e
+                self._close_connection(connection)
+            return
+        if not data:
+            self._close_connection(connection)
+            return
+        try:
+            for (header, payload) in handler.decoder.feed(data):
+                if header.get('type') == 'rpc':
+                    with connection.lock:
+                        connection.in_flight += 1
+                handler.on_packet(header, payload)
+        except Exception, e:
+            #  A bad stream only fails its own connection, not the loop
+            #  serving all the others.
+            connection.error = e
+            self._close_connection(connection)
+
+    def _update(self, connection):
+        """Close 'connection' if it has failed, else update its events."""
+        if connection.closed:
+            return
+        if connection.error is not None:
+            self._close_connection(connection)
+            return
+        with connection.lock:
+            events = connection.wanted_events()
+            if events == connection.events:
+                return
+            connection.events = events
+        self._poller.modify(connection.fileno, events)
+
+    def _close_connection(self, connection):
+        if connection.closed:
+            return
+        self._poller.unregister(connection.fileno)
+        del self.connections[connection.fileno]
+        with connection.lock:
+            connection.closed = True
+            connection.outgoing.clear()
+        connection.handler.socket_error = connection.error
+        connection.handler.on_connection_close()
+
+
 if __name__ == "__main__":
     server = Server()
     server.serve_forever()
-    
\ No newline at end of file
@@ -94,13 +94,25 @@ class SFTPServerInterface(paramiko.SFTPServerInterface):
     If this all looks too complicated, you might consider the BaseSFTPServer
     class also provided by this module - it automatically creates the enclosing
     paramiko server infrastructure.
+
+    Directories are listed with a single listdirinfo() call, and the
+    attributes of the last directory listed are kept for 'attr_timeout'
+    seconds to answer the stat requests clients tend to follow a listing
+    with.  Any change made through this session drops them.  Files opened
+    for reading are read up to 'read_ahead' bytes at a time, so the small
+    pipelined reads of a client don't each reach the FS.
     """
 
-    def __init__(self, server, fs, encoding=None, *args, **kwds):
+    def __init__(self, server, fs, encoding=None, attr_timeout=1.0, read_ahead=256*1024, *args, **kwds):
         self.fs = fs
         if encoding is None:
             encoding = "utf8"
         self.encoding = encoding
+        self.attr_timeout = attr_timeout
+        self.read_ahead = read_ahead
+        #  (directory path, expiry time, dict of attributes by name) for
+        #  the last directory listed, or None.
+        self._listing = None
         super(SFTPServerInterface,self).__init__(server, *args, **kwds)
 
     def close(self):
@@ -110,26 +122,43 @@ class SFTPServerInterface(paramiko.SFTPServerInterface):
 
     @report_sftp_errors
     def open(self, path, flags, attr):
-        return SFTPHandle(self, path, flags)
+        handle = SFTPHandle(self, path, flags)
+        if handle.writable:
+            self._listing = None
+        return handle
 
     @report_sftp_errors
     def list_folder(self, path):
         if not isinstance(path, unicode):
             path = path.decode(self.encoding)
+        path = abspath(normpath(path))
         stats = []
-        for entry in self.fs.listdir(path, absolute=True):
-            stat = self.stat(entry)
-            if not isinstance(stat, int):
-                stats.append(stat)
+        attrs = {}
+        for (name, info) in self.fs.listdirinfo(path):
+            stat = self._make_attrs(pathjoin(path, name), info)
+            stats.append(stat)
+            attrs[name] = stat
+        if self.attr_timeout > 0:
+            self._listing = (path, time.time() + self.attr_timeout, attrs)
+        else:
+            self._listing = None
         return stats
 
     @report_sftp_errors
     def stat(self, path):
         if not isinstance(path, unicode):
             path = path.decode(self.encoding)
-
-        info = self.fs.getinfo(path)
-
+        if self._listing is not None:
+            (dir_path, expires, attrs) = self._listing
+            path = abspath(normpath(path))
+            if expires < time.time():
+                self._listing = None
+            elif dirname(path) == dir_path and basename(path) in attrs:
+                return attrs[basename(path)]
+        return self._make_attrs(path, self.fs.getinfo(path))
+
+    def _make_attrs(self, path, info):
+        """Build an SFTPAttributes object from the info dict for a path."""
         stat = paramiko.SFTPAttributes()
         stat.filename = basename(path).encode(self.encoding)
         stat.st_size = info.get("size")
@@ -158,6 +187,7 @@ class SFTPServerInterface(paramiko.SFTPServerInterface):
     def remove(self, path):
         if not isinstance(path, unicode):
             path = path.decode(self.encoding)
+        self._listing = None
         self.fs.remove(path)
         return paramiko.SFTP_OK
 
@@ -167,6 +197,7 @@ class SFTPServerInterface(paramiko.SFTPServerInterface):
             oldpath = oldpath.decode(self.encoding)
         if not isinstance(newpath, unicode):
             newpath = newpath.decode(self.encoding)
+        self._listing = None
         if self.fs.isfile(oldpath):
             self.fs.move(oldpath, newpath)
         else:
@@ -177,6 +208,7 @@ class SFTPServerInterface(paramiko.SFTPServerInterface):
     def mkdir(self, path, attr):
         if not isinstance(path, unicode):
             path = path.decode(self.encoding)
+        self._listing = None
         self.fs.makedir(path)
         return paramiko.SFTP_OK
 
@@ -184,6 +216,7 @@ class SFTPServerInterface(paramiko.SFTPServerInterface):
     def rmdir(self, path):
         if not isinstance(path, unicode):
             path = path.decode(self.encoding)
+        self._listing = None
         self.fs.removedir(path)
         return paramiko.SFTP_OK
 
@@ -202,6 +235,7 @@ class SFTPServerInterface(paramiko.SFTPServerInterface):
         if attr._flags:
             if attr._flags != attr.FLAG_SIZE:
                 raise UnsupportedError
+            self._listing = None
             with self.fs.open(path,"r+") as f:
                 f.truncate(attr.st_size)
         return paramiko.SFTP_OK
@@ -217,7 +251,10 @@ class SFTPHandle(paramiko.SFTPHandle):
     """SFTP file handler pointing to a file in an FS object.
 
     This is a simple file wrapper for SFTPServerInterface, passing read
-    and write requests directly through the to underlying file from the FS.
+    and write requests through to the underlying file from the FS.  The
+    file is only seeked when a request doesn't carry on from the previous
+    one, and files opened read-only are read ahead by the owner's
+    'read_ahead' bytes.
     """
 
     def __init__(self, owner, path, flags):
@@ -227,22 +264,55 @@ class SFTPHandle(paramiko.SFTPHandle):
         if not isinstance(path, unicode):
             path = path.decode(self.owner.encoding)
         self.path = path
+        self.writable = "w" in mode or "a" in mode or "+" in mode
         self._file = owner.fs.open(path, mode)
+        #  Where the file's position was left by the last request, or None
+        #  if it isn't known.
+        self._pos = 0
+        #  Data read ahead of the client, and the offset it starts at.
+        self._ahead = ""
+        self._ahead_offset = 0
 
     @report_sftp_errors
     def close(self):
+        self._ahead = ""
+        if self.writable:
+            self.owner._listing = None
         self._file.close()
         return paramiko.SFTP_OK
 
     @report_sftp_errors
     def read(self, offset, length):
-        self._file.seek(offset)
-        return self._file.read(length)
+        ahead = self._ahead
+        if ahead:
+            start = offset - self._ahead_offset
+            if 0 <= start and start + length <= len(ahead):
+                self._ahead = ahead[start + length:]
+                self._ahead_offset = offset + length
+                return ahead[start:start + length]
+            self._ahead = ""
+        if offset != self._pos:
+            self._pos = None
+            self._file.seek(offset)
+        read_ahead = 0
+        if not self.writable:
+            read_ahead = self.owner.read_ahead
+        data = self._file.read(max(length, read_ahead))
+        self._pos = offset + len(data)
+        if len(data) > length:
+            self._ahead = data[length:]
+            self._ahead_offset = offset + length
+            data = data[:length]
+        return data
 
     @report_sftp_errors
     def write(self, offset, data):
-        self._file.seek(offset)
+        self._ahead = ""
+        if offset != self._pos:
+            self._pos = None
+            self._file.seek(offset)
         self._file.write(data)
+        self._pos = offset + len(data)
         return paramiko.SFTP_OK
 
     def stat(self):
@@ -1,4 +1,5 @@
 template = """
+<%def name="header()">
 <html>
 
 <head>
@@ -48,6 +49,12 @@ table.dirlist tr:hover {
     background-color:#e9e9e9;
 }
 
+div.pages {
+    margin:12px auto;
+    text-align:center;
+    font-size:13px;
+}
+
 
 </style>
 
@@ -67,21 +74,42 @@ table.dirlist tr:hover {
         </tr>
     </thead>
     <tbody>
-        % for i, entry in enumerate(dirlist):
-        <tr class="${entry['type']} r${i%2}">
+</%def>
+
+<%def name="rows(entries, offset)">
+        % for i, entry in enumerate(entries):
+        <tr class="${entry['type']} r${(offset + i)%2}">
             <td><a class="link-${entry['type']}" href="${ entry['path'] }">${entry['name']}</a></td>
             <td>${entry['size']}</td>
             <td>${entry['created_time']}</td>
         </tr>
         % endfor
+</%def>
+
+<%def name="footer()">
     </tbody>
 
 </table>
 
+% if num_pages > 1:
+<div class="pages">
+    % for n in range(1, num_pages + 1):
+        % if n == page:
+    <b>${n}</b>
+        % else:
+    <a href="?page=${n}">${n}</a>
+        % endif
+    % endfor
+</div>
+% endif
+
 </div>
 
 </body>
 
 </html>
-
+</%def>
+${header()}
+${rows(dirlist, 0)}
+${footer()}
 """
\ No newline at end of file
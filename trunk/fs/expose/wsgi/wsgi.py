@@ -1,9 +1,17 @@
 
+from __future__ import with_statement
+
+import stat
+import time
 import urlparse
+import threading
 import mimetypes
 
 from fs.errors import FSError
 from fs.path import basename, pathsplit
+from fs.expose.httputil import http_date, last_modified, make_etag, not_modified, etag_matches, \
+                               if_range_matches, parse_range, content_range, \
+                               make_boundary, multipart_ranges
 
 from datetime import datetime
 
@@ -20,12 +28,66 @@ class Request(object):
         self.environ = environ
         self.start_response = start_response
         self.path = environ.get('PATH_INFO')
+        self.method = environ.get('REQUEST_METHOD', 'GET')
+
+
+class _Listing(object):
+    """A directory's sorted entries and the pages rendered from them"""
+    def __init__(self, stamp, etag, entries):
+        self.stamp = stamp
+        self.created = time.time()
+        self.etag = etag
+        self.entries = entries
+        self.pages = {}
+
+
+class _ListingCache(object):
+    """Least-recently-used cache of directory listings, keyed by path"""
+    def __init__(self, size):
+        self.size = size
+        self._listings = {}
+        self._tick = 0
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        with self._lock:
+            item = self._listings.get(path)
+            if item is None:
+                return None
+            self._tick += 1
+            item[0] = self._tick
+            return item[1]
+
+    def set(self, path, listing):
+        with self._lock:
+            self._tick += 1
+            self._listings[path] = [self._tick, listing]
+            if len(self._listings) > self.size:
+                oldest = min(self._listings, key=lambda p: self._listings[p][0])
+                del self._listings[oldest]
+
+    def discard(self, path):
+        with self._lock:
+            self._listings.pop(path, None)
+
+    def clear(self):
+        with self._lock:
+            self._listings.clear()
 
 
 class WSGIServer(object):
-    """Light-weight WSGI server that exposes an FS"""
+    """Light-weight WSGI server that exposes an FS
+
+    Directory indexes are split into pages of 'page_size' entries, and the
+    listings of up to 'cache_size' directories are kept along with their
+    rendered pages.  A cached listing is reused for up to 'cache_ttl'
+    seconds while its directory's modified time is unchanged.  If 'watch'
+    is true and the FS supports watchers (see fs.watch), listings are
+    instead kept until a change in their directory is reported.
+    """
 
-    def __init__(self, serve_fs, indexes=True, dir_template=None, chunk_size=16*1024*1024):
+    def __init__(self, serve_fs, indexes=True, dir_template=None, chunk_size=256*1024,
+                 page_size=1000, cache_size=64, cache_ttl=10, watch=False):
 
         if dir_template is None:
             from dirtemplate import template as dir_template
@@ -33,8 +95,32 @@ class WSGIServer(object):
         self.serve_fs = serve_fs
         self.indexes = indexes
         self.chunk_size = chunk_size
+        self.page_size = page_size
+        self.cache_ttl = cache_ttl
 
         self.dir_template = Template(dir_template)
+        self._streaming = all(self.dir_template.has_def(name)
+                              for name in ('header', 'rows', 'footer'))
+
+        self._listings = None
+        if cache_size:
+            self._listings = _ListingCache(cache_size)
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._watcher = None
+        if watch and self._listings is not None:
+            try:
+                self._watcher = serve_fs.add_watcher(self._on_change, '/')
+            except (AttributeError, FSError):
+                pass
+
+    def _on_change(self, event):
+        """Drop cached listings affected by a change to the FS"""
+        if event.path is None:
+            self._listings.clear()
+        else:
+            self._listings.discard(event.path)
+            self._listings.discard(pathsplit(event.path)[0])
 
     def __call__(self, environ, start_response):
 
@@ -52,60 +138,217 @@ class WSGIServer(object):
 
 
     def serve_file(self, request):
-        """Serve a file, guessing a mime-type"""
+        """Serve a file, guessing a mime-type
+
+        Responses carry ETag and Last-Modified validators, conditional
+        requests are answered with '304 NOT MODIFIED', and 'Range' requests
+        get just the requested bytes.  Whole files that have a system path
+        are handed to the server's 'wsgi.file_wrapper', which may send them
+        without copying (e.g. with sendfile).
+        """
         path = request.path
+        environ = request.environ
+        try:
+            info = self.serve_fs.getinfo(path)
+            file_size = info.get('size')
+            if file_size is None:
+                file_size = self.serve_fs.getsize(path)
+        except FSError, e:
+            return self.serve_500(request, str(e))
+
+        mime_type = mimetypes.guess_type(basename(path))[0] or b'text/plain'
+        validators = [(b'Accept-Ranges', b'bytes')]
+        etag = make_etag(info)
+        if etag is not None:
+            validators.append((b'ETag', bytes(etag)))
+        mtime = last_modified(info)
+        if mtime is not None:
+            validators.append((b'Last-Modified', bytes(http_date(mtime))))
+
+        if not_modified(info,
+                        environ.get('HTTP_IF_NONE_MATCH'),
+                        environ.get('HTTP_IF_MODIFIED_SINCE')):
+            request.start_response(b'304 NOT MODIFIED', validators)
+            return []
+
+        ranges = None
+        if if_range_matches(info, environ.get('HTTP_IF_RANGE')):
+            ranges = parse_range(environ.get('HTTP_RANGE'), file_size)
+        if ranges is not None and not ranges:
+            request.start_response(b'416 REQUESTED RANGE NOT SATISFIABLE',
+                                   [(b'Content-Range', b'bytes */%i' % file_size)])
+            return []
+
+        if not ranges:
+            status = b'200 OK'
+            headers = [(b'Content-Type', bytes(mime_type)),
+                       (b'Content-Length', bytes(file_size))]
+            parts = [('', 0, file_size)]
+            closing = ''
+        elif len(ranges) == 1:
+            (start, stop) = ranges[0]
+            status = b'206 PARTIAL CONTENT'
+            headers = [(b'Content-Type', bytes(mime_type)),
+                       (b'Content-Length', bytes(stop - start)),
+                       (b'Content-Range', bytes(content_range(start, stop, file_size)))]
+            parts = [('', start, stop)]
+            closing = ''
+        else:
+            boundary = make_boundary()
+            (parts, closing, length) = multipart_ranges(ranges, file_size,
+                                                        mime_type, boundary)
+            status = b'206 PARTIAL CONTENT'
+            headers = [(b'Content-Type', b'multipart/byteranges; boundary=' + boundary),
+                       (b'Content-Length', bytes(length))]
+        headers.extend(validators)
+
+        if request.method == 'HEAD':
+            request.start_response(status, headers)
+            return []
+
+        syspath = None
+        if not ranges and 'wsgi.file_wrapper' in environ:
+            syspath = self.serve_fs.getsyspath(path, allow_none=True)
         serving_file = None
         try:
-            serving_file = self.serve_fs.open(path, 'rb')
+            if syspath is not None:
+                serving_file = open(syspath, 'rb')
+            else:
+                serving_file = self.serve_fs.open(path, 'rb')
         except Exception, e:
             if serving_file is not None:
                 serving_file.close()
             return self.serve_500(request, str(e))
 
-        mime_type = mimetypes.guess_type(basename(path))[0] or b'text/plain'
-        file_size = self.serve_fs.getsize(path)
-        headers = [(b'Content-Type', bytes(mime_type)),
-                   (b'Content-Length', bytes(file_size))]
+        request.start_response(status, headers)
+        if syspath is not None:
+            return environ['wsgi.file_wrapper'](serving_file, self.chunk_size)
+        return self._iter_parts(serving_file, parts, closing)
 
-        def gen_file():
-            chunk_size = self.chunk_size
-            read = serving_file.read
-            try:
-                while 1:
-                    data = read(chunk_size)
+    def _iter_parts(self, serving_file, parts, closing):
+        """Generate the body for (header, start, stop) parts of a file"""
+        chunk_size = self.chunk_size
+        read = serving_file.read
+        pos = 0
+        try:
+            for header, start, stop in parts:
+                if header:
+                    yield header
+                if start != pos:
+                    serving_file.seek(start)
+                pos = start
+                while pos < stop:
+                    data = read(min(chunk_size, stop - pos))
                     if not data:
                         break
+                    pos += len(data)
                     yield data
-            finally:
-                serving_file.close()
-
-        request.start_response(b'200 OK',
-                               headers)
-        return gen_file()
+            if closing:
+                yield closing
+        finally:
+            serving_file.close()
 
     def serve_dir(self, request):
-        """Serve an index page"""
-        fs = self.serve_fs
-        isdir = fs.isdir
+        """Serve an index page
+
+        A long directory is split into pages, chosen with a 'page' query
+        parameter.  Pages are rendered from a cached listing when there is
+        a valid one, and new pages are streamed as they are rendered if the
+        template has 'header', 'rows' and 'footer' defs.
+        """
         path = request.path
-        dirinfo = fs.listdirinfo(path, full=True, absolute=True)
-        entries = []
+        try:
+            listing = self._get_listing(path)
+        except FSError, e:
+            return self.serve_500(request, str(e))
+
+        page_size = self.page_size or len(listing.entries) or 1
+        num_pages = max(1, (len(listing.entries) + page_size - 1) // page_size)
+        try:
+            page = int(urlparse.parse_qs(request.environ.get('QUERY_STRING', '')).get('page', [1])[0])
+        except ValueError:
+            page = 1
+        page = min(max(page, 1), num_pages)
+
+        etag = b'"%s-%i"' % (listing.etag, page)
+        headers = [(b'Content-Type', b'text/html'), (b'ETag', etag)]
+        if_none_match = request.environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match and etag_matches(etag, if_none_match):
+            request.start_response(b'304 NOT MODIFIED', [(b'ETag', etag)])
+            return []
+
+        html = listing.pages.get(page)
+        if html is not None:
+            headers.append((b'Content-Length', b'%i' % len(html)))
+            request.start_response(b'200 OK', headers)
+            return [html]
+
+        entries = listing.entries[(page - 1) * page_size:page * page_size]
+        if path not in ('', '/') and page == 1:
+            # Add an up dir link for non-root
+            entries.insert(0, dict(name='../', path='../', type="dir", size='', created_time='..'))
+        context = dict(fs=self.serve_fs,
+                       path=path,
+                       page=page,
+                       num_pages=num_pages)
+        if not self._streaming:
+            html = self.dir_template.render(dirlist=entries, **context).encode('utf-8')
+            listing.pages[page] = html
+            headers.append((b'Content-Length', b'%i' % len(html)))
+            request.start_response(b'200 OK', headers)
+            return [html]
+
+        request.start_response(b'200 OK', headers)
+        return self._stream_page(listing, page, entries, context)
+
+    def _stream_page(self, listing, page, entries, context):
+        """Render a page of a listing in batches, then cache it"""
+        template = self.dir_template
+        rendered = []
+        def render(name, *args):
+            html = template.get_def(name).render(*args, **context).encode('utf-8')
+            rendered.append(html)
+            return html
+        yield render('header')
+        batch_size = 200
+        for offset in xrange(0, len(entries), batch_size):
+            yield render('rows', entries[offset:offset + batch_size], offset)
+        yield render('footer')
+        listing.pages[page] = b''.join(rendered)
+
+    def _get_listing(self, path):
+        """Get the listing for a directory, from the cache if it is valid"""
+        fs = self.serve_fs
+        stamp = None
+        if self._watcher is None:
+            try:
+                stamp = fs.getinfo(path).get('modified_time')
+            except FSError:
+                pass
+        if self._listings is not None:
+            listing = self._listings.get(path)
+            if listing is not None:
+                if self._watcher is not None:
+                    return listing
+                if stamp == listing.stamp and time.time() - listing.created < self.cache_ttl:
+                    return listing
 
-        for p, info in dirinfo:
+        entries = []
+        no_time = datetime(1970, 1, 1, 1, 0)
+        for p, info in fs.listdirinfo(path, full=True, absolute=True):
             entry = {}
             entry['path'] = p
             entry['name'] = basename(p)
             entry['size'] = info.get('size', 'unknown')
             entry['created_time'] = info.get('created_time')
-            if isdir(p):
-                entry['type'] = 'dir'
+            if 'st_mode' in info:
+                isdir = stat.S_ISDIR(info['st_mode'])
             else:
-                entry['type'] = 'file'
-
+                isdir = fs.isdir(p)
+            entry['type'] = 'dir' if isdir else 'file'
             entries.append(entry)
 
         # Put dirs first, and sort by reverse created time order
-        no_time = datetime(1970, 1, 1, 1, 0)
         entries.sort(key=lambda k:(k['type'] == 'dir', k.get('created_time') or no_time), reverse=True)
 
         # Turn datetime to text and tweak names
@@ -116,19 +359,13 @@ class WSGIServer(object):
             if entry['type'] == 'dir':
                 entry['name'] += '/'
 
-        # Add an up dir link for non-root
-        if path not in ('', '/'):
-            entries.insert(0, dict(name='../', path='../', type="dir", size='', created_time='..'))
-
-        # Render the mako template
-        html = self.dir_template.render(**dict(fs=self.serve_fs,
-                                               path=path,
-                                               dirlist=entries)).encode('utf-8')
-        request.start_response(b'200 OK', [(b'Content-Type', b'text/html'),
-                                           (b'Content-Length', b'%i' % len(html))])
-
-        return [html]
-
+        with self._lock:
+            self._generation += 1
+            etag = '%x-%x' % (int(time.time()), self._generation)
+        listing = _Listing(stamp, etag, entries)
+        if self._listings is not None:
+            self._listings.set(path, listing)
+        return listing
 
     def serve_404(self, request, msg='Not found'):
         """Serves a Not found page"""
@@ -141,8 +378,8 @@ class WSGIServer(object):
         return [msg]
 
 
-def serve_fs(fs, indexes=True):
+def serve_fs(fs, indexes=True, **kwds):
     """Serves an FS object via WSGI"""
-    application = WSGIServer(fs, indexes)
+    application = WSGIServer(fs, indexes, **kwds)
     return application
 
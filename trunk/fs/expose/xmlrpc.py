@@ -8,6 +8,11 @@ This module provides the necessary infrastructure to expose an FS object
 over XML-RPC.  The main class is 'RPCFSServer', a SimpleXMLRPCServer subclass
 designed to expose an underlying FS.
 
+RPCFSServer handles a single request at a time.  ThreadedRPCFSServer serves
+several clients at once from a bounded pool of worker threads, and keeps
+connections open between requests (HTTP/1.1 keep-alive).  Both gzip large
+responses for clients that accept it, unless created with compress=False.
+
 If you need to use a more powerful server than SimpleXMLRPCServer, you can
 use the RPCFSInterface class to provide an XML-RPC-compatible wrapper around
 an FS object, which can then be exposed using whatever server you choose
@@ -16,9 +21,15 @@ an FS object, which can then be exposed using whatever server you choose
 """
 
 import xmlrpclib
-from SimpleXMLRPCServer import SimpleXMLRPCServer
+from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
 from datetime import datetime
+import threading
+import time
+import socket
 import base64
+import Queue as queue
+
+from fs.errors import ResourceNotFoundError
 
 import six
 from six import PY3
@@ -28,9 +39,23 @@ class RPCFSInterface(object):
     """Wrapper to expose an FS via a XML-RPC compatible interface.
 
     The only real trick is using xmlrpclib.Binary objects to transport
-    the contents of files.
+    the contents of files.  Small files can be transferred whole with
+    get_contents and set_contents; larger ones can be opened as a handle
+    and accessed in chunks with read_file, write_file and friends.  Since
+    XML-RPC integers are limited to 32 bits, file offsets and sizes are
+    sent as strings.
+
+    Methods such as listdirinfo, getinfo_many and walk return the results
+    of many operations at once, to save a request per item.
+
+    A client that goes away can't close its files, so a handle not used for
+    'file_timeout' seconds is closed, as is the least recently used handle
+    when more than 'max_files' are open.
     """
 
+    file_timeout = 600
+    max_files = 1000
+
     # info keys are restricted to a subset known to work over xmlrpc
     # This fixes an issue with transporting Longs on Py3
     _allowed_info = ["size",
@@ -44,6 +69,11 @@ class RPCFSInterface(object):
     def __init__(self, fs):
         super(RPCFSInterface, self).__init__()
         self.fs = fs
+        #  Open files and the time each was last used, indexed by handle.
+        self._files = {}
+        self._files_lock = threading.Lock()
+        self._next_handle = 1
+        self._next_expiry = 0
 
     def encode_path(self, path):
         """Encode a filesystem path for sending over the wire.
@@ -83,6 +113,83 @@ class RPCFSInterface(object):
         path = self.decode_path(path)
         self.fs.setcontents(path, data.data)
 
+    def open_file(self, path, mode="r"):
+        """Open a file, returning a handle and the file's current size."""
+        path = self.decode_path(path)
+        mode = mode.replace("t", "").replace("-", "")
+        if "b" not in mode:
+            mode += "b"
+        f = self.fs.open(path, mode)
+        try:
+            f.seek(0, 2)
+            size = f.tell()
+            if "a" not in mode:
+                f.seek(0)
+        except Exception:
+            f.close()
+            raise
+        with self._files_lock:
+            handle = self._next_handle
+            self._next_handle += 1
+            self._files[handle] = [f, time.time()]
+        self._expire_files(force=len(self._files) > self.max_files)
+        return [handle, str(size)]
+
+    def _get_file(self, handle):
+        self._expire_files()
+        try:
+            entry = self._files[handle]
+        except KeyError:
+            raise ValueError("invalid file handle: %r" % (handle,))
+        entry[1] = time.time()
+        return entry[0]
+
+    def _expire_files(self, force=False):
+        """Close files that are idle or beyond max_files.
+
+        Open files are only checked every tenth of file_timeout, unless
+        'force' is true.
+        """
+        now = time.time()
+        if not force and now < self._next_expiry:
+            return
+        with self._files_lock:
+            self._next_expiry = now + self.file_timeout / 10.0
+            by_use = sorted(self._files.iteritems(), key=lambda item: item[1][1])
+            num_extra = len(by_use) - self.max_files
+            expired = []
+            for (i, (handle, (f, last_used))) in enumerate(by_use):
+                if i < num_extra or now - last_used > self.file_timeout:
+                    del self._files[handle]
+                    expired.append(f)
+        for f in expired:
+            try:
+                f.close()
+            except Exception:
+                pass
+
+    def read_file(self, handle, offset, size):
+        f = self._get_file(handle)
+        f.seek(int(offset))
+        return xmlrpclib.Binary(f.read(int(size)))
+
+    def write_file(self, handle, offset, data):
+        f = self._get_file(handle)
+        f.seek(int(offset))
+        f.write(data.data)
+
+    def truncate_file(self, handle, size):
+        self._get_file(handle).truncate(int(size))
+
+    def flush_file(self, handle):
+        self._get_file(handle).flush()
+
+    def close_file(self, handle):
+        with self._files_lock:
+            entry = self._files.pop(handle, None)
+        if entry is not None:
+            entry[0].close()
+
     def exists(self, path):
         path = self.decode_path(path)
         return self.fs.exists(path)
@@ -100,6 +207,17 @@ class RPCFSInterface(object):
         entries = self.fs.listdir(path, wildcard, full, absolute, dirs_only, files_only)
         return [self.encode_path(e) for e in entries]
 
+    def listdirinfo(self, path="./", wildcard=None, full=False, absolute=False, dirs_only=False, files_only=False):
+        path = self.decode_path(path)
+        entries = self.fs.listdirinfo(path, wildcard, full, absolute, dirs_only, files_only)
+        return [[self.encode_path(e), self._filter_info(info)]
+                for (e, info) in entries]
+
+    def walk(self, path="/", wildcard=None, dir_wildcard=None, search="breadth", ignore_errors=False):
+        path = self.decode_path(path)
+        return [[self.encode_path(dirpath), [self.encode_path(f) for f in files]]
+                for (dirpath, files) in self.fs.walk(path, wildcard, dir_wildcard, search, ignore_errors)]
+
     def makedir(self, path, recursive=False, allow_recreate=False):
         path = self.decode_path(path)
         return self.fs.makedir(path, recursive, allow_recreate)
@@ -127,10 +245,21 @@ class RPCFSInterface(object):
 
     def getinfo(self, path):
         path = self.decode_path(path)
-        info = self.fs.getinfo(path)
-        info = dict((k, v) for k, v in info.iteritems()
+        return self._filter_info(self.fs.getinfo(path))
+
+    def getinfo_many(self, paths):
+        """Get the info for several paths, with None for any that are missing."""
+        infos = []
+        for path in paths:
+            try:
+                infos.append(self.getinfo(path))
+            except ResourceNotFoundError:
+                infos.append(None)
+        return infos
+
+    def _filter_info(self, info):
+        return dict((k, v) for k, v in info.iteritems()
                     if k in self._allowed_info)
-        return info
 
     def desc(self, path):
         path = self.decode_path(path)
@@ -176,6 +305,29 @@ class RPCFSInterface(object):
         return self.fs.copydir(src, dst, overwrite, ignore_errors, chunk_size)
 
 
+class RPCFSRequestHandler(SimpleXMLRPCRequestHandler):
+    """Request handler for RPCFSServer.
+
+    This speaks HTTP/1.1 when the server's 'keep_alive' attribute is set,
+    closing connections that have been idle for 'keep_alive_timeout'
+    seconds, and only gzips responses if the server's 'compress' attribute
+    is set.
+    """
+
+    def setup(self):
+        if self.server.keep_alive:
+            self.protocol_version = "HTTP/1.1"
+            self.timeout = self.server.keep_alive_timeout
+        if not self.server.compress:
+            self.encode_threshold = None
+        SimpleXMLRPCRequestHandler.setup(self)
+
+    def log_message(self, format, *args):
+        #  Idle keep-alive connections timing out are reported as errors.
+        if self.server.logRequests:
+            SimpleXMLRPCRequestHandler.log_message(self, format, *args)
+
+
 class RPCFSServer(SimpleXMLRPCServer):
     """Server to expose an FS object via XML-RPC.
 
@@ -191,17 +343,97 @@ class RPCFSServer(SimpleXMLRPCServer):
     attribute "serve_more_requests" to False.
     """
 
-    def __init__(self, fs, addr, requestHandler=None, logRequests=None):
+    keep_alive = False
+    keep_alive_timeout = 30
+
+    def __init__(self, fs, addr, requestHandler=None, logRequests=None, compress=True):
         kwds = dict(allow_none=True)
-        if requestHandler is not None:
-            kwds['requestHandler'] = requestHandler
+        if requestHandler is None:
+            requestHandler = RPCFSRequestHandler
+        kwds['requestHandler'] = requestHandler
         if logRequests is not None:
             kwds['logRequests'] = logRequests
+        self.compress = compress
         self.serve_more_requests = True
         SimpleXMLRPCServer.__init__(self, addr, **kwds)
         self.register_instance(RPCFSInterface(fs))
+        self.register_multicall_functions()
 
     def serve_forever(self):
         """Override serve_forever to allow graceful shutdown."""
         while self.serve_more_requests:
             self.handle_request()
+
+
+class ThreadedRPCFSServer(RPCFSServer):
+    """RPCFSServer that serves many clients at once.
+
+    Connections are handed to a pool of up to 'max_workers' threads, which
+    are started as needed; once they are all busy, further connections wait
+    until one becomes free.  Each connection is kept open for further
+    requests until the client closes it or it has been idle for
+    'keep_alive_timeout' seconds.
+    """
+
+    keep_alive = True
+    request_queue_size = 64
+
+    def __init__(self, fs, addr, requestHandler=None, logRequests=None, compress=True, max_workers=16):
+        self.max_workers = max_workers
+        self._requests = queue.Queue()
+        self._workers = []
+        self._idle_workers = 0
+        self._active = set()
+        self._workers_lock = threading.Lock()
+        self._closing = False
+        RPCFSServer.__init__(self, fs, addr, requestHandler, logRequests, compress)
+
+    def process_request(self, request, client_address):
+        with self._workers_lock:
+            if self._idle_workers <= self._requests.qsize() and \
+               len(self._workers) < self.max_workers:
+                t = threading.Thread(target=self._work)
+                t.daemon = True
+                t.start()
+                self._workers.append(t)
+        self._requests.put((request, client_address))
+
+    def _work(self):
+        while True:
+            with self._workers_lock:
+                self._idle_workers += 1
+            job = self._requests.get()
+            with self._workers_lock:
+                self._idle_workers -= 1
+            if job is None:
+                break
+            (request, client_address) = job
+            with self._workers_lock:
+                closing = self._closing
+                self._active.add(request)
+            try:
+                if not closing:
+                    self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                with self._workers_lock:
+                    self._active.discard(request)
+                self.shutdown_request(request)
+
+    def server_close(self):
+        RPCFSServer.server_close(self)
+        with self._workers_lock:
+            self._closing = True
+            workers = self._workers
+            self._workers = []
+            for t in workers:
+                self._requests.put(None)
+            #  Wake up workers waiting on idle keep-alive connections.
+            for request in self._active:
+                try:
+                    request.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+        for t in workers:
+            t.join()
@@ -1,191 +1,471 @@
-# Work in Progress - Do not use
+"""
+fs.remotefs
+===========
+
+Access a filesystem served by :class:`fs.expose.serve.server.Server`.
+
+The server and client talk a simple packet protocol (see
+:mod:`fs.expose.serve.packetstream`) over a single socket: each request
+carries a reference that is echoed in its response, so any number of
+requests from any number of threads can be in flight at once.  File
+contents are streamed in chunks, with writes and read-ahead pipelined so
+that a large transfer doesn't wait a round trip per chunk.
+
+Example::
+
+    fs = RemoteFS("my.server.com", 3000)
+
+"""
+
 from __future__ import with_statement
-from fs.base import FS
-from fs.expose.serve import packetstream
 
-from collections import defaultdict
+import socket
 import threading
-from threading import Lock, RLock
-from json import dumps
+from collections import deque
 import Queue as queue
-import socket
 
+from fs.base import *
+from fs.errors import *
+from fs.path import *
+from fs import iotools
+from fs.filelike import FileLikeBase
+from fs.expose.serve import packetstream
+from fs.expose.serve.protocol import PRELUDE, CHUNK_SIZE, READ_SIZE, \
+    encode_time, decode_info, decode_error
+
+import six
 from six import b
 
 
+#  Maximum number of chunks written without waiting for the server.
+MAX_PENDING_WRITES = 16
+
+#  Maximum number of chunks requested ahead of a sequential reader.
+MAX_READ_AHEAD = 8
+
+#  setcontents() sends strings up to this size in a single request.
+MAX_SETCONTENTS_SIZE = 4 * 1024 * 1024
+
+
 class PacketHandler(threading.Thread):
-    
+    """Thread that reads responses from the server and hands them to callers.
+
+    send_packet() gives each request a new 'client_ref' and returns it;
+    get_packet() then waits for the response with that reference.  If the
+    connection is lost, anything waiting gets a RemoteConnectionError.
+    """
+
     def __init__(self, transport, prelude_callback=None):
         super(PacketHandler, self).__init__()
+        self.daemon = True
         self.transport = transport
         self.encoder = packetstream.JSONFileEncoder(transport)
-        self.decoder = packetstream.JSONDecoder(prelude_callback=None)
-        
-        self.queues = defaultdict(queue.Queue)            
+        self.decoder = packetstream.JSONDecoder(prelude_callback=prelude_callback)
+
+        self._pending = {}
         self._encoder_lock = threading.Lock()
-        self._queues_lock = threading.Lock()
-        self._call_id_lock = threading.Lock()
-        
+        self._pending_lock = threading.Lock()
+        self.closed = False
+
         self.call_id = 0
-                
+
     def run(self):
         decoder = self.decoder
         read = self.transport.read
         on_packet = self.on_packet
-        while True:
-            data = read(1024*16)
-            if not data:
-                print "No data"
-                break
-            print "data", repr(data)            
-            for header, payload in decoder.feed(data):
-                print repr(header)
-                print repr(payload)
-                on_packet(header, payload)
-             
-    def _new_call_id(self):
-        with self._call_id_lock:
-            self.call_id += 1
-            return self.call_id
-             
-    def get_thread_queue(self, queue_id=None):
-        if queue_id is None:
-            queue_id = threading.current_thread().ident
-        with self._queues_lock:
-            return self.queues[queue_id]
-             
+        try:
+            while True:
+                data = read(READ_SIZE)
+                if not data:
+                    break
+                for header, payload in decoder.feed(data):
+                    on_packet(header, payload)
+        except packetstream.DecoderError:
+            pass
+        finally:
+            with self._pending_lock:
+                self.closed = True
+                waiting = self._pending.values()
+            for response_queue in waiting:
+                response_queue.put(None)
+
     def send_packet(self, header, payload=''):
-        call_id = self._new_call_id()                
-        queue_id = threading.current_thread().ident        
-        client_ref = "%i:%i" % (queue_id, call_id)        
-        header['client_ref'] = client_ref
-        
-        with self._encoder_lock:
-            self.encoder.write(header, payload)
-            
+        response_queue = queue.Queue(1)
+        with self._pending_lock:
+            if self.closed:
+                raise RemoteConnectionError(msg="connection to server closed")
+            self.call_id += 1
+            call_id = self.call_id
+            self._pending[call_id] = response_queue
+        header['client_ref'] = call_id
+        try:
+            with self._encoder_lock:
+                self.encoder.write(header, payload)
+        except socket.error, e:
+            with self._pending_lock:
+                del self._pending[call_id]
+            raise RemoteConnectionError(msg="error sending to server", details=e)
         return call_id
-        
+
     def get_packet(self, call_id):
-        
-        if call_id is not None:
-            queue_id = threading.current_thread().ident        
-            client_ref = "%i:%i" % (queue_id, call_id)
-        else:
-            client_ref = None
-        
-        queue = self.get_thread_queue()
-        
-        while True:        
-            header, payload = queue.get()
-            print repr(header)
-            print repr(payload)
-            if client_ref is not None and header.get('client_ref') != client_ref:
-                continue
-            break                
-        
-        return header, payload
-                
+        with self._pending_lock:
+            response_queue = self._pending[call_id]
+        packet = response_queue.get()
+        with self._pending_lock:
+            del self._pending[call_id]
+        if packet is None:
+            raise RemoteConnectionError(msg="connection to server closed")
+        return packet
+
     def on_packet(self, header, payload):
-        client_ref = header.get('client_ref', '')
-        queue_id, call_id = client_ref.split(':', 1)
-        queue_id = int(queue_id)
-        #queue_id = header.get('queue_id', '')
-        queue = self.get_thread_queue(queue_id)        
-        queue.put((header, payload))
-     
-     
+        with self._pending_lock:
+            response_queue = self._pending.get(header.get('client_ref'))
+        if response_queue is not None:
+            response_queue.put((header, payload))
+
+
 class _SocketFile(object):
     def __init__(self, socket):
         self.socket = socket
-        
+
     def read(self, size):
         try:
             return self.socket.recv(size)
-        except:           
-            return b('')        
-    
+        except socket.error:
+            return b('')
+
     def write(self, data):
         self.socket.sendall(data)
-        
+
+    def writev(self, buffers):
+        for data in buffers:
+            self.socket.sendall(data)
+
     def close(self):
-        self.socket.shutdown(socket.SHUT_RDWR)
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
         self.socket.close()
-     
 
-class _RemoteFile(object):
-    
-    def __init__(self, path, connection):
+
+class RemoteFile(FileLikeBase):
+    """A file opened on the server through RemoteFS.
+
+    Writes are sent in CHUNK_SIZE packets without waiting for a reply, up
+    to MAX_PENDING_WRITES at a time, so errors from a write may only be
+    raised by a later write, flush() or close().  Sequential reads request
+    chunks ahead of the current position, starting with one and doubling
+    up to MAX_READ_AHEAD while the reader keeps going.
+    """
+
+    def __init__(self, fs, path, mode, handle, size):
+        super(RemoteFile, self).__init__(bufsize=CHUNK_SIZE)
+        self.fs = fs
         self.path = path
-        self.connection = connection  
+        self.mode = mode
+        self.handle = handle
+        self.size = size
+        self._pos = 0
+        if "a" in mode:
+            self._pos = size
+        self._pending = deque()
+        self._read_ahead = deque()
+        self._read_window = 1
+        self._closing = False
+
+    def _wait_pending(self, max_pending=0):
+        """Wait until at most 'max_pending' calls are still outstanding."""
+        error = None
+        while len(self._pending) > max_pending:
+            try:
+                self.fs._get_response(self._pending.popleft())
+            except Exception, e:
+                if error is None:
+                    error = e
+        if error is not None:
+            raise error
+
+    def _cancel_read_ahead(self):
+        while self._read_ahead:
+            (offset, call_id) = self._read_ahead.popleft()
+            try:
+                self.fs._get_response(call_id)
+            except Exception:
+                pass
+        self._read_window = 1
+
+    def _request_read(self, offset):
+        call_id = self.fs._send_call("read_file", (self.handle, offset, CHUNK_SIZE))
+        self._read_ahead.append((offset, call_id))
+
+    def _read(self, sizehint=-1):
+        if not self._read_ahead or self._read_ahead[0][0] != self._pos:
+            self._cancel_read_ahead()
+        while len(self._read_ahead) < self._read_window:
+            if self._read_ahead:
+                self._request_read(self._read_ahead[-1][0] + CHUNK_SIZE)
+            else:
+                self._request_read(self._pos)
+        (offset, call_id) = self._read_ahead.popleft()
+        data = self.fs._get_response(call_id)[1]
+        if not data:
+            self._cancel_read_ahead()
+            return None
+        self._pos += len(data)
+        if len(data) == CHUNK_SIZE:
+            self._read_window = min(self._read_window * 2, MAX_READ_AHEAD)
+        return data
+
+    def _write(self, data, flushing=False):
+        if self._read_ahead:
+            self._cancel_read_ahead()
+        if "a" in self.mode:
+            self._pos = self.size
+        for offset in xrange(0, len(data), CHUNK_SIZE):
+            chunk = data[offset:offset+CHUNK_SIZE]
+            call_id = self.fs._send_call("write_file", (self.handle, self._pos), payload=chunk)
+            self._pending.append(call_id)
+            self._pos += len(chunk)
+            self._wait_pending(MAX_PENDING_WRITES)
+        self.size = max(self.size, self._pos)
+
+    def _seek(self, offset, whence):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += self.size
+        self._pos = offset
+
+    def _tell(self):
+        return self._pos
+
+    def _truncate(self, size):
+        self._cancel_read_ahead()
+        self._pending.append(self.fs._send_call("truncate_file", (self.handle, size)))
+        self._wait_pending()
+        self.size = size
+
+    def flush(self):
+        super(RemoteFile, self).flush()
+        #  When closing, outstanding writes are waited for by close().
+        if self._pending and not self._closing:
+            self._pending.append(self.fs._send_call("flush_file", (self.handle,)))
+            self._wait_pending()
+
+    def close(self):
+        if not hasattr(self, "closed"):
+            FileLikeBase.__init__(self)
+        if not self.closed:
+            self._closing = True
+            try:
+                super(RemoteFile, self).close()
+            finally:
+                self._cancel_read_ahead()
+                self._pending.append(self.fs._send_call("close_file", (self.handle,)))
+                self._wait_pending()
+
 
 class RemoteFS(FS):
-    
-    _meta = { 'thead_safe' : True,
+    """Access a filesystem served by fs.expose.serve.server.Server.
+
+    All threads share one connection to the server, and don't wait for
+    each other's requests to complete.
+    """
+
+    _meta = { 'thread_safe' : True,
               'network' : True,
               'virtual' : False,
               'read_only' : False,
               'unicode_paths' : True,
               }
-    
+
     def __init__(self, addr='', port=3000, username=None, password=None, resource=None, transport=None):
+        super(RemoteFS, self).__init__(thread_synchronize=False)
         self.addr = addr
         self.port = port
-        self.username = None
-        self.password = None
-        self.resource = None
+        self.username = username
+        self.password = password
+        self.resource = resource
         self.transport = transport
+        self._connect()
+
+    def _connect(self):
         if self.transport is None:
             self.transport = self._open_connection()
-        self.packet_handler = PacketHandler(self.transport)  
-        self.packet_handler.start()  
-        
+        self.packet_handler = PacketHandler(self.transport)
+        self.packet_handler.start()
+
         self._remote_call('auth',
-                          username=username,
-                          password=password,
-                          resource=resource)
-        
+                          username=self.username,
+                          password=self.password,
+                          resource=self.resource)
+
     def _open_connection(self):
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((self.addr, self.port))
+        try:
+            sock.connect((self.addr, self.port))
+        except socket.error, e:
+            sock.close()
+            raise RemoteConnectionError(msg="unable to connect to %s:%s" % (self.addr, self.port), details=e)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         socket_file = _SocketFile(sock)
-        socket_file.write(b('pyfs/0.1\n'))
+        socket_file.write(b(PRELUDE))
         return socket_file
-    
-    def _make_call(self, method_name, *args, **kwargs):
+
+    def __str__(self):
+        return '<RemoteFS: %s:%s>' % (self.addr, self.port)
+
+    __repr__ = __str__
+
+    def __getstate__(self):
+        state = super(RemoteFS, self).__getstate__()
+        del state['transport']
+        del state['packet_handler']
+        return state
+
+    def __setstate__(self, state):
+        super(RemoteFS, self).__setstate__(state)
+        self.transport = None
+        self._connect()
+
+    def _send_call(self, method_name, args=(), kwargs={}, payload=''):
+        """Send a request without waiting for the response."""
         call = dict(type='rpc',
                     method=method_name,
                     args=args,
                     kwargs=kwargs)
-        return call        
-        
-    def _remote_call(self, method_name, *args, **kwargs):
-        call = self._make_call(method_name, *args, **kwargs)
-        call_id = self.packet_handler.send_packet(call)
-        header, payload = self.packet_handler.get_packet(call_id)
-        return header, payload
-    
-    def ping(self, msg):
-        call_id = self.packet_handler.send_packet({'type':'rpc', 'method':'ping'}, msg)
+        return self.packet_handler.send_packet(call, payload)
+
+    def _get_response(self, call_id):
+        """Wait for the response to a request, returning (result, payload)."""
         header, payload = self.packet_handler.get_packet(call_id)
-        print "PING"
-        print header
-        print payload
-    
+        if header.get('type') == 'rpcerror':
+            raise decode_error(header.get('error', {}))
+        return header.get('response'), payload
+
+    def _remote_call(self, method_name, *args, **kwargs):
+        call_id = self._send_call(method_name, args, kwargs)
+        return self._get_response(call_id)[0]
+
+    def ping(self, msg=''):
+        call_id = self._send_call('ping', payload=msg)
+        return self._get_response(call_id)[1]
+
     def close(self):
-        self.transport.close()
-        self.packet_handler.join()
-    
-    def open(self, path, mode="r", **kwargs):
-        pass
-    
+        if not self.closed:
+            self.transport.close()
+            self.packet_handler.join()
+        super(RemoteFS, self).close()
+
+    def getmeta(self, meta_name, default=NoDefaultMeta):
+        try:
+            return self._remote_call('getmeta', meta_name)
+        except NoMetaError:
+            if default is NoDefaultMeta:
+                raise
+            return default
+
+    def hasmeta(self, meta_name):
+        return self._remote_call('hasmeta', meta_name)
+
+    @iotools.filelike_to_stream
+    def open(self, path, mode='r', buffering=-1, encoding=None, errors=None, newline=None, line_buffering=False, **kwargs):
+        (handle, size) = self._remote_call('open_file', path, mode)
+        return RemoteFile(self, path, mode, handle, size)
+
+    def getcontents(self, path, mode='rb', encoding=None, errors=None, newline=None):
+        if 'b' not in mode:
+            return super(RemoteFS, self).getcontents(path, mode, encoding, errors, newline)
+        call_id = self._send_call('getcontents', (path,))
+        return self._get_response(call_id)[1]
+
+    def setcontents(self, path, data=b'', encoding=None, errors=None, chunk_size=1024 * 64):
+        if not isinstance(data, six.binary_type) or len(data) > MAX_SETCONTENTS_SIZE:
+            return super(RemoteFS, self).setcontents(path, data, encoding, errors, chunk_size)
+        call_id = self._send_call('setcontents', (path,), payload=data)
+        self._get_response(call_id)
+        return len(data)
+
     def exists(self, path):
-        remote = self._remote_call('exists', path)
-        return remote.get('response')
-        
-        
-
-if __name__ == "__main__":
-    
-    rfs = RemoteFS()    
-    rfs.close()
-    
+        return self._remote_call('exists', path)
+
+    def isdir(self, path):
+        return self._remote_call('isdir', path)
+
+    def isfile(self, path):
+        return self._remote_call('isfile', path)
+
+    def listdir(self, path="./", wildcard=None, full=False, absolute=False, dirs_only=False, files_only=False):
+        if not callable(wildcard):
+            return self._remote_call('listdir', path, wildcard, full, absolute, dirs_only, files_only)
+        entries = self._remote_call('listdir', path, None, False, False, dirs_only, files_only)
+        entries = [e for e in entries if wildcard(e)]
+        if full:
+            entries = [relpath(pathjoin(path, e)) for e in entries]
+        elif absolute:
+            entries = [abspath(pathjoin(path, e)) for e in entries]
+        return entries
+
+    def listdirinfo(self, path="./", wildcard=None, full=False, absolute=False, dirs_only=False, files_only=False):
+        if not callable(wildcard):
+            entries = self._remote_call('listdirinfo', path, wildcard, full, absolute, dirs_only, files_only)
+            return [(e, decode_info(info)) for (e, info) in entries]
+        entries = self._remote_call('listdirinfo', path, None, False, False, dirs_only, files_only)
+        entries = [(e, decode_info(info)) for (e, info) in entries if wildcard(e)]
+        if full:
+            entries = [(relpath(pathjoin(path, e)), info) for (e, info) in entries]
+        elif absolute:
+            entries = [(abspath(pathjoin(path, e)), info) for (e, info) in entries]
+        return entries
+
+    def walk(self, path="/", wildcard=None, dir_wildcard=None, search="breadth", ignore_errors=False):
+        #  Callable wildcards can't be sent to the server, so walk locally.
+        if callable(wildcard) or callable(dir_wildcard):
+            for item in super(RemoteFS, self).walk(path, wildcard, dir_wildcard, search, ignore_errors):
+                yield item
+            return
+        for (dirpath, files) in self._remote_call('walk', path, wildcard, dir_wildcard, search, ignore_errors):
+            yield (dirpath, files)
+
+    def makedir(self, path, recursive=False, allow_recreate=False):
+        self._remote_call('makedir', path, recursive, allow_recreate)
+
+    def remove(self, path):
+        self._remote_call('remove', path)
+
+    def removedir(self, path, recursive=False, force=False):
+        self._remote_call('removedir', path, recursive, force)
+
+    def rename(self, src, dst):
+        self._remote_call('rename', src, dst)
+
+    def settimes(self, path, accessed_time=None, modified_time=None):
+        self._remote_call('settimes', path, encode_time(accessed_time), encode_time(modified_time))
+
+    def getinfo(self, path):
+        return decode_info(self._remote_call('getinfo', path))
+
+    def getinfo_many(self, paths):
+        """Get the info for several paths in a single request.
+
+        Returns a list of info dicts in the same order as 'paths', with
+        None in place of any path that does not exist.
+        """
+        return [info and decode_info(info)
+                for info in self._remote_call('getinfo_many', paths)]
+
+    def desc(self, path):
+        return self._remote_call('desc', path)
+
+    def copy(self, src, dst, overwrite=False, chunk_size=1024 * 64):
+        self._remote_call('copy', src, dst, overwrite)
+
+    def move(self, src, dst, overwrite=False, chunk_size=16384):
+        self._remote_call('move', src, dst, overwrite)
+
+    def copydir(self, src, dst, overwrite=False, ignore_errors=False, chunk_size=16384):
+        self._remote_call('copydir', src, dst, overwrite, ignore_errors)
+
+    def movedir(self, src, dst, overwrite=False, ignore_errors=False, chunk_size=16384):
+        self._remote_call('movedir', src, dst, overwrite, ignore_errors)
@@ -17,12 +17,22 @@ from fs.errors import *
 from fs.path import *
 from fs import iotools
 
-from fs.filelike import StringIO
+from fs.filelike import FileLikeBase
 
 import six
 from six import PY3, b
 
 
+#  Files are read and written in requests of at most this many bytes.
+CHUNK_SIZE = 256 * 1024
+
+#  Modified data is sent to the server once this much has accumulated.
+MAX_DIRTY_SIZE = 4 * 1024 * 1024
+
+#  Requests larger than this are gzipped, if the server supports it.
+GZIP_THRESHOLD = 1400
+
+
 def re_raise_faults(func):
     """Decorator to re-raise XML-RPC faults as proper exceptions."""
     def wrapper(*args, **kwds):
@@ -88,6 +98,175 @@ class ReRaiseFaults:
         return val
 
 
+def _negotiate_gzip(transport, response):
+    #  A gzipped response shows that the server also accepts gzipped requests.
+    if transport.accept_gzip_encoding and transport.encode_threshold is None:
+        if response.getheader("content-encoding", "") == "gzip":
+            transport.encode_threshold = GZIP_THRESHOLD
+
+
+class RPCFSTransport(xmlrpclib.Transport):
+    """XML-RPC transport for RPCFS.
+
+    If 'compress' is true this accepts gzipped responses, and once the
+    server has sent one it starts gzipping large requests as well.  The
+    connection is kept open between requests if the server allows it.
+    """
+
+    def __init__(self, use_datetime=0, compress=True):
+        xmlrpclib.Transport.__init__(self, use_datetime)
+        self.accept_gzip_encoding = compress
+
+    def parse_response(self, response):
+        _negotiate_gzip(self, response)
+        return xmlrpclib.Transport.parse_response(self, response)
+
+
+class SafeRPCFSTransport(xmlrpclib.SafeTransport):
+    """Version of RPCFSTransport for https URIs."""
+
+    def __init__(self, use_datetime=0, compress=True):
+        xmlrpclib.SafeTransport.__init__(self, use_datetime)
+        self.accept_gzip_encoding = compress
+
+    def parse_response(self, response):
+        _negotiate_gzip(self, response)
+        return xmlrpclib.SafeTransport.parse_response(self, response)
+
+
+class RPCFile(FileLikeBase):
+    """A file opened on a remote server through RPCFS.
+
+    Data is read from the server in chunks of CHUNK_SIZE bytes.  Writes
+    are collected locally as a list of modified ("dirty") byte ranges,
+    which are sent to the server when the file is flushed or closed, or
+    once more than MAX_DIRTY_SIZE bytes are waiting.  Only the modified
+    ranges are ever sent, rather than the whole file, and they are sent
+    together in as few multicall requests as possible.
+    """
+
+    def __init__(self, fs, path, mode, handle, size):
+        super(RPCFile, self).__init__(bufsize=CHUNK_SIZE)
+        self.fs = fs
+        self.path = path
+        self.mode = mode
+        self.handle = handle
+        self.size = size
+        self._pos = 0
+        if "a" in mode:
+            self._pos = size
+        self._dirty = []
+        self._dirty_size = 0
+        self._closing = False
+
+    def _call(self, method, *args):
+        with self.fs._lock:
+            return getattr(self.fs.proxy, method)(self.handle, *args)
+
+    def _read(self, sizehint=-1):
+        self._send_dirty()
+        size = max(sizehint, CHUNK_SIZE)
+        data = self._call("read_file", str(self._pos), str(size)).data
+        if not data:
+            return None
+        self._pos += len(data)
+        return data
+
+    def _write(self, data, flushing=False):
+        if "a" in self.mode:
+            self._pos = self.size
+        self._mark_dirty(self._pos, data)
+        self._pos += len(data)
+        self.size = max(self.size, self._pos)
+        if self._dirty_size > MAX_DIRTY_SIZE:
+            self._send_dirty()
+
+    def _mark_dirty(self, start, data):
+        """Record that 'data' has been written at offset 'start'."""
+        end = start + len(data)
+        i = 0
+        while i < len(self._dirty) and self._dirty[i][0] + len(self._dirty[i][1]) < start:
+            i += 1
+        j = i
+        while j < len(self._dirty) and self._dirty[j][0] <= end:
+            j += 1
+        if i == j:
+            #  Doesn't touch any existing range.
+            self._dirty.insert(i, (start, bytearray(data)))
+        elif j == i + 1 and self._dirty[i][0] <= start:
+            #  Overlaps or extends a single range; update it in place.
+            (rstart, rdata) = self._dirty[i]
+            self._dirty_size -= len(rdata)
+            rdata[start-rstart:end-rstart] = data
+        else:
+            #  Merge all the touched ranges into one.
+            rstart = min(start, self._dirty[i][0])
+            rend = max(end, self._dirty[j-1][0] + len(self._dirty[j-1][1]))
+            rdata = bytearray(rend - rstart)
+            for (ostart, odata) in self._dirty[i:j]:
+                self._dirty_size -= len(odata)
+                rdata[ostart-rstart:ostart-rstart+len(odata)] = odata
+            rdata[start-rstart:end-rstart] = data
+            self._dirty[i:j] = [(rstart, rdata)]
+        self._dirty_size += len(self._dirty[i][1])
+
+    def _send_dirty(self, *methods):
+        """Send all the modified ranges to the server.
+
+        The writes are batched into multicalls of up to MAX_DIRTY_SIZE
+        bytes, and any extra 'methods' are called on the file handle at
+        the end of the last batch.
+        """
+        calls = []
+        batch_size = 0
+        for (start, data) in self._dirty:
+            for offset in xrange(0, len(data), CHUNK_SIZE):
+                chunk = bytes(data[offset:offset+CHUNK_SIZE])
+                calls.append(("write_file", (self.handle, str(start + offset),
+                                             xmlrpclib.Binary(chunk))))
+                batch_size += len(chunk)
+                if batch_size >= MAX_DIRTY_SIZE:
+                    self.fs._multicall(calls)
+                    calls = []
+                    batch_size = 0
+        self._dirty = []
+        self._dirty_size = 0
+        calls.extend((method, (self.handle,)) for method in methods)
+        if calls:
+            self.fs._multicall(calls)
+
+    def _seek(self, offset, whence):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += self.size
+        self._pos = offset
+
+    def _tell(self):
+        return self._pos
+
+    def _truncate(self, size):
+        self._send_dirty()
+        self._call("truncate_file", str(size))
+        self.size = size
+
+    def flush(self):
+        super(RPCFile, self).flush()
+        #  When closing, the final writes are sent along with close_file.
+        if self._dirty and not self._closing:
+            self._send_dirty("flush_file")
+
+    def close(self):
+        if not hasattr(self, "closed"):
+            FileLikeBase.__init__(self)
+        if not self.closed:
+            self._closing = True
+            try:
+                super(RPCFile, self).close()
+            finally:
+                self._send_dirty("close_file")
+
+
 class RPCFS(FS):
     """Access a filesystem exposed via XML-RPC.
 
@@ -105,7 +284,7 @@ class RPCFS(FS):
              'network' : True,
               }
 
-    def __init__(self, uri, transport=None):
+    def __init__(self, uri, transport=None, compress=True):
         """Constructor for RPCFS objects.
 
         The only required argument is the URI of the server to connect
@@ -113,10 +292,13 @@ class RPCFS(FS):
         object, along with the 'transport' argument if it is provided.
 
         :param uri: address of the server
+        :param compress: if True (and no 'transport' is given), gzip large
+            requests and responses when the server supports it
 
         """
         super(RPCFS, self).__init__(thread_synchronize=True)
         self.uri = uri
+        self.compress = compress
         self._transport = transport
         self.proxy = self._make_proxy()
         self.isdir('/')
@@ -125,13 +307,30 @@ class RPCFS(FS):
     def _make_proxy(self):
         kwds = dict(allow_none=True, use_datetime=True)
 
-        if self._transport is not None:
-            proxy = xmlrpclib.ServerProxy(self.uri, self._transport, **kwds)
-        else:
-            proxy = xmlrpclib.ServerProxy(self.uri, **kwds)
+        transport = self._transport
+        if transport is None:
+            if self.uri.startswith("https:"):
+                transport = SafeRPCFSTransport(True, self.compress)
+            else:
+                transport = RPCFSTransport(True, self.compress)
+        proxy = xmlrpclib.ServerProxy(self.uri, transport, **kwds)
 
         return ReRaiseFaults(proxy)
 
+    @synchronize
+    def _multicall(self, calls):
+        """Make several (method, args) calls in a single request.
+
+        Returns a list of the results, re-raising the first fault as with
+        a direct call.
+        """
+        multicall = xmlrpclib.MultiCall(self.proxy._obj)
+        for (method, args) in calls:
+            getattr(multicall, method)(*args)
+        results = re_raise_faults(multicall)()
+        return [re_raise_faults(results.__getitem__)(i)
+                for i in xrange(len(calls))]
+
     def __str__(self):
         return '<RPCFS: %s>' % (self.uri,)
 
@@ -179,61 +378,12 @@ class RPCFS(FS):
     def hasmeta(self, meta_name):
         return self.proxy.hasmeta(meta_name)
 
-    @synchronize
     @iotools.filelike_to_stream
     def open(self, path, mode='r', buffering=-1, encoding=None, errors=None, newline=None, line_buffering=False, **kwargs):
-        # TODO: chunked transport of large files
         epath = self.encode_path(path)
-        if "w" in mode:
-            self.proxy.set_contents(epath, xmlrpclib.Binary(b("")))
-        if "r" in mode or "a" in mode or "+" in mode:
-            try:
-                data = self.proxy.get_contents(epath, "rb").data
-            except IOError:
-                if "w" not in mode and "a" not in mode:
-                    raise ResourceNotFoundError(path)
-                if not self.isdir(dirname(path)):
-                    raise ParentDirectoryMissingError(path)
-                self.proxy.set_contents(path, xmlrpclib.Binary(b("")))
-        else:
-            data = b("")
-        f = StringIO(data)
-        if "a" not in mode:
-            f.seek(0, 0)
-        else:
-            f.seek(0, 2)
-        oldflush = f.flush
-        oldclose = f.close
-        oldtruncate = f.truncate
-
-        def newflush():
-            self._lock.acquire()
-            try:
-                oldflush()
-                self.proxy.set_contents(epath, xmlrpclib.Binary(f.getvalue()))
-            finally:
-                self._lock.release()
-
-        def newclose():
-            self._lock.acquire()
-            try:
-                f.flush()
-                oldclose()
-            finally:
-                self._lock.release()
-
-        def newtruncate(size=None):
-            self._lock.acquire()
-            try:
-                oldtruncate(size)
-                f.flush()
-            finally:
-                self._lock.release()
-
-        f.flush = newflush
-        f.close = newclose
-        f.truncate = newtruncate
-        return f
+        with self._lock:
+            (handle, size) = self.proxy.open_file(epath, mode)
+        return RPCFile(self, path, mode, handle, int(size))
 
     @synchronize
     def exists(self, path):
@@ -276,6 +426,44 @@ class RPCFS(FS):
                 entries = [abspath(pathjoin(path, e)) for e in entries]
         return entries
 
+    @synchronize
+    def listdirinfo(self, path="./", wildcard=None, full=False, absolute=False, dirs_only=False, files_only=False):
+        enc_path = self.encode_path(path)
+        if not callable(wildcard):
+            entries = self.proxy.listdirinfo(enc_path,
+                                             wildcard,
+                                             full,
+                                             absolute,
+                                             dirs_only,
+                                             files_only)
+            entries = [(self.decode_path(e), info) for (e, info) in entries]
+        else:
+            entries = self.proxy.listdirinfo(enc_path,
+                                             None,
+                                             False,
+                                             False,
+                                             dirs_only,
+                                             files_only)
+            entries = [(self.decode_path(e), info) for (e, info) in entries]
+            entries = [(e, info) for (e, info) in entries if wildcard(e)]
+            if full:
+                entries = [(relpath(pathjoin(path, e)), info) for (e, info) in entries]
+            elif absolute:
+                entries = [(abspath(pathjoin(path, e)), info) for (e, info) in entries]
+        return entries
+
+    def walk(self, path="/", wildcard=None, dir_wildcard=None, search="breadth", ignore_errors=False):
+        #  Callable wildcards can't be sent to the server, so walk locally.
+        if callable(wildcard) or callable(dir_wildcard):
+            for item in super(RPCFS, self).walk(path, wildcard, dir_wildcard, search, ignore_errors):
+                yield item
+            return
+        enc_path = self.encode_path(path)
+        with self._lock:
+            entries = self.proxy.walk(enc_path, wildcard, dir_wildcard, search, ignore_errors)
+        for (dirpath, files) in entries:
+            yield (self.decode_path(dirpath), [self.decode_path(f) for f in files])
+
     @synchronize
     def makedir(self, path, recursive=False, allow_recreate=False):
         path = self.encode_path(path)
@@ -308,6 +496,15 @@ class RPCFS(FS):
         info = self.proxy.getinfo(path)
         return info
 
+    @synchronize
+    def getinfo_many(self, paths):
+        """Get the info for several paths in a single request.
+
+        Returns a list of info dicts in the same order as 'paths', with
+        None in place of any path that does not exist.
+        """
+        return self.proxy.getinfo_many([self.encode_path(p) for p in paths])
+
     @synchronize
     def desc(self, path):
         path = self.encode_path(path)
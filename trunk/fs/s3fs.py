@@ -12,23 +12,43 @@ interface for objects stored in Amazon Simple Storage Service (S3).
 """
 
 import os
+import sys
 import datetime
-import tempfile
 from fnmatch import fnmatch
 import stat as statinfo
 
 import boto.s3.connection
 from boto.s3.prefix import Prefix
+from boto.s3.multipart import MultiPartUpload
 from boto.exception import S3ResponseError
 
 from fs.base import *
 from fs.path import *
 from fs.errors import *
 from fs.remote import *
-from fs.filelike import LimitBytesFile
+from fs.filelike import FileLikeBase, LimitBytesFile, StringIO
 from fs import iotools
 
 import six
+from six import b
+from six.moves import queue
+
+#  S3 rejects any multipart upload part (other than the last) smaller than this.
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+#  The most keys that can be removed by a single multi-object delete request.
+MAX_DELETE_KEYS = 1000
+
+#  Bounds for the exponential backoff used when polling for consistency.
+SYNC_POLL_MIN = 0.05
+SYNC_POLL_MAX = 1.0
+
+#  How many levels of sub-prefixes may be discovered when sharding a listing.
+MAX_LIST_SHARD_DEPTH = 3
+
+#  Objects larger than this must be copied in parts, as a multipart upload.
+MAX_COPY_SIZE = 5 * 1024 * 1024 * 1024
+COPY_PART_SIZE = 512 * 1024 * 1024
 
 # Boto is not thread-safe, so we need to use a per-thread S3 connection.
 if hasattr(threading,"local"):
@@ -46,6 +66,192 @@ else:
             self._map[(threading.currentThread(),attr)] = value
 
 
+class _S3WorkerPool(object):
+    """Run S3 requests concurrently on a small pool of worker threads.
+
+    At most 'max_pending' jobs may be queued or running at any one time;
+    submit() blocks until a slot is free, which bounds the memory held by
+    jobs that carry data with them (e.g. the parts of a multipart upload).
+    Worker threads are started on demand, and each uses its own boto
+    connection via the owning S3FS's thread-local storage.  Jobs may
+    themselves submit more jobs.
+
+    Once a job has failed, any remaining jobs are skipped and the error is
+    re-raised from the next call to submit() or join().  If 'on_skip' is
+    given, it is called with the arguments of each job that is skipped.
+    """
+
+    def __init__(self,num_workers,max_pending=None,on_skip=None):
+        if max_pending is None:
+            max_pending = num_workers
+        self.num_workers = max(num_workers,1)
+        self.on_skip = on_skip
+        self._jobs = queue.Queue()
+        self._slots = threading.Semaphore(max(max_pending,1))
+        self._workers = []
+        self._workers_lock = threading.Lock()
+        self._error = None
+        self._cancelled = False
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            (func,args) = job
+            try:
+                if self._error is None and not self._cancelled:
+                    func(*args)
+                elif self.on_skip is not None:
+                    self.on_skip(*args)
+            except Exception:
+                if self._error is None:
+                    self._error = sys.exc_info()
+            finally:
+                self._slots.release()
+
+    def submit(self,func,*args):
+        """Queue func(*args) for execution by a worker thread."""
+        self._slots.acquire()
+        if self._error is not None:
+            self._slots.release()
+            self.join()
+        with self._workers_lock:
+            if len(self._workers) < self.num_workers:
+                t = threading.Thread(target=self._run)
+                t.daemon = True
+                t.start()
+                self._workers.append(t)
+        self._jobs.put((func,args))
+
+    def join(self):
+        """Wait for all submitted jobs, re-raising the first error if any."""
+        with self._workers_lock:
+            workers = self._workers
+            self._workers = []
+        for t in workers:
+            self._jobs.put(None)
+        for t in workers:
+            t.join()
+        if self._error is not None:
+            six.reraise(*self._error)
+
+    def cancel(self):
+        """Skip any jobs not yet started, and wait for running ones to end.
+
+        Errors raised by the jobs are discarded.
+        """
+        self._cancelled = True
+        try:
+            self.join()
+        except Exception:
+            pass
+
+
+class _S3MultipartWriter(FileLikeBase):
+    """Write-only file object streaming its contents into an S3 key.
+
+    Data is collected into parts of the owning filesystem's 'part_size',
+    and each part is handed to a worker thread for upload as soon as it
+    fills up.  At most 'transfer_threads' parts are held in memory while
+    waiting to be sent.  Data that never fills a whole part is sent with a
+    single PUT request when the file is closed.
+
+    If anything goes wrong the multipart upload is cancelled, so that no
+    partial object is left behind (and no storage is charged for it).
+    """
+
+    def __init__(self,fs,s3path):
+        super(_S3MultipartWriter,self).__init__()
+        self.mode = "w-"
+        self.fs = fs
+        self.s3path = s3path
+        self.key = None
+        self._part_size = fs._part_size
+        self._chunks = []
+        self._chunks_size = 0
+        self._pos = 0
+        self._upload_id = None
+        self._num_parts = 0
+        self._workers = None
+
+    def _tell(self):
+        return self._pos
+
+    def _write(self,data,flushing=False):
+        self._chunks.append(data)
+        self._chunks_size += len(data)
+        self._pos += len(data)
+        if self._chunks_size >= self._part_size:
+            data = b("").join(self._chunks)
+            offset = 0
+            while len(data) - offset >= self._part_size:
+                self._send_part(data[offset:offset+self._part_size])
+                offset += self._part_size
+            self._chunks = [data[offset:]]
+            self._chunks_size = len(data) - offset
+
+    def _send_part(self,data):
+        try:
+            if self._upload_id is None:
+                mp = self.fs._s3bukt.initiate_multipart_upload(self.s3path)
+                self._upload_id = mp.id
+                self._workers = _S3WorkerPool(self.fs._transfer_threads)
+            self._num_parts += 1
+            self._workers.submit(self._upload_part,self._num_parts,data)
+        except Exception:
+            self.abort()
+            raise
+
+    def _upload_part(self,part_num,data):
+        mp = MultiPartUpload(self.fs._s3bukt)
+        mp.key_name = self.s3path
+        mp.id = self._upload_id
+        mp.upload_part_from_file(StringIO(data),part_num)
+
+    def abort(self):
+        """Cancel the upload, discarding any data written so far."""
+        self.closed = True
+        self._chunks = []
+        if self._workers is not None:
+            self._workers.cancel()
+        if self._upload_id is not None:
+            mp = MultiPartUpload(self.fs._s3bukt)
+            mp.key_name = self.s3path
+            mp.id = self._upload_id
+            self._upload_id = None
+            mp.cancel_upload()
+
+    def close(self):
+        if not hasattr(self,"closed"):
+            FileLikeBase.__init__(self)
+        if self.closed:
+            return
+        super(_S3MultipartWriter,self).close()
+        data = b("").join(self._chunks)
+        self._chunks = []
+        try:
+            if self._upload_id is None:
+                key = self.fs._s3bukt.new_key(self.s3path)
+                key.set_contents_from_string(data)
+            else:
+                if data:
+                    self._num_parts += 1
+                    self._workers.submit(self._upload_part,self._num_parts,data)
+                self._workers.join()
+                mp = MultiPartUpload(self.fs._s3bukt)
+                mp.key_name = self.s3path
+                mp.id = self._upload_id
+                result = mp.complete_upload()
+                self._upload_id = None
+                key = self.fs._s3bukt.new_key(self.s3path)
+                key.etag = result.etag
+        except Exception:
+            self.abort()
+            raise
+        self.key = self.fs._sync_key(key)
+
+
 class S3FS(FS):
     """A filesystem stored in Amazon S3.
 
@@ -76,7 +282,7 @@ class S3FS(FS):
         PATH_MAX = None
         NAME_MAX = None
 
-    def __init__(self, bucket, prefix="", aws_access_key=None, aws_secret_key=None, separator="/", thread_synchronize=True, key_sync_timeout=1):
+    def __init__(self, bucket, prefix="", aws_access_key=None, aws_secret_key=None, separator="/", thread_synchronize=True, key_sync_timeout=1, part_size=8*1024*1024, transfer_threads=4, consistency="strict"):
         """Constructor for S3FS objects.
 
         S3FS objects require the name of the S3 bucket in which to store
@@ -93,13 +299,38 @@ class S3FS(FS):
         thus reduce the filesystem's consistency guarantees to those of
         S3's "eventual consistency" model) set it to None.
 
+        The keyword argument 'consistency' controls how those checks are
+        made.  It may be one of:
+
+            * "strict":  poll each key after writing it, until it reads
+                         back as written (the default)
+            * "lazy":    poll keys in a background thread; any that never
+                         read back as written are reported by the next
+                         call to checkconsistency() or close()
+            * "none":    trust the response to each write, and don't check
+                         at all (the same as key_sync_timeout=None)
+
         By default the path separator is "/", but this can be overridden
         by specifying the keyword 'separator' in the constructor.
+
+        Files larger than 'part_size' bytes are uploaded in parts using
+        S3's multipart upload API, and downloaded as a series of ranged GET
+        requests, with up to 'transfer_threads' parts being transferred
+        concurrently.  S3 requires parts of at least 5MB.
         """
+        if part_size < MIN_PART_SIZE:
+            raise ValueError("part_size must be at least %d bytes" % (MIN_PART_SIZE,))
+        if consistency not in ("strict","lazy","none"):
+            raise ValueError("consistency must be 'strict', 'lazy' or 'none'")
+        if key_sync_timeout is None:
+            consistency = "none"
         self._bucket_name = bucket
         self._access_keys = (aws_access_key,aws_secret_key)
         self._separator = separator
         self._key_sync_timeout = key_sync_timeout
+        self._part_size = part_size
+        self._transfer_threads = transfer_threads
+        self._consistency = consistency
         # Normalise prefix to this form: path/to/files/
         prefix = normpath(prefix)
         while prefix.startswith(separator):
@@ -116,8 +347,16 @@ class S3FS(FS):
                 raise CreateFailedError("AWS_SECRET_ACCESS_KEY not set")
         self._prefix = prefix
         self._tlocal = thread_local()
+        self._init_sync_state()
         super(S3FS, self).__init__(thread_synchronize=thread_synchronize)
 
+    def _init_sync_state(self):
+        self._sync_stats = {"checks":0,"waits":0,"timeouts":0,"wait_time":0.0}
+        self._sync_lock = threading.Lock()
+        self._sync_queue = None
+        self._sync_thread = None
+        self._sync_failures = []
+
     #  Make _s3conn and _s3bukt properties that are created on demand,
     #  since they cannot be stored during pickling.
 
@@ -160,11 +399,26 @@ class S3FS(FS):
     def __getstate__(self):
         state = super(S3FS,self).__getstate__()
         del state['_tlocal']
+        for attr in ("_sync_stats","_sync_lock","_sync_queue",
+                     "_sync_thread","_sync_failures"):
+            del state[attr]
         return state
 
     def __setstate__(self,state):
         super(S3FS,self).__setstate__(state)
         self._tlocal = thread_local()
+        self._init_sync_state()
+
+    def close(self):
+        if not self.closed:
+            try:
+                self.checkconsistency()
+            finally:
+                if self._sync_thread is not None:
+                    self._sync_queue.put(None)
+                    self._sync_thread.join()
+                    self._sync_thread = None
+                super(S3FS,self).close()
 
     def __repr__(self):
         args = (self.__class__.__name__,self._bucket_name,self._prefix)
@@ -204,44 +458,153 @@ class S3FS(FS):
         Note that this could easily fail if the key is modified by another
         program, meaning the content will never be as specified in the given
         key.  This is the reason for the timeout argument to the construtcor.
+
+        In "lazy" consistency mode the polling is done by a background
+        thread, and in "none" mode it is not done at all; in both cases
+        the given key is returned immediately.
         """
-        timeout = self._key_sync_timeout
-        if timeout is None:
+        k2 = self._sync_key_name(k.name,k.etag)
+        if k2 is None:
             return k
-        k2 = self._s3bukt.get_key(k.name)
-        t = time.time()
-        while k2 is None or k2.etag != k.etag:
+        return k2
+
+    def _sync_removed_key(self,name):
+        """Synchronise on the removal of the named key."""
+        self._sync_key_name(name,None)
+
+    def _sync_key_name(self,name,etag):
+        if self._consistency == "none":
+            return None
+        if self._consistency == "lazy":
+            with self._sync_lock:
+                if self._sync_thread is None:
+                    self._sync_queue = queue.Queue()
+                    self._sync_thread = threading.Thread(target=self._run_lazy_sync)
+                    self._sync_thread.daemon = True
+                    self._sync_thread.start()
+            self._sync_queue.put((name,etag))
+            return None
+        return self._poll_key(name,etag)[0]
+
+    def _run_lazy_sync(self):
+        """Main loop of the background thread for "lazy" consistency."""
+        while True:
+            item = self._sync_queue.get()
+            try:
+                if item is None:
+                    break
+                (name,etag) = item
+                try:
+                    ok = self._poll_key(name,etag)[1]
+                except Exception:
+                    ok = False
+                if not ok:
+                    with self._sync_lock:
+                        self._sync_failures.append(name)
+            finally:
+                self._sync_queue.task_done()
+
+    def _poll_key(self,name,etag):
+        """Poll the named key until it has the given etag.
+
+        If 'etag' is None, this polls until the key has been removed.
+        Polls are spaced with exponential backoff, for at most as long as
+        the key_sync_timeout.  Returns a tuple (key,ok) giving the last key
+        read back (or None if it was missing) and whether it was as expected.
+        """
+        timeout = self._key_sync_timeout
+        start = time.time()
+        delay = SYNC_POLL_MIN
+        waited = False
+        k = self._s3bukt.get_key(name)
+        ok = _key_has_etag(k,etag)
+        while not ok:
+            remaining = start + timeout - time.time()
             if timeout > 0:
-                if t + timeout < time.time():
+                if remaining <= 0:
                     break
-            time.sleep(0.1)
-            k2 = self._s3bukt.get_key(k.name)
-        return k2
+                delay = min(delay,remaining)
+            waited = True
+            time.sleep(delay)
+            delay = min(delay * 2,SYNC_POLL_MAX)
+            k = self._s3bukt.get_key(name)
+            ok = _key_has_etag(k,etag)
+        with self._sync_lock:
+            self._sync_stats["checks"] += 1
+            if waited:
+                self._sync_stats["waits"] += 1
+                self._sync_stats["wait_time"] += time.time() - start
+            if not ok:
+                self._sync_stats["timeouts"] += 1
+        return (k,ok)
+
+    def getsyncstats(self):
+        """Get statistics on the consistency checks made by this filesystem.
+
+        This returns a dict with the following keys:
+
+            * checks:     the number of keys that have been checked
+            * waits:      how many of those weren't immediately consistent
+            * timeouts:   how many never became consistent within the
+                          key_sync_timeout
+            * wait_time:  the total time (in seconds) spent waiting
+
+        """
+        with self._sync_lock:
+            return self._sync_stats.copy()
+
+    def checkconsistency(self):
+        """Wait for any background consistency checks to finish.
+
+        When using "lazy" consistency, this method waits until all keys
+        written so far have been checked, and raises OperationTimeoutError
+        if any of them could not be read back as written.  In other modes
+        it does nothing.
+        """
+        if self._sync_queue is None:
+            return
+        self._sync_queue.join()
+        with self._sync_lock:
+            failures = self._sync_failures
+            self._sync_failures = []
+        if failures:
+            path = self._uns3path(failures[0])
+            if not isinstance(path,unicode):
+                path = path.decode("utf8")
+            msg = "%d key(s) were not consistent after writing, including: %%(path)s" % (len(failures),)
+            raise OperationTimeoutError("check consistency",path,msg=msg)
 
     def _sync_set_contents(self,key,contents):
         """Synchronously set the contents of a key."""
         if isinstance(key,basestring):
             key = self._s3bukt.new_key(key)
         if isinstance(contents,basestring):
-            key.set_contents_from_string(contents)
+            if len(contents) <= self._part_size:
+                key.set_contents_from_string(contents)
+                return self._sync_key(key)
+            contents = StringIO(contents)
         elif hasattr(contents,"md5"):
             hexmd5 = contents.md5
             b64md5 = hexmd5.decode("hex").encode("base64").strip()
             key.set_contents_from_file(contents,md5=(hexmd5,b64md5))
-        else:
-            try:
-                contents.seek(0)
-            except (AttributeError,EnvironmentError):
-                tf = tempfile.TemporaryFile()
-                data = contents.read(524288)
-                while data:
-                    tf.write(data)
-                    data = contents.read(524288)
-                tf.seek(0)
-                key.set_contents_from_file(tf)
-            else:
-                key.set_contents_from_file(contents)
-        return self._sync_key(key)
+            return self._sync_key(key)
+        try:
+            contents.seek(0)
+        except (AttributeError,EnvironmentError):
+            pass
+        #  Stream the data through a multipart upload, rather than spooling
+        #  it to a temporary file and sending it in a single request.
+        f = _S3MultipartWriter(self,key.name)
+        try:
+            data = contents.read(self._part_size)
+            while data:
+                f.write(data)
+                data = contents.read(self._part_size)
+        except Exception:
+            f.abort()
+            raise
+        f.close()
+        return f.key
 
     def makepublic(self, path):
         """Mark given path as publicly accessible using HTTP(S)"""
@@ -285,10 +648,19 @@ class S3FS(FS):
         This method downloads the file contents into a local temporary file
         so that it can be worked on efficiently.  Any changes made to the
         file are only sent back to S3 when the file is flushed or closed.
+
+        Files opened in streaming write mode ("w-") skip the local buffer
+        and upload their contents directly, in parallel parts, as they are
+        written.  Nothing is visible in S3 until such a file is closed.
         """
         if self.isdir(path):
             raise ResourceInvalidError(path)
         s3path = self._s3path(path)
+        #  For streaming writes, upload the data as it is written
+        if "w" in mode and "-" in mode:
+            if not self.isdir(dirname(path)):
+                raise ParentDirectoryMissingError(path)
+            return _S3MultipartWriter(self,s3path)
         # Truncate the file if requested
         if "w" in mode:
             k = self._sync_set_contents(s3path,"")
@@ -310,6 +682,82 @@ class S3FS(FS):
         #  This will take care of closing the socket when it's done.
         return RemoteFileBuffer(self,path,mode,f)
 
+    def getcontents(self, path, mode="rb", encoding=None, errors=None, newline=None):
+        if "r" not in mode:
+            raise ValueError("mode must contain 'r' to be readable")
+        contents = six.BytesIO()
+        self.download(path,contents)
+        data = contents.getvalue()
+        if "b" not in mode:
+            return iotools.decode_binary(data, encoding=encoding, errors=errors, newline=newline)
+        return data
+
+    def download(self,path,dst_file,chunk_size=64*1024):
+        """Write the contents of the file at 'path' into 'dst_file'.
+
+        Files larger than the filesystem's 'part_size' are fetched as a
+        series of ranged GET requests, with up to 'transfer_threads' of them
+        in flight at once.  The data is written to 'dst_file' sequentially,
+        so it need not be seekable.  'chunk_size' is ignored.
+        """
+        s3path = self._s3path(path)
+        k = self._s3bukt.get_key(s3path)
+        if k is None:
+            if self.isdir(path):
+                raise ResourceInvalidError(path,msg="not a file: %(path)s")
+            raise ResourceNotFoundError(path)
+        self._download_key(k,dst_file)
+
+    def _download_key(self,k,dst_file):
+        """Write the contents of the given key into 'dst_file'."""
+        size = int(k.size)
+        if size <= self._part_size:
+            k.get_contents_to_file(dst_file)
+            return
+        ranges = [(start,min(start+self._part_size,size)-1)
+                  for start in xrange(0,size,self._part_size)]
+        parts = {}
+        parts_ready = threading.Condition()
+        def store(i,data):
+            with parts_ready:
+                parts[i] = data
+                parts_ready.notify()
+        def fetch(i,start,end):
+            data = None
+            try:
+                #  Fail rather than mix data from different versions of
+                #  the key, in case it is overwritten while we're reading.
+                headers = {"Range":"bytes=%d-%d" % (start,end),
+                           "If-Match":k.etag}
+                key = self._s3bukt.new_key(k.name)
+                data = key.get_contents_as_string(headers=headers)
+            finally:
+                store(i,data)
+        #  Keep at most 'transfer_threads' parts fetched-but-unwritten or
+        #  in flight, so that memory use doesn't depend on the file size.
+        #  Parts skipped after a failure are stored as failed too, so that
+        #  we never wait for them.
+        workers = _S3WorkerPool(self._transfer_threads,len(ranges),
+                                on_skip=lambda i,start,end: store(i,None))
+        try:
+            num_submitted = 0
+            for i in xrange(len(ranges)):
+                while num_submitted < min(i+self._transfer_threads,len(ranges)):
+                    workers.submit(fetch,num_submitted,*ranges[num_submitted])
+                    num_submitted += 1
+                with parts_ready:
+                    while i not in parts:
+                        parts_ready.wait()
+                    data = parts.pop(i)
+                if data is None:
+                    #  A fetch failed; this will re-raise its error.
+                    workers.join()
+                dst_file.write(data)
+        except Exception:
+            workers.cancel()
+            raise
+        workers.join()
+
     def exists(self,path):
         """Check whether a path exists."""
         s3path = self._s3path(path)
@@ -410,6 +858,88 @@ class S3FS(FS):
                     raise ResourceInvalidError(path,msg=msg)
                 raise ResourceNotFoundError(path)
 
+    def _list_keys(self,s3prefix):
+        """Iterator over all keys starting with the given prefix.
+
+        This is equivalent to self._s3bukt.list(prefix=s3prefix), but lists
+        the keys in parallel when using several transfer threads.  The prefix
+        is split into shards by listing it with a delimiter, which gives
+        both its immediate keys and its sub-prefixes.  Each sub-prefix is
+        then either listed in full, or split again if there are too few
+        shards to keep the worker threads busy.  Keys are yielded as they
+        arrive, so they are not in lexicographic order.
+        """
+        threads = self._transfer_threads
+        if threads <= 1:
+            for k in self._s3bukt.list(prefix=s3prefix):
+                yield k
+            return
+        #  Workers send pages of keys back through this queue, along with
+        #  ("spawn",n) when they start n more shards, ("done",None) when
+        #  they finish a shard, and ("error",exc_info) if they fail.
+        results = queue.Queue(threads * 2)
+        stopped = []
+        workers = _S3WorkerPool(threads,sys.maxint)
+        def list_shard(prefix,depth):
+            try:
+                if depth >= MAX_LIST_SHARD_DEPTH:
+                    ks = self._s3bukt.list(prefix=prefix)
+                else:
+                    ks = self._s3bukt.list(prefix=prefix,delimiter=self._separator)
+                page = []
+                shards = []
+                for k in ks:
+                    if stopped:
+                        return
+                    if isinstance(k,Prefix):
+                        shards.append(k.name)
+                        continue
+                    page.append(k)
+                    if len(page) == 1000:
+                        results.put(("keys",page))
+                        page = []
+                if page:
+                    results.put(("keys",page))
+                if shards:
+                    #  Split the sub-prefixes further only while there
+                    #  aren't enough shards to go round the workers.
+                    if len(shards) < threads:
+                        depth += 1
+                    else:
+                        depth = MAX_LIST_SHARD_DEPTH
+                    results.put(("spawn",len(shards)))
+                    for shard in shards:
+                        workers.submit(list_shard,shard,depth)
+            except Exception:
+                results.put(("error",sys.exc_info()))
+            finally:
+                results.put(("done",None))
+        workers.submit(list_shard,s3prefix,0)
+        remaining = 1
+        try:
+            while remaining:
+                (what,value) = results.get()
+                if what == "keys":
+                    for k in value:
+                        yield k
+                elif what == "spawn":
+                    remaining += value
+                elif what == "done":
+                    remaining -= 1
+                else:
+                    six.reraise(*value)
+        finally:
+            #  Let any remaining workers run to completion, in case we're
+            #  exiting early due to an error or the caller stopping.
+            stopped.append(True)
+            while remaining:
+                (what,value) = results.get()
+                if what == "spawn":
+                    remaining += value
+                elif what == "done":
+                    remaining -= 1
+            workers.join()
+
     def _key_is_dir(self, k):
         if isinstance(k,Prefix):
             return True
@@ -502,9 +1032,69 @@ class S3FS(FS):
         else:
             raise ResourceNotFoundError(path)
         self._s3bukt.delete_key(s3path)
-        k = self._s3bukt.get_key(s3path)
-        while k:
-            k = self._s3bukt.get_key(s3path)
+        self._sync_removed_key(s3path)
+
+    def removemany(self,paths,ignore_errors=False):
+        """Remove several files, using S3's multi-object delete requests.
+
+        Up to 1000 keys are removed per request.  S3 does not report keys
+        that don't exist, so each parent directory is listed once first to
+        find the paths that are missing or are directories.
+        """
+        failures = []
+        s3paths = {}
+        listings = {}
+        for path in paths:
+            s3path = self._s3path(path)
+            parent = self._s3path(dirname(path)) + self._separator
+            if parent == "/":
+                parent = ""
+            if parent not in listings:
+                listing = listings[parent] = set()
+                for k in self._s3bukt.list(prefix=parent,delimiter=self._separator):
+                    name = k.name
+                    if isinstance(name,unicode):
+                        name = name.encode("utf8")
+                    listing.add(name)
+            if s3path in listings[parent]:
+                s3paths[s3path] = path
+            elif s3path + self._separator in listings[parent]:
+                msg = "that's not a file: %(path)s"
+                failures.append((path,ResourceInvalidError(path,msg=msg)))
+            else:
+                failures.append((path,ResourceNotFoundError(path)))
+        errors = self._delete_keys(s3paths.iterkeys())
+        failures.extend((s3paths[e.key],_delete_error(s3paths[e.key],e)) for e in errors)
+        if failures and not ignore_errors:
+            raise failures[0][1]
+        return failures
+
+    def _delete_keys(self,s3paths):
+        """Delete the named keys using batched multi-object delete requests.
+
+        The batches are sent by worker threads while 's3paths' is still
+        being consumed, so it may usefully be a lazy listing of the bucket.
+        Returns a list of boto errors for the keys that couldn't be deleted.
+        """
+        errors = []
+        def delete(batch):
+            result = self._s3bukt.delete_keys(batch,quiet=True)
+            errors.extend(result.errors)
+        workers = _S3WorkerPool(self._transfer_threads)
+        try:
+            batch = []
+            for s3path in s3paths:
+                batch.append(s3path)
+                if len(batch) == MAX_DELETE_KEYS:
+                    workers.submit(delete,batch)
+                    batch = []
+            if batch:
+                workers.submit(delete,batch)
+        except Exception:
+            workers.cancel()
+            raise
+        workers.join()
+        return errors
 
     def removedir(self,path,recursive=False,force=False):
         """Remove the directory at the given path."""
@@ -515,18 +1105,27 @@ class S3FS(FS):
             s3path = s3path + self._separator
         if force:
             #  If we will be forcibly removing any directory contents, we
-            #  might as well get the un-delimited list straight away.
-            ks = self._s3bukt.list(prefix=s3path)
+            #  might as well get the un-delimited list straight away, and
+            #  delete keys in bulk while we're still listing the rest.
+            listed = []
+            def contents():
+                for k in self._list_keys(s3path):
+                    if not listed:
+                        listed.append(k)
+                    if not _eq_utf8(k.name,s3path):
+                        yield k.name
+            errors = self._delete_keys(contents())
+            if errors:
+                e = errors[0]
+                raise _delete_error(self._uns3path(e.key),e)
+            found = bool(listed)
         else:
-            ks = self._s3bukt.list(prefix=s3path,delimiter=self._separator)
-        # Fail if the directory is not empty, or remove them if forced
-        found = False
-        for k in ks:
-            found = True
-            if not _eq_utf8(k.name,s3path):
-                if not force:
+            # Fail if the directory is not empty
+            found = False
+            for k in self._s3bukt.list(prefix=s3path,delimiter=self._separator):
+                found = True
+                if not _eq_utf8(k.name,s3path):
                     raise DirectoryNotEmptyError(path)
-                self._s3bukt.delete_key(k.name)
         if not found:
             if self.isfile(path):
                 msg = "removedir() called on a regular file: %(path)s"
@@ -630,16 +1229,13 @@ class S3FS(FS):
         # OK, now we can copy the file.
         s3path_src = self._s3path(src)
         try:
-            self._s3bukt.copy_key(s3path_dst,self._bucket_name,s3path_src)
+            k = self._s3bukt.copy_key(s3path_dst,self._bucket_name,s3path_src)
         except S3ResponseError, e:
             if "404 Not Found" in str(e):
                 msg = "Source is not a file: %(path)s"
                 raise ResourceInvalidError(src, msg=msg)
             raise e
         else:
-            k = self._s3bukt.get_key(s3path_dst)
-            while k is None:
-                k = self._s3bukt.get_key(s3path_dst)
             self._sync_key(k)
 
     def move(self,src,dst,overwrite=False,chunk_size=16384):
@@ -647,6 +1243,129 @@ class S3FS(FS):
         self.copy(src,dst,overwrite=overwrite)
         self._s3bukt.delete_key(self._s3path(src))
 
+    def copydir(self,src,dst,overwrite=False,ignore_errors=False,chunk_size=16384):
+        """Copy a directory from 'src' to 'dst'.
+
+        The source directory is listed once, and each key under it is
+        copied server-side by the transfer threads.
+        """
+        if not self.isdir(src):
+            raise ResourceInvalidError(src,msg="Source is not a directory: %(path)s")
+        if not overwrite and self.exists(dst):
+            raise DestinationExistsError(dst)
+        self._copy_tree(src,dst,ignore_errors)
+
+    def movedir(self,src,dst,overwrite=False,ignore_errors=False,chunk_size=16384):
+        """Move a directory from 'src' to 'dst'.
+
+        The keys are copied as for copydir(), then the sources are removed
+        using multi-object delete requests.
+        """
+        if not self.isdir(src):
+            if self.isfile(src):
+                raise ResourceInvalidError(src,msg="Source is not a directory: %(path)s")
+            raise ResourceNotFoundError(src)
+        if not overwrite and self.exists(dst):
+            raise DestinationExistsError(dst)
+        (copied,failed) = self._copy_tree(src,dst,ignore_errors)
+        if failed:
+            #  Leave the source directory in place for the remaining files.
+            s3path = self._s3path(src) + self._separator
+            copied = [nm for nm in copied if not _eq_utf8(nm,s3path)]
+        errors = self._delete_keys(copied)
+        if errors and not ignore_errors:
+            e = errors[0]
+            raise _delete_error(self._uns3path(e.key),e)
+
+    def _copy_tree(self,src,dst,ignore_errors=False):
+        """Copy all the keys under directory 'src' into directory 'dst'.
+
+        Objects larger than MAX_COPY_SIZE are copied in parts using a
+        multipart upload, with the parts spread across the transfer threads.
+        Returns a list of the source keys that were copied, and a list of
+        those that failed (which is always empty unless 'ignore_errors').
+        """
+        s3src = self._s3path(src)
+        if s3src != self._prefix:
+            s3src = s3src + self._separator
+        s3dst = self._s3path(dst)
+        if s3dst != self._prefix:
+            s3dst = s3dst + self._separator
+            self.makedir(dst,allow_recreate=True)
+        keys = self._list_keys(s3src)
+        if _startswith_utf8(s3dst,s3src):
+            #  Don't go copying the copies we're making.
+            keys = list(keys)
+        copied = []
+        failed = []
+        uploads = []
+        def copy_key(src_name,dst_name):
+            try:
+                k = self._s3bukt.copy_key(dst_name,self._bucket_name,src_name)
+                self._sync_key(k)
+            except Exception:
+                if not ignore_errors:
+                    raise
+                failed.append(src_name)
+            else:
+                copied.append(src_name)
+        def copy_part(upload,src_name,part_num,start,end):
+            try:
+                mp = MultiPartUpload(self._s3bukt)
+                mp.key_name = upload[2]
+                mp.id = upload[0]
+                mp.copy_part_from_key(self._bucket_name,src_name,part_num,start,end)
+            except Exception:
+                if not ignore_errors:
+                    raise
+                upload[1].append(part_num)
+        workers = _S3WorkerPool(self._transfer_threads)
+        try:
+            for k in keys:
+                src_name = k.name
+                if isinstance(src_name,unicode):
+                    src_name = src_name.encode("utf8")
+                if src_name == s3src:
+                    #  The directory itself was created by makedir() above.
+                    copied.append(src_name)
+                    continue
+                dst_name = s3dst + src_name[len(s3src):]
+                if k.size <= MAX_COPY_SIZE:
+                    workers.submit(copy_key,src_name,dst_name)
+                    continue
+                mp = self._s3bukt.initiate_multipart_upload(dst_name)
+                upload = (mp.id,[],dst_name,src_name)
+                uploads.append(upload)
+                for (i,start) in enumerate(xrange(0,k.size,COPY_PART_SIZE)):
+                    end = min(start + COPY_PART_SIZE,k.size) - 1
+                    workers.submit(copy_part,upload,src_name,i+1,start,end)
+            workers.join()
+            for (upload_id,errors,dst_name,src_name) in uploads:
+                mp = MultiPartUpload(self._s3bukt)
+                mp.key_name = dst_name
+                mp.id = upload_id
+                if errors:
+                    mp.cancel_upload()
+                    failed.append(src_name)
+                    continue
+                result = mp.complete_upload()
+                k = self._s3bukt.new_key(dst_name)
+                k.etag = result.etag
+                self._sync_key(k)
+                copied.append(src_name)
+        except Exception:
+            workers.cancel()
+            for (upload_id,_,dst_name,_) in uploads:
+                mp = MultiPartUpload(self._s3bukt)
+                mp.key_name = dst_name
+                mp.id = upload_id
+                try:
+                    mp.cancel_upload()
+                except S3ResponseError:
+                    pass
+            raise
+        return (copied,failed)
+
     def walkfiles(self,
               path="/",
               wildcard=None,
@@ -659,7 +1378,9 @@ class S3FS(FS):
                 yield item
         else:
             prefix = self._s3path(path)
-            for k in self._s3bukt.list(prefix=prefix):
+            if prefix:
+                prefix = prefix + self._separator
+            for k in self._list_keys(prefix):
                 name = relpath(self._uns3path(k.name,prefix))
                 if name != "":
                     if not isinstance(name,unicode):
@@ -687,7 +1408,9 @@ class S3FS(FS):
                 yield (item,self.getinfo(item))
         else:
             prefix = self._s3path(path)
-            for k in self._s3bukt.list(prefix=prefix):
+            if prefix:
+                prefix = prefix + self._separator
+            for k in self._list_keys(prefix):
                 name = relpath(self._uns3path(k.name,prefix))
                 if name != "":
                     if not isinstance(name,unicode):
@@ -714,7 +1437,9 @@ class S3FS(FS):
                 yield (item,self.getinfo(item))
         else:
             prefix = self._s3path(path)
-            for k in self._s3bukt.list(prefix=prefix):
+            if prefix:
+                prefix = prefix + self._separator
+            for k in self._list_keys(prefix):
                 name = relpath(self._uns3path(k.name,prefix))
                 if name != "":
                     if not isinstance(name,unicode):
@@ -738,6 +1463,24 @@ def _eq_utf8(name1,name2):
         name2 = name2.encode("utf8")
     return name1 == name2
 
+def _key_has_etag(k,etag):
+    """Check whether a key read back from S3 has the given etag.
+
+    An etag of None means that the key should not exist at all.
+    """
+    if etag is None:
+        return k is None
+    return k is not None and k.etag == etag
+
+def _delete_error(path,error):
+    """Convert an error from a multi-object delete into an FSError."""
+    if error.code == "NoSuchKey":
+        return ResourceNotFoundError(path)
+    if error.code == "AccessDenied":
+        return PermissionDeniedError("remove file",path,details=error.message)
+    msg = "Unable to remove file: %(path)s (%(details)s)"
+    return OperationFailedError("remove file",path,details=error.message,msg=msg)
+
 def _startswith_utf8(name1,name2):
     if isinstance(name1,unicode):
         name1 = name1.encode("utf8")
@@ -12,9 +12,12 @@ import datetime
 import stat as statinfo
 import threading
 import os
+import pipes
 import paramiko
+from paramiko.sftp import CMD_INIT, CMD_VERSION, CMD_EXTENDED, SFTPError
 from getpass import getuser
 import errno
+import struct
 
 from fs.base import *
 from fs.path import *
@@ -22,9 +25,15 @@ from fs.errors import *
 from fs.utils import isdir, isfile
 from fs import iotools
 
+import six
+
 
 ENOENT = errno.ENOENT
 
+#  Flow-control window for each SFTP channel.  paramiko's default of 2MB
+#  limits the data in flight for pipelined transfers over high-latency links.
+DEFAULT_WINDOW_SIZE = 16 * 1024 * 1024
+
 
 class WrongHostKeyError(RemoteConnectionError):
     pass
@@ -51,6 +60,27 @@ else:
             self._map[(threading.currentThread().ident, attr)] = value
 
 
+class _SFTPClient(paramiko.SFTPClient):
+    """SFTPClient that records the protocol extensions offered by the server.
+
+    paramiko discards the extension list sent with the server's version,
+    so it is parsed here into the 'extensions' dict.
+    """
+
+    def _send_version(self):
+        self._send_packet(CMD_INIT, struct.pack('>I', 3))
+        t, data = self._read_packet()
+        if t != CMD_VERSION:
+            raise SFTPError('Incompatible sftp protocol')
+        msg = paramiko.Message(data)
+        version = msg.get_int()
+        self.extensions = {}
+        while msg.get_remainder():
+            name = msg.get_string()
+            self.extensions[name] = msg.get_string()
+        return version
+
+
 if not hasattr(paramiko.SFTPFile, "__enter__"):
     paramiko.SFTPFile.__enter__ = lambda self: self
     paramiko.SFTPFile.__exit__ = lambda self,et,ev,tb: self.close() and False
@@ -87,7 +117,10 @@ class SFTPFS(FS):
                  pkey=None,
                  agent_auth=True,
                  no_auth=False,
-                 look_for_keys=True):
+                 look_for_keys=True,
+                 num_transports=1,
+                 window_size=DEFAULT_WINDOW_SIZE,
+                 remote_cp=False):
         """SFTPFS constructor.
 
         The only required argument is 'connection', which must be something
@@ -102,6 +135,26 @@ class SFTPFS(FS):
         The keyword argument 'root_path' specifies the root directory on the
         remote machine - access to files outside this root will be prevented.
 
+        Each thread accessing the filesystem gets its own SFTP channel, so
+        operations from different threads run concurrently.  Since all the
+        channels share a single SSH connection by default, its encryption
+        and flow-control can become a bottleneck; if 'num_transports' is
+        greater than one, that many SSH connections are opened and the
+        threads' channels are spread evenly across them.  This requires a
+        hostname or (hostname,port) tuple as the connection.
+
+        Files opened in mode "r-" are read with many requests outstanding,
+        by prefetching the whole file in the background; files opened in
+        mode "w-" are written without waiting for the server to acknowledge
+        each write, so errors may not be reported until the file is closed.
+        getcontents() and setcontents() use these modes.
+
+        Files are copied on the server when it supports the "copy-data"
+        extension.  Otherwise, if 'remote_cp' is True, copy() and copydir()
+        try running "cp" on the server over an exec channel; this needs a
+        shell account whose paths match those seen over SFTP.  Failing that,
+        copies are streamed through the client.
+
         :param connection: a connection string
         :param root_path: The root path to open
         :param encoding: String encoding of paths (defaults to UTF-8)
@@ -113,6 +166,9 @@ class SFTPFS(FS):
         :param no_auth: attempt to log in without any kind of authorization
         :param look_for_keys: Look for keys in the same locations as ssh,
             if other authentication is not succesful
+        :param num_transports: Number of SSH connections to open to the server
+        :param window_size: Flow-control window size for each SFTP channel
+        :param remote_cp: Allow copying files with "cp" on the server
 
         """
         credentials = dict(username=username,
@@ -126,8 +182,15 @@ class SFTPFS(FS):
         self.closed = False
         self._owns_transport = False
         self._credentials = credentials
+        self._auth_options = dict(agent_auth=agent_auth,
+                                  no_auth=no_auth,
+                                  look_for_keys=look_for_keys)
         self._tlocal = thread_local()
         self._transport = None
+        self._transports = []
+        self._num_clients = 0
+        self._window_size = window_size
+        self._remote_cp = remote_cp
         self._client = None
 
         self.hostname = None
@@ -141,7 +204,7 @@ class SFTPFS(FS):
 
         if isinstance(connection,paramiko.Channel):
             self._transport = None
-            self._client = paramiko.SFTPClient(connection)
+            self._client = _SFTPClient(connection)
         else:
             if not isinstance(connection,paramiko.Transport):
                 connection = paramiko.Transport(connection)
@@ -158,13 +221,31 @@ class SFTPFS(FS):
         if not connection.is_active():
             raise RemoteConnectionError(msg='Unable to connect')
 
-        if no_auth:
+        self._authenticate(connection)
+        self._transport = connection
+        self._transports.append(connection)
+
+        if num_transports > 1:
+            if not self._owns_transport:
+                raise ValueError("num_transports requires a hostname or (hostname,port) connection")
+            for _ in xrange(num_transports - 1):
+                self._transports.append(self._connect_transport(connection.getpeername()))
+
+    def __unicode__(self):
+        return u'<SFTPFS: %s>' % self.desc('/')
+
+    def _authenticate(self, connection):
+        """Authenticate a freshly-started transport to the server."""
+        if self._auth_options['no_auth']:
             try:
                 connection.auth_none('')
             except paramiko.SSHException:
                 pass
 
         elif not connection.is_authenticated():
+            username = self._credentials['username']
+            password = self._credentials['password']
+            pkey = self._credentials['pkey']
             if not username:
                 username = getuser()
             try:
@@ -174,10 +255,10 @@ class SFTPFS(FS):
                 if not connection.is_authenticated() and password:
                     connection.auth_password(username, password)
 
-                if agent_auth and not connection.is_authenticated():
+                if self._auth_options['agent_auth'] and not connection.is_authenticated():
                     self._agent_auth(connection, username)
 
-                if look_for_keys and not connection.is_authenticated():
+                if self._auth_options['look_for_keys'] and not connection.is_authenticated():
                     self._userkeys_auth(connection, username, password)
 
                 if not connection.is_authenticated():
@@ -196,10 +277,19 @@ class SFTPFS(FS):
                 self.close()
                 raise RemoteConnectionError(msg='SSH exception (%s)' % str(e), details=e)
 
-        self._transport = connection
-
-    def __unicode__(self):
-        return u'<SFTPFS: %s>' % self.desc('/')
+    def _connect_transport(self, address):
+        """Open an additional authenticated transport to the server."""
+        transport = paramiko.Transport(address)
+        transport.daemon = True
+        try:
+            transport.start_client()
+            if not transport.is_active():
+                raise RemoteConnectionError(msg='Unable to connect')
+            self._authenticate(transport)
+        except Exception:
+            transport.close()
+            raise
+        return transport
 
     @classmethod
     def _agent_auth(cls, transport, username):
@@ -260,6 +350,7 @@ class SFTPFS(FS):
     def __getstate__(self):
         state = super(SFTPFS,self).__getstate__()
         del state["_tlocal"]
+        state['_transports'] = len(self._transports)
         if self._owns_transport:
             state['_transport'] = self._transport.getpeername()
         return state
@@ -270,20 +361,32 @@ class SFTPFS(FS):
         #    self.__dict__[k] = v
         #self._lock = threading.RLock()
         self._tlocal = thread_local()
+        num_transports = self._transports
+        self._transports = []
         if self._owns_transport:
-            self._transport = paramiko.Transport(self._transport)
+            address = self._transport
+            self._transport = paramiko.Transport(address)
             self._transport.connect(**self._credentials)
+            self._transports.append(self._transport)
+            for _ in xrange(num_transports - 1):
+                self._transports.append(self._connect_transport(address))
+        elif self._transport is not None:
+            self._transports.append(self._transport)
 
     @property
-    @synchronize
     def client(self):
+        #  The FS-level lock is only needed while creating a new channel;
+        #  after that each thread uses its own channel without locking.
         if self.closed:
             return None
         client = getattr(self._tlocal, 'client', None)
         if client is None:
             if self._transport is None:
                 return self._client
-            client = paramiko.SFTPClient.from_transport(self._transport)
+            with self._lock:
+                transport = self._transports[self._num_clients % len(self._transports)]
+                self._num_clients += 1
+                client = _SFTPClient.from_transport(transport, window_size=self._window_size)
             self._tlocal.client = client
         return client
 #        try:
@@ -302,8 +405,10 @@ class SFTPFS(FS):
             self._tlocal = None
             #if self.client:
             #    self.client.close()
-            if self._owns_transport and self._transport and self._transport.is_active:
-                self._transport.close()
+            if self._owns_transport:
+                for transport in self._transports:
+                    if transport.is_active():
+                        transport.close()
             self.closed = True
 
     def _normpath(self, path):
@@ -329,17 +434,12 @@ class SFTPFS(FS):
             url = 'sftp://%s%s' % (self.hostname.rstrip('/'), abspath(path))
         return url
 
-    @synchronize
     @convert_os_errors
     @iotools.filelike_to_stream
     def open(self, path, mode='r', buffering=-1, encoding=None, errors=None, newline=None, line_buffering=False, bufsize=-1, **kwargs):
-        npath = self._normpath(path)
-        if self.isdir(path):
-            msg = "that's a directory: %(path)s"
-            raise ResourceInvalidError(path, msg=msg)
         #  paramiko implements its own buffering and write-back logic,
         #  so we don't need to use a RemoteFileBuffer here.
-        f = self.client.open(npath, mode, bufsize)
+        f = self._open(path, mode, bufsize)
         #  Unfortunately it has a broken truncate() method.
         #  TODO: implement this as a wrapper
         old_truncate = f.truncate
@@ -351,7 +451,76 @@ class SFTPFS(FS):
         f.truncate = new_truncate
         return f
 
-    @synchronize
+    def _open(self, path, mode, bufsize=-1):
+        """Open a paramiko SFTPFile, pipelining requests in "-" modes."""
+        npath = self._normpath(path)
+        try:
+            f = self.client.open(npath, mode.replace("-", ""), bufsize)
+        except IOError:
+            #  Rather than checking for a directory before every open,
+            #  only do so once it has failed.
+            if self.isdir(path):
+                raise ResourceInvalidError(path, msg="that's a directory: %(path)s")
+            raise
+        if "r" in mode and "+" not in mode:
+            #  Some servers, such as OpenSSH's, will open a directory for
+            #  reading, so check what was opened.
+            stat = f.stat()
+            if statinfo.S_ISDIR(stat.st_mode):
+                f.close()
+                raise ResourceInvalidError(path, msg="that's a directory: %(path)s")
+            if "-" in mode:
+                f.prefetch(stat.st_size)
+        elif "-" in mode:
+            f.set_pipelined(True)
+        return f
+
+    @convert_os_errors
+    def getcontents(self, path, mode="rb", encoding=None, errors=None, newline=None):
+        if "r" not in mode:
+            raise ValueError("mode must contain 'r' to be readable")
+        f = self._open(path, "rb-")
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        if "b" not in mode:
+            return iotools.decode_binary(data, encoding=encoding, errors=errors, newline=newline)
+        return data
+
+    @convert_os_errors
+    def _setcontents(self, path, data, encoding=None, errors=None, chunk_size=1024 * 64, progress_callback=None, finished_callback=None):
+        #  As for FS._setcontents, but writing with pipelined requests.
+        if not data:
+            return super(SFTPFS, self)._setcontents(path, data, encoding, errors, chunk_size, progress_callback, finished_callback)
+        if progress_callback is None:
+            progress_callback = lambda bytes_written: None
+        if finished_callback is None:
+            finished_callback = lambda: None
+        bytes_written = 0
+        progress_callback(0)
+        if hasattr(data, 'read'):
+            read = data.read
+        else:
+            #  Treat a string as a file that's read in a single chunk.
+            chunks = [b'', data]
+            read = lambda size: chunks.pop()
+        chunk = read(chunk_size)
+        if isinstance(chunk, six.text_type):
+            f = self.open(path, 'wt-', encoding=encoding, errors=errors)
+        else:
+            f = self.open(path, 'wb-')
+        try:
+            while chunk:
+                f.write(chunk)
+                bytes_written += len(chunk)
+                progress_callback(bytes_written)
+                chunk = read(chunk_size)
+        finally:
+            f.close()
+        finished_callback()
+        return bytes_written
+
     def desc(self, path):
         npath = self._normpath(path)
         if self.hostname:
@@ -360,7 +529,6 @@ class SFTPFS(FS):
             addr, port = self._transport.getpeername()
             return u'sftp://%s:%i%s' % (addr, port, self.client.normalize(npath))
 
-    @synchronize
     @convert_os_errors
     def exists(self, path):
         if path in ('', '/'):
@@ -374,7 +542,6 @@ class SFTPFS(FS):
             raise
         return True
 
-    @synchronize
     @convert_os_errors
     def isdir(self,path):
         if normpath(path) in ('', '/'):
@@ -388,7 +555,6 @@ class SFTPFS(FS):
             raise
         return statinfo.S_ISDIR(stat.st_mode) != 0
 
-    @synchronize
     @convert_os_errors
     def isfile(self,path):
         npath = self._normpath(path)
@@ -400,7 +566,6 @@ class SFTPFS(FS):
             raise
         return statinfo.S_ISREG(stat.st_mode) != 0
 
-    @synchronize
     @convert_os_errors
     def listdir(self,path="./",wildcard=None,full=False,absolute=False,dirs_only=False,files_only=False):
         npath = self._normpath(path)
@@ -441,7 +606,6 @@ class SFTPFS(FS):
 
         return self._listdir_helper(path, paths, wildcard, full, absolute, False, False)
 
-    @synchronize
     @convert_os_errors
     def listdirinfo(self,path="./",wildcard=None,full=False,absolute=False,dirs_only=False,files_only=False):
         npath = self._normpath(path)
@@ -485,7 +649,6 @@ class SFTPFS(FS):
         return [(p, getinfo(p)) for p in
                     self._listdir_helper(path, paths, wildcard, full, absolute, False, False)]
 
-    @synchronize
     @convert_os_errors
     def makedir(self,path,recursive=False,allow_recreate=False):
         npath = self._normpath(path)
@@ -513,7 +676,6 @@ class SFTPFS(FS):
                 else:
                     raise ResourceInvalidError(path,msg="Can't create directory, there's already a file of that name: %(path)s")
 
-    @synchronize
     @convert_os_errors
     def remove(self,path):
         npath = self._normpath(path)
@@ -526,7 +688,6 @@ class SFTPFS(FS):
                 raise ResourceInvalidError(path,msg="Cannot use remove() on a directory: %(path)s")
             raise
 
-    @synchronize
     @convert_os_errors
     def removedir(self,path,recursive=False,force=False):
         npath = self._normpath(path)
@@ -558,7 +719,6 @@ class SFTPFS(FS):
             except DirectoryNotEmptyError:
                 pass
 
-    @synchronize
     @convert_os_errors
     def rename(self,src,dst):
         nsrc = self._normpath(src)
@@ -572,7 +732,6 @@ class SFTPFS(FS):
                 raise ParentDirectoryMissingError(dst)
             raise
 
-    @synchronize
     @convert_os_errors
     def move(self,src,dst,overwrite=False,chunk_size=16384):
         nsrc = self._normpath(src)
@@ -590,7 +749,6 @@ class SFTPFS(FS):
                 raise ParentDirectoryMissingError(dst,msg="Destination directory does not exist: %(path)s")
             raise
 
-    @synchronize
     @convert_os_errors
     def movedir(self,src,dst,overwrite=False,ignore_errors=False,chunk_size=16384):
         nsrc = self._normpath(src)
@@ -608,6 +766,86 @@ class SFTPFS(FS):
                 raise ParentDirectoryMissingError(dst,msg="Destination directory does not exist: %(path)s")
             raise
 
+    @convert_os_errors
+    def copy(self,src,dst,overwrite=False,chunk_size=1024 * 64):
+        if not self.isfile(src):
+            if self.isdir(src):
+                raise ResourceInvalidError(src,msg="Source is not a file: %(path)s")
+            raise ResourceNotFoundError(src)
+        if not overwrite and self.exists(dst):
+            raise DestinationExistsError(dst)
+        try:
+            self._copy(src,dst,chunk_size)
+        except IOError, e:
+            if getattr(e,"errno",None) == ENOENT and not self.isdir(dirname(dst)):
+                raise ParentDirectoryMissingError(dst)
+            raise
+
+    def _copy(self,src,dst,chunk_size):
+        """Copy a file using the fastest method the server allows."""
+        client = self.client
+        if "copy-data" in getattr(client,"extensions",{}):
+            fsrc = self._open(src,"rb")
+            try:
+                fdst = self._open(dst,"wb")
+                try:
+                    #  A length of zero copies everything up to EOF.
+                    client._request(CMD_EXTENDED,"copy-data",fsrc.handle,0L,0L,fdst.handle,0L)
+                finally:
+                    fdst.close()
+            finally:
+                fsrc.close()
+            return
+        if self._remote_cp:
+            if self._remote_command("cp","--reflink=auto","--",self._normpath(src),self._normpath(dst)):
+                return
+        fsrc = self._open(src,"rb-")
+        try:
+            fdst = self._open(dst,"wb-")
+            try:
+                chunk = fsrc.read(chunk_size)
+                while chunk:
+                    fdst.write(chunk)
+                    chunk = fsrc.read(chunk_size)
+            finally:
+                fdst.close()
+        finally:
+            fsrc.close()
+
+    def copydir(self,src,dst,overwrite=False,ignore_errors=False,chunk_size=16384):
+        if self._remote_cp:
+            if not self.isdir(src):
+                raise ResourceInvalidError(src,msg="Source is not a directory: %(path)s")
+            if not overwrite and self.exists(dst):
+                raise DestinationExistsError(dst)
+            #  With -T, cp merges src into dst rather than copying it inside.
+            if self._remote_command("cp","-R","-T","--reflink=auto","--",self._normpath(src),self._normpath(dst)):
+                return
+        super(SFTPFS,self).copydir(src,dst,overwrite=overwrite,ignore_errors=ignore_errors,chunk_size=chunk_size)
+
+    def _remote_command(self,*args):
+        """Run a command on the server, returning True if it succeeded.
+
+        This returns False if the command fails or the server doesn't let
+        us execute commands, in which case the caller should fall back to
+        doing the work over SFTP.  If the server refuses to execute it at
+        all, remote commands are disabled for this filesystem.
+        """
+        if self._transport is None:
+            return False
+        args = [a.encode(self.encoding) if isinstance(a,unicode) else a for a in args]
+        command = " ".join(pipes.quote(a) for a in args)
+        try:
+            chan = self._transport.open_session()
+            try:
+                chan.exec_command(command)
+                return chan.recv_exit_status() == 0
+            finally:
+                chan.close()
+        except paramiko.SSHException:
+            self._remote_cp = False
+            return False
+
     _info_vars = frozenset('st_size st_uid st_gid st_mode st_atime st_mtime'.split())
     @classmethod
     def _extract_info(cls, stats):
@@ -625,7 +863,6 @@ class SFTPFS(FS):
             info['modified_time'] = fromtimestamp(mt)
         return info
 
-    @synchronize
     @convert_os_errors
     def getinfo(self, path):
         npath = self._normpath(path)
@@ -643,7 +880,6 @@ class SFTPFS(FS):
             info['modified_time'] = datetime.datetime.fromtimestamp(mt)
         return info
 
-    @synchronize
     @convert_os_errors
     def getsize(self, path):
         npath = self._normpath(path)
@@ -35,6 +35,60 @@ except ImportError:
 import six
 from six import PY3, b
 
+from fs.wrapfs import WrapFS
+from fs.memoryfs import MemoryFS
+
+
+class CountingFS(WrapFS):
+    """Wraps an FS, counting the calls made to some of its methods.
+
+    'calls' maps the name of each method in 'methods' to the number of
+    times it has been called.  Calls that a counted method makes on the
+    same FS aren't counted again.  If 'latency' is given, each counted call
+    is delayed by that many seconds, as it would be on a remote FS.  The
+    wrapped FS defaults to a new MemoryFS.
+    """
+
+    def __init__(self, fs=None, methods=("getinfo", "listdirinfo"), latency=0):
+        if fs is None:
+            fs = MemoryFS()
+        super(CountingFS, self).__init__(fs)
+        self.methods = frozenset(methods)
+        self.latency = latency
+        self.calls = {}
+        self._depth = threading.local()
+
+    def total_calls(self):
+        """Get the number of counted calls made to all methods."""
+        return sum(self.calls.values())
+
+    def _count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _call(self, name, *args, **kwds):
+        depth = getattr(self._depth, "value", 0)
+        if depth == 0 and name in self.methods:
+            self._count(name)
+        self._depth.value = depth + 1
+        try:
+            return getattr(super(CountingFS, self), name)(*args, **kwds)
+        finally:
+            self._depth.value = depth
+
+
+def _counted_method(name):
+    def method(self, *args, **kwds):
+        return self._call(name, *args, **kwds)
+    method.__name__ = name
+    return method
+
+for _name in ("exists", "isdir", "isfile", "getinfo", "listdir", "listdirinfo",
+              "open", "getcontents", "setcontents", "makedir", "remove"):
+    setattr(CountingFS, _name, _counted_method(_name))
+del _name
+
 
 class FSTestCases(object):
     """Base suite of testcases for filesystem implementations.
@@ -173,6 +227,15 @@ class FSTestCases(object):
         self.fs.setcontents("hello", b(""))
         self.assertEquals(self.fs.getcontents("hello", "rb"), b(""))
 
+    def test_download(self):
+        self.fs.setcontents("hello", b("to you, good sir!"))
+        f = StringIO()
+        self.fs.download("hello", f, chunk_size=2)
+        self.assertEquals(f.getvalue(), b("to you, good sir!"))
+        self.fs.makedir("dir")
+        self.assertRaises(ResourceNotFoundError, self.fs.download, "missing", f)
+        self.assertRaises(ResourceInvalidError, self.fs.download, "dir", f)
+
     def test_setcontents_async(self):
         #  setcontents() should accept both a string...
         self.fs.setcontents_async("hello", b("world")).wait()
@@ -437,6 +500,24 @@ class FSTestCases(object):
         self.fs.remove("dir1/a.txt")
         self.assertFalse(self.check("/dir1/a.txt"))
 
+    def test_removemany(self):
+        for name in ("a.txt", "b.txt", "c.txt"):
+            self.fs.setcontents(name, b('data'))
+        self.fs.makedir("dir1")
+        failures = self.fs.removemany(["a.txt", "missing.txt", "b.txt", "dir1"],
+                                      ignore_errors=True)
+        self.assertFalse(self.check("a.txt"))
+        self.assertFalse(self.check("b.txt"))
+        self.assertTrue(self.check("c.txt"))
+        self.assertTrue(self.check("dir1"))
+        self.assertEqual([path for (path, error) in failures], ["missing.txt", "dir1"])
+        self.assertTrue(isinstance(failures[0][1], ResourceNotFoundError))
+        self.assertTrue(isinstance(failures[1][1], ResourceInvalidError))
+        self.assertRaises(ResourceNotFoundError, self.fs.removemany,
+                          ["missing.txt", "c.txt"])
+        self.assertFalse(self.check("c.txt"))
+        self.assertEqual(self.fs.removemany([]), [])
+
     def test_removedir(self):
         check = self.check
         self.fs.makedir("a")
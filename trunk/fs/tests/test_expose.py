@@ -8,11 +8,13 @@ import unittest
 import sys
 import os
 import os.path
+import errno
 import socket
 import threading
 import time
+import httplib
 
-from fs.tests import FSTestCases, ThreadingTestCases
+from fs.tests import FSTestCases, ThreadingTestCases, CountingFS
 from fs.tempfs import TempFS
 from fs.osfs import OSFS
 from fs.memoryfs import MemoryFS
@@ -26,9 +28,12 @@ import six
 from six import PY3, b
 
 from fs.tests.test_rpcfs import TestRPCFS
+from fs.expose.http import FSHTTPRequestHandler
 
 try:
+    import paramiko
     from fs import sftpfs
+    from fs.expose import sftp
     from fs.expose.sftp import BaseSFTPServer
 except ImportError:
     if not PY3:
@@ -55,6 +60,339 @@ class TestSFTPFS(TestRPCFS):
         # TODO: do this using a paramiko.Transport() connection
         pass
 
+    def test_pipelined_modes(self):
+        data = os.urandom(1024 * 1024 + 123)
+        f = self.fs.open("big.bin", "wb-")
+        for i in xrange(0, len(data), 10000):
+            f.write(data[i:i+10000])
+        f.close()
+        self.assertEquals(self.fs.getsize("big.bin"), len(data))
+        f = self.fs.open("big.bin", "rb-")
+        try:
+            self.assertEquals(f.read(5000), data[:5000])
+            f.seek(600000)
+            self.assertEquals(f.read(), data[600000:])
+        finally:
+            f.close()
+        self.assertEquals(self.fs.getcontents("big.bin"), data)
+        self.fs.setcontents("text.txt", u"caf\xe9\n", encoding="utf-8")
+        self.assertEquals(self.fs.getcontents("text.txt", "rt", encoding="utf-8"), u"caf\xe9\n")
+
+    def test_copy_remote_cp_fallback(self):
+        # The test server doesn't allow exec, so this streams the copy.
+        fs = sftpfs.SFTPFS(self.server_addr, no_auth=True, remote_cp=True)
+        try:
+            fs.setcontents("a.txt", b("hello"))
+            fs.copy("a.txt", "b.txt")
+            self.assertEquals(fs.getcontents("b.txt"), b("hello"))
+            fs.makedir("dir")
+            fs.setcontents("dir/c.txt", b("world"))
+            fs.copydir("dir", "dir2")
+            self.assertEquals(fs.getcontents("dir2/c.txt"), b("world"))
+            self.assertFalse(fs._remote_cp)
+        finally:
+            fs.close()
+
+    def test_open_directory(self):
+        self.fs.makedir("dir")
+        for mode in ("r", "rb-", "w", "wb-"):
+            self.assertRaises(ResourceInvalidError, self.fs.open, "dir", mode)
+        self.assertRaises(ResourceNotFoundError, self.fs.open, "missing", "rb-")
+        self.assertRaises(ResourceNotFoundError, self.fs.getcontents, "missing")
+
+    def test_open_directory_succeeds_on_server(self):
+        #  OpenSSH's server lets a directory be opened for reading.
+        self.fs.makedir("dir")
+        client = self.fs.client
+        opened = []
+        class DirHandle(object):
+            def __init__(self, path):
+                self.path = path
+                self.closed = False
+            def stat(self):
+                return client.stat(self.path)
+            def close(self):
+                self.closed = True
+        def open_dir(path, mode="r", bufsize=-1):
+            opened.append(DirHandle(path))
+            return opened[-1]
+        client.open = open_dir
+        try:
+            for mode in ("r", "rb", "rb-"):
+                self.assertRaises(ResourceInvalidError, self.fs.open, "dir", mode)
+        finally:
+            del client.open
+        self.assertEquals([f.closed for f in opened], [True] * 3)
+
+
+class _CopyDataSFTPServer(sftp.SFTPServer):
+    """SFTP server supporting the "copy-data" extension."""
+
+    copies = 0
+
+    def _send_server_version(self):
+        t, data = self._read_packet()
+        version = paramiko.Message(data).get_int()
+        msg = paramiko.Message()
+        msg.add_int(3)
+        msg.add("check-file", "md5,sha1", "copy-data", "1")
+        self._send_packet(paramiko.sftp.CMD_VERSION, msg)
+        return version
+
+    def _process(self, t, request_number, msg):
+        if t == paramiko.sftp.CMD_EXTENDED and msg.get_text() == "copy-data":
+            src = self.file_table[msg.get_binary()]
+            src_offset = msg.get_int64()
+            length = msg.get_int64()
+            dst = self.file_table[msg.get_binary()]
+            dst_offset = msg.get_int64()
+            while True:
+                size = 32768
+                if length:
+                    size = min(size, length)
+                data = src.read(src_offset, size)
+                if not data:
+                    break
+                dst.write(dst_offset, data)
+                src_offset += len(data)
+                dst_offset += len(data)
+                if length:
+                    length -= len(data)
+                    if not length:
+                        break
+            _CopyDataSFTPServer.copies += 1
+            self._send_status(request_number, paramiko.SFTP_OK)
+        else:
+            msg.rewind()
+            msg.get_int()
+            super(_CopyDataSFTPServer, self)._process(t, request_number, msg)
+
+
+class _CopyDataRequestHandler(sftp.SFTPRequestHandler):
+
+    def setup(self):
+        sftp.SFTPRequestHandler.setup(self)
+        self.transport.set_subsystem_handler("sftp", _CopyDataSFTPServer, sftp.SFTPServerInterface, self.server.fs, encoding=self.server.encoding)
+
+
+class TestSFTPFS_copydata(TestSFTPFS):
+
+    def makeServer(self,fs,addr):
+        return BaseSFTPServer(addr,fs,RequestHandlerClass=_CopyDataRequestHandler)
+
+    def test_copy_uses_copy_data(self):
+        data = os.urandom(100000)
+        self.fs.setcontents("a.bin", data)
+        copies = _CopyDataSFTPServer.copies
+        self.fs.copy("a.bin", "b.bin")
+        self.assertEquals(_CopyDataSFTPServer.copies, copies + 1)
+        self.assertEquals(self.fs.getcontents("b.bin"), data)
+
+
+class TestSFTPFS_transports(TestSFTPFS):
+
+    def setUp(self):
+        self.startServer()
+        self.fs = sftpfs.SFTPFS(self.server_addr, no_auth=True, num_transports=3)
+
+    def test_threads_share_transports(self):
+        clients = []
+        def getclient():
+            clients.append(self.fs.client)
+        threads = [threading.Thread(target=getclient) for _ in xrange(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEquals(len(set(clients)), 6)
+        transports = [c.sock.get_transport() for c in clients]
+        self.assertEquals(len(set(transports)), 3)
+
+
+class TestSFTPServerInterface(unittest.TestCase):
+
+    __test__ = not PY3
+
+    def setUp(self):
+        self.fs = CountingFS()
+        self.fs.makedir("dir")
+        for i in xrange(10):
+            self.fs.setcontents("dir/f%d.txt" % (i,), b("x") * i)
+        self.fs.makedir("dir/sub")
+        self.server = sftp.SFTPServerInterface(None, self.fs, read_ahead=1000)
+
+    def test_list_folder(self):
+        stats = self.server.list_folder("/dir")
+        self.assertEquals(len(stats), 11)
+        self.assertEquals(self.fs.calls, {"listdirinfo": 1})
+        self.assertEquals(self.server.stat("/dir/f3.txt").st_size, 3)
+        self.assertTrue(self.server.stat("dir/sub").st_mode & 040000)
+        self.assertEquals(self.fs.calls, {"listdirinfo": 1})
+        self.server.remove("/dir/f3.txt")
+        self.assertEquals(self.server.stat("/dir/f3.txt"), paramiko.SFTP_NO_SUCH_FILE)
+        self.server.list_folder("/dir")
+        self.server.attr_timeout = 0
+        self.server.list_folder("/dir")
+        self.server.stat("/dir/f4.txt")
+        self.assertEquals(self.fs.calls, {"listdirinfo": 3, "getinfo": 2})
+
+    def test_read_ahead(self):
+        data = os.urandom(10000)
+        self.fs.setcontents("big.bin", data)
+        handle = self.server.open("/big.bin", os.O_RDONLY, None)
+        reads = []
+        read = handle._file.read
+        def counting_read(size=-1):
+            reads.append(size)
+            return read(size)
+        handle._file.read = counting_read
+        chunks = [handle.read(offset, 100) for offset in xrange(0, 10000, 100)]
+        self.assertEquals(b("").join(chunks), data)
+        self.assertEquals(len(reads), 10)
+        self.assertEquals(handle.read(5000, 10), data[5000:5010])
+        self.assertEquals(handle.read(9990, 100), data[9990:])
+        self.assertEquals(handle.read(10000, 100), b(""))
+        handle.close()
+        handle = self.server.open("/out.bin", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, None)
+        handle.write(0, b("hello "))
+        handle.write(6, b("world"))
+        handle.write(0, b("H"))
+        handle.close()
+        self.assertEquals(self.fs.getcontents("out.bin"), b("Hello world"))
+
+
+from fs.expose.http import FSHTTPServer
+
+class _QuietHTTPRequestHandler(FSHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class TestHTTPExpose(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_fs = TempFS()
+        self.data = b("").join(b("%05d\n") % (i,) for i in xrange(2000))
+        self.temp_fs.setcontents("data.txt", self.data)
+        self.temp_fs.makedir("dir")
+        self.temp_fs.setcontents("dir/a.txt", b("a"))
+        self.temp_fs.makedir("dir/sub")
+        self.server = FSHTTPServer(self.temp_fs, ("127.0.0.1", 0), buffer_size=1000)
+        self.server.RequestHandlerClass = _QuietHTTPRequestHandler
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.conn = httplib.HTTPConnection("127.0.0.1", self.server.server_address[1])
+
+    def tearDown(self):
+        self.conn.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.temp_fs.close()
+
+    def request(self, path, method="GET", **headers):
+        self.conn.request(method, path, headers=headers)
+        response = self.conn.getresponse()
+        return (response, response.read())
+
+    def test_keep_alive(self):
+        (response, body) = self.request("/data.txt")
+        self.assertEquals((response.status, body), (200, self.data))
+        sock = self.conn.sock
+        (response, body) = self.request("/data.txt", method="HEAD")
+        self.assertEquals((response.status, body), (200, b("")))
+        self.assertEquals(response.getheader("Content-Length"), str(len(self.data)))
+        (response, body) = self.request("/dir")
+        self.assertEquals(response.status, 301)
+        (response, body) = self.request("/dir/")
+        self.assertTrue(b('href="sub/"') in body and b('href="a.txt"') in body)
+        self.assertTrue(self.conn.sock is sock)
+
+    def test_conditional(self):
+        (response, body) = self.request("/data.txt")
+        etag = response.getheader("ETag")
+        last_modified = response.getheader("Last-Modified")
+        (response, body) = self.request("/data.txt", **{"If-None-Match": etag})
+        self.assertEquals((response.status, body), (304, b("")))
+        (response, body) = self.request("/data.txt", **{"If-Modified-Since": last_modified})
+        self.assertEquals(response.status, 304)
+
+    def test_ranges(self):
+        (response, body) = self.request("/data.txt", Range="bytes=1000-2999")
+        self.assertEquals((response.status, body), (206, self.data[1000:3000]))
+        self.assertEquals(response.getheader("Content-Range"),
+                          "bytes 1000-2999/%d" % (len(self.data),))
+        (response, body) = self.request("/data.txt", Range="bytes=0-1,-2")
+        self.assertEquals(response.status, 206)
+        self.assertTrue(response.getheader("Content-Type").startswith("multipart/byteranges"))
+        self.assertTrue(self.data[:2] in body and self.data[-2:] in body)
+        (response, body) = self.request("/data.txt", Range="bytes=%d-" % (len(self.data),))
+        self.assertEquals(response.status, 416)
+
+
+try:
+    import ftplib
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.servers import FTPServer
+    from fs.expose import ftp
+except ImportError:
+    ftp = None
+
+
+class TestFTPExpose(unittest.TestCase):
+
+    def setUp(self):
+        if ftp is None:
+            self.skipTest("pyftpdlib is not installed")
+        self.fs = CountingFS()
+        self.fs.makedir("dir")
+        for i in xrange(20):
+            self.fs.setcontents("dir/f%02d.txt" % (i,), b("x") * i)
+        self.fs.makedir("dir/sub")
+        logging.getLogger("pyftpdlib").setLevel(logging.CRITICAL)
+        class Handler(ftp.FTPFSHandler):
+            authorizer = DummyAuthorizer()
+            abstracted_fs = ftp.FTPFSFactory(self.fs)
+        Handler.authorizer.add_user("user", "12345", "/", perm="elradfmw")
+        self.server = FTPServer(("127.0.0.1", 0), Handler)
+        self.serving = True
+        self.server_thread = threading.Thread(target=self.serve)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.client = ftplib.FTP()
+        self.client.connect("127.0.0.1", self.server.address[1])
+        self.client.login("user", "12345")
+
+    def serve(self):
+        # The server's IOLoop must only be used from this thread.
+        while self.serving:
+            self.server.serve_forever(timeout=0.05, blocking=False)
+        self.server.close_all()
+
+    def tearDown(self):
+        self.client.close()
+        self.serving = False
+        self.server_thread.join()
+
+    def test_listing(self):
+        for command in ("LIST /dir", "MLSD /dir"):
+            self.fs.calls.clear()
+            lines = []
+            self.client.retrlines(command, lines.append)
+            self.assertEquals(len(lines), 21)
+            self.assertEquals(self.fs.calls, {"listdirinfo": 1})
+        self.assertTrue([l for l in lines if "type=dir" in l and l.endswith(" sub")])
+        self.assertTrue([l for l in lines if "size=7;" in l and l.endswith(" f07.txt")])
+        self.client.delete("/dir/f07.txt")
+        self.assertRaises(ftplib.error_perm, self.client.sendcmd, "MLST /dir/f07.txt")
+
+    def test_retr(self):
+        data = os.urandom(100000)
+        self.fs.setcontents("big.bin", data)
+        chunks = []
+        self.client.retrbinary("RETR /big.bin", chunks.append)
+        self.assertEquals(b("").join(chunks), data)
+
 
 try:
     from fs.expose import fuse
@@ -86,6 +424,194 @@ else:
         def check(self, p):
             return self.mounted_fs.exists(p)
 
+    class _FileInfo(object):
+        """Stands in for the fuse_file_info structure FUSE passes."""
+
+        def __init__(self, flags):
+            self.flags = flags
+            self.fh = None
+            self.keep_cache = None
+
+    class _CountingFile(object):
+        """Wraps a file object, counting calls to seek() and write()."""
+
+        def __init__(self, f):
+            self.f = f
+            self.seeks = 0
+            self.writes = 0
+            self.error = None
+
+        def seek(self, *args):
+            self.seeks += 1
+            return self.f.seek(*args)
+
+        def write(self, data):
+            self.writes += 1
+            if self.error is not None:
+                raise self.error
+            return self.f.write(data)
+
+        def __getattr__(self, name):
+            return getattr(self.f, name)
+
+    class TestFSOperations(unittest.TestCase):
+        """Drive FSOperations directly, without mounting anything."""
+
+        def setUp(self):
+            #  There's no FUSE request to get the caller's context from.
+            self._fuse_get_context = fuse.fuse_get_context
+            fuse.fuse_get_context = lambda: (0, 0, 0)
+            self.fs = CountingFS()
+            self.fs.makedir("dir")
+            self.fs.setcontents("dir/a.txt", b("hello"))
+            self.ops = fuse.FSOperations(self.fs, attr_timeout=60, negative_timeout=60)
+
+        def tearDown(self):
+            fuse.fuse_get_context = self._fuse_get_context
+
+        def _open(self, path, flags=os.O_RDONLY):
+            fi = _FileInfo(flags)
+            self.ops.open(path, fi)
+            return fi
+
+        def _counting_file(self, fi):
+            (f, path, lock) = self.ops._files_by_handle[fi.fh]
+            f = _CountingFile(f)
+            self.ops._files_by_handle[fi.fh] = (f, path, lock)
+            return f
+
+        def test_positional_reads(self):
+            t = TempFS()
+            try:
+                data = os.urandom(10000)
+                t.setcontents("a.bin", data)
+                self.ops = fuse.FSOperations(t)
+                fi = self._open("/a.bin")
+                self.assertTrue(isinstance(self.ops._files_by_handle[fi.fh][0], fuse._SysFile))
+                self.assertEquals(self.ops.read("/a.bin", 100, 5000, fi), data[5000:5100])
+                self.assertEquals(self.ops.read("/a.bin", 100, 9950, fi), data[9950:])
+                self.assertEquals(self.ops.read("/a.bin", 100, 0, fi), data[:100])
+                self.ops.release("/a.bin", fi)
+            finally:
+                t.close()
+
+        def test_sequential_io_doesnt_seek(self):
+            data = os.urandom(10000)
+            self.fs.setcontents("a.bin", data)
+            fi = self._open("/a.bin")
+            f = self._counting_file(fi)
+            chunks = [self.ops.read("/a.bin", 1000, offset, fi) for offset in xrange(0, 10000, 1000)]
+            self.assertEquals(b("").join(chunks), data)
+            self.assertEquals(f.seeks, 1)
+            self.assertEquals(self.ops.read("/a.bin", 10, 500, fi), data[500:510])
+            self.assertEquals(f.seeks, 2)
+            self.ops.release("/a.bin", fi)
+            self.ops = fuse.FSOperations(self.fs, write_buffer_size=0)
+            fi = self._open("/b.bin", os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+            f = self._counting_file(fi)
+            for offset in xrange(0, 10000, 1000):
+                self.ops.write("/b.bin", data[offset:offset+1000], offset, fi)
+            self.assertEquals(f.seeks, 1)
+            self.ops.release("/b.bin", fi)
+            self.assertEquals(self.fs.getcontents("b.bin", "rb"), data)
+
+        def test_coalesced_writes(self):
+            t = TempFS()
+            try:
+                self.ops = fuse.FSOperations(t)
+                fi = self._open("/a.txt", os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+                f = self._counting_file(fi)
+                for (i, c) in enumerate("hello"):
+                    self.ops.write("/a.txt", b(c) * 10, i * 10, fi)
+                self.assertEquals(f.writes, 0)
+                self.assertEquals(self.ops.getattr("/a.txt")["st_size"], 50)
+                #  Another handle sees the writes.
+                reader = self._open("/a.txt")
+                self.assertEquals(self.ops.read("/a.txt", 100, 0, reader),
+                                  b("h" * 10 + "e" * 10 + "l" * 20 + "o" * 10))
+                self.assertEquals(f.writes, 1)
+                self.ops.release("/a.txt", reader)
+                self.ops.release("/a.txt", fi)
+            finally:
+                t.close()
+
+        def test_truncate_pending_writes(self):
+            fi = self._open("/dir/a.txt", os.O_WRONLY)
+            self.ops.write("/dir/a.txt", b("hello world"), 0, fi)
+            self.ops.truncate("/dir/a.txt", 8)
+            self.assertEquals(self.fs.getcontents("dir/a.txt", "rb"), b("hello wo"))
+            self.ops.write("/dir/a.txt", b("!!"), 8, fi)
+            self.ops.truncate("/dir/a.txt", 9, fi)
+            self.ops.release("/dir/a.txt", fi)
+            self.assertEquals(self.fs.getcontents("dir/a.txt", "rb"), b("hello wo!"))
+
+        def test_write_errors_reported_by_flush(self):
+            fi = self._open("/dir/a.txt", os.O_WRONLY)
+            f = self._counting_file(fi)
+            f.error = StorageSpaceError("write")
+            self.assertEquals(self.ops.write("/dir/a.txt", b("hello"), 0, fi), 5)
+            try:
+                self.ops.flush("/dir/a.txt", fi)
+            except OSError, e:
+                self.assertEquals(e.errno, errno.ENOSPC)
+            else:
+                self.fail("OSError not raised")
+            f.error = None
+            self.ops.release("/dir/a.txt", fi)
+
+        def test_attribute_cache(self):
+            self.ops.readdir("/dir")
+            self.assertEquals(self.ops.getattr("/dir/a.txt")["st_size"], 5)
+            self.assertRaises(OSError, self.ops.getattr, "/dir/b.txt")
+            self.assertRaises(OSError, self.ops.getattr, "/dir/b.txt")
+            self.assertEquals(self.fs.calls, {"listdirinfo": 1, "getinfo": 1})
+            self.ops.mkdir("/dir/b.txt", 0755)
+            self.assertTrue(self.ops.getattr("/dir/b.txt")["st_mode"] & 040000)
+
+        def test_rename_invalidates(self):
+            self.ops.readdir("/dir")
+            self.ops.getattr("/dir")
+            self.assertRaises(OSError, self.ops.getattr, "/other/a.txt")
+            self.ops.rename("/dir", "/other")
+            self.assertFalse([p for p in self.ops._attr_cache if "dir" in p or "other" in p])
+            self.assertRaises(OSError, self.ops.getattr, "/dir/a.txt")
+            self.assertEquals(self.ops.getattr("/other/a.txt")["st_size"], 5)
+
+        def test_cache_is_locked(self):
+            #  Recursive invalidation iterates over the caches while holding
+            #  their lock, so nothing may change them without it.
+            info = self.ops.getattr("/dir/a.txt")
+            fi = self._open("/dir/a.txt", os.O_WRONLY)
+            for func in (lambda: self.ops._cache_attrs("/dir/b.txt", info),
+                         lambda: self.ops._get_cached_attrs("/dir/a.txt"),
+                         lambda: self.ops.write("/dir/a.txt", b("x"), 0, fi)):
+                thread = threading.Thread(target=func)
+                self.ops._attr_lock.acquire()
+                try:
+                    thread.start()
+                    thread.join(0.1)
+                    self.assertTrue(thread.is_alive())
+                finally:
+                    self.ops._attr_lock.release()
+                thread.join()
+            self.ops.release("/dir/a.txt", fi)
+
+        def test_keep_cache(self):
+            t = TempFS()
+            try:
+                t.setcontents("a.txt", b("aaaa"))
+                self.ops = fuse.FSOperations(t, attr_timeout=60)
+                for (data, keep) in ((None, 0), (None, 1), (b("bbbb"), 0)):
+                    if data is not None:
+                        time.sleep(0.01)
+                        t.setcontents("a.txt", data)
+                    self.ops.getattr("/a.txt")
+                    fi = self._open("/a.txt")
+                    self.assertEquals(fi.keep_cache, keep)
+                    self.ops.release("/a.txt", fi)
+            finally:
+                t.close()
+
 
 from fs.expose import dokan
 if dokan.is_available:
@@ -4,11 +4,14 @@ import unittest
 import marshal
 import imp
 import struct
+import time
 from textwrap import dedent
 
-from fs.expose.importhook import FSImportHook
+from fs.expose.importhook import FSImportHook, make_bundle
 from fs.tempfs import TempFS
+from fs.memoryfs import MemoryFS
 from fs.zipfs import ZipFS
+from fs.tests import CountingFS
 
 from six import b
 
@@ -141,3 +144,92 @@ class TestFSImportHook(unittest.TestCase):
             sys.path_hooks.remove(FSImportHook)
             sys.path.pop()
             t.close()
+
+    def test_lookups_use_index(self):
+        t = CountingFS(TempFS(),methods=("isfile","getinfo","listdirinfo"))
+        self._init_modules(t)
+        ih = FSImportHook(t,index_ttl=60)
+        sys.meta_path.append(ih)
+        try:
+            self._check_imports_are_working()
+            calls = t.total_calls()
+            self._check_imports_are_working()
+            self.assertEquals(t.total_calls(),calls)
+            #  Changes show up once the listing is checked again.
+            t.setcontents("fsih_helo.py",b("message = 'helo'"))
+            self.assertEquals(ih.find_module("fsih_helo"),None)
+            ih.index_ttl = 0
+            self.assertEquals(ih.find_module("fsih_helo"),ih)
+        finally:
+            sys.meta_path.remove(ih)
+            t.close()
+
+    def test_index_refreshed_without_dir_mtimes(self):
+        #  MemoryFS doesn't update a directory's modified time.
+        m = MemoryFS()
+        self._init_modules(m)
+        ih = FSImportHook(m,index_ttl=0.1)
+        try:
+            self.assertEquals(ih.find_module("fsih_pkg.sub3"),None)
+            m.setcontents("fsih_pkg/sub3.py",b("a = 3"))
+            time.sleep(0.2)
+            self.assertEquals(ih.find_module("fsih_pkg.sub3"),ih)
+        finally:
+            m.close()
+
+    def test_bytecode_cache(self):
+        t = TempFS()
+        self._init_modules(t)
+        cache = TempFS()
+        try:
+            ih = FSImportHook(t,bytecode_fs=cache)
+            self.assertEquals(ih.load_module("fsih_hello").message,"hello world!")
+            assert cache.isfile("fsih_hello.py.code")
+            #  A new hook uses the cached code, without reading the source.
+            ih = FSImportHook(t,bytecode_fs=cache)
+            t.getcontents = None
+            del sys.modules["fsih_hello"]
+            self.assertEquals(ih.load_module("fsih_hello").message,"hello world!")
+            del t.getcontents
+            #  Changed source is compiled again.
+            del sys.modules["fsih_hello"]
+            t.setcontents("fsih_hello.py",b("message = 'changed!'"))
+            ih = FSImportHook(t,bytecode_fs=cache)
+            self.assertEquals(ih.load_module("fsih_hello").message,"changed!")
+        finally:
+            t.close()
+            cache.close()
+
+    def test_bundle(self):
+        t = TempFS()
+        self._init_modules(t)
+        make_bundle(t)
+        ih = FSImportHook(t)
+        sys.meta_path.append(ih)
+        try:
+            #  Modules come from the bundle, without reading the sources.
+            t.getcontents = None
+            self._check_imports_are_working()
+            self.assertEquals(ih.get_filename("fsih_pkg"),"fsih_pkg/__init__.py")
+            self.assertEquals(ih.find_module("fsih_helo"),None)
+        finally:
+            sys.meta_path.remove(ih)
+            t.close()
+
+    def test_bundle_on_sys_path(self):
+        t = TempFS()
+        src = TempFS()
+        self._init_modules(src)
+        zpath = t.getsyspath("modules.zip")
+        make_bundle(src,ZipFS(zpath,"w")).close()
+        src.close()
+        sys.path.append("zip://" + zpath)
+        FSImportHook.install()
+        try:
+            self._check_imports_are_working()
+            self.assertNotEquals(sys.path_importer_cache[sys.path[-1]]._manifest,None)
+        finally:
+            sys.path_hooks.remove(FSImportHook)
+            sys.path.pop()
+            t.close()
+
@@ -0,0 +1,239 @@
+"""
+
+  fs.tests.test_remotefs:  testcases for fs.remotefs and fs.expose.serve
+
+"""
+
+import time
+import socket
+import unittest
+import threading
+
+from fs.tests import FSTestCases, ThreadingTestCases
+from fs.tempfs import TempFS
+from fs.path import *
+from fs.errors import *
+
+from fs import remotefs
+from fs.expose.serve import packetstream
+from fs.expose.serve.server import Server, EventLoopServer
+from fs.expose.serve.protocol import PRELUDE, CHUNK_SIZE, encode_error, decode_error
+
+from six import b
+
+
+class TestRemoteFS(unittest.TestCase, FSTestCases, ThreadingTestCases):
+
+    server_class = Server
+
+    def setUp(self):
+        self.temp_fs = TempFS()
+        self.server = self.server_class("127.0.0.1", 0, fs=self.temp_fs, num_threads=4)
+        self.server.listen()
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.fs = remotefs.RemoteFS("127.0.0.1", self.server.port)
+
+    def tearDown(self):
+        self.fs.close()
+        self.server.shutdown()
+        self.server_thread.join()
+        self.temp_fs.close()
+
+    def test_ping(self):
+        self.assertEquals(self.fs.ping(b("hello")), b("hello"))
+
+    def test_pipelined_calls(self):
+        for i in xrange(20):
+            self.temp_fs.setcontents("f%d" % (i,), b("x") * i)
+        call_ids = [self.fs._send_call("getinfo", ("f%d" % (i,),))
+                    for i in xrange(20)]
+        sizes = [self.fs._get_response(call_id)[0]["size"]
+                 for call_id in reversed(call_ids)]
+        self.assertEquals(sizes, range(19, -1, -1))
+
+    def test_streamed_file(self):
+        data = b("0123456789") * (CHUNK_SIZE // 2)
+        with self.fs.open("big.bin", "wb") as f:
+            for offset in xrange(0, len(data), 1000):
+                f.write(data[offset:offset+1000])
+        self.assertEquals(self.temp_fs.getcontents("big.bin", "rb"), data)
+        with self.fs.open("big.bin", "rb") as f:
+            self.assertEquals(f.read(), data)
+            pos = CHUNK_SIZE * 3 + 7
+            f.seek(pos)
+            self.assertEquals(f.read(20), data[pos:pos+20])
+
+    def test_errors(self):
+        self.assertRaises(ResourceNotFoundError, self.fs.getinfo, "missing")
+        self.assertRaises(ValueError, self.fs._remote_call, "read_file", 99, 0, 10)
+        #  Errors from pipelined writes are raised when the file is closed.
+        f = self.fs.open("a.txt", "wb")
+        self.fs._remote_call("close_file", f._f.handle)
+        f.write(b("hello"))
+        self.assertRaises(ValueError, f.close)
+
+
+class TestEventLoopRemoteFS(TestRemoteFS):
+
+    server_class = EventLoopServer
+
+    def _wait_for(self, condition):
+        for _ in xrange(500):
+            if condition():
+                return True
+            time.sleep(0.01)
+        return False
+
+    def test_many_connections(self):
+        num_threads = threading.active_count()
+        sockets = [socket.create_connection(("127.0.0.1", self.server.port))
+                   for _ in xrange(200)]
+        try:
+            self.assertTrue(self._wait_for(lambda: len(self.server.connections) == 201))
+            self.assertEquals(threading.active_count(), num_threads)
+            self.fs.setcontents("a.txt", b("hello"))
+            self.assertEquals(self.fs.getcontents("a.txt"), b("hello"))
+        finally:
+            for sock in sockets:
+                sock.close()
+        self.assertTrue(self._wait_for(lambda: len(self.server.connections) == 1))
+
+    def test_backpressure(self):
+        self.server.max_outgoing = 256 * 1024
+        self.server.max_in_flight = 8
+        payload = b("x") * (64 * 1024)
+        num_calls = 200
+        sock = socket.create_connection(("127.0.0.1", self.server.port))
+        def send_calls():
+            sock.sendall(PRELUDE)
+            for i in xrange(num_calls):
+                call = dict(type='rpc', method='ping', client_ref=i)
+                sock.sendall(packetstream.encode(packetstream.dumps(call), payload))
+        sender = threading.Thread(target=send_calls)
+        sender.daemon = True
+        sender.start()
+        try:
+            #  Nothing is read by the client, so the server must stop
+            #  reading rather than queue every response.
+            paused = lambda: [c for c in self.server.connections.values() if not c.reading]
+            self.assertTrue(self._wait_for(paused))
+            (connection,) = paused()
+            self.assertTrue(connection.outgoing_size < 2 * 1024 * 1024)
+            decoder = packetstream.JSONDecoder()
+            responses = []
+            while len(responses) < num_calls:
+                data = sock.recv(65536)
+                self.assertTrue(data)
+                responses.extend(decoder.feed(data))
+            sender.join()
+            self.assertEquals(sorted(h["client_ref"] for (h, p) in responses), range(num_calls))
+            self.assertTrue(all(p == payload for (h, p) in responses))
+        finally:
+            sock.close()
+
+    def test_bad_packets(self):
+        #  A connection sending garbage is closed, and others still work.
+        for packet in (b("3,0:abc"), b("-5,0:"), b("1,0:{")):
+            sock = socket.create_connection(("127.0.0.1", self.server.port))
+            try:
+                sock.sendall(PRELUDE + packet)
+                sock.settimeout(5)
+                while sock.recv(65536):
+                    pass
+            finally:
+                sock.close()
+            self.assertEquals(self.fs.ping(b("hello")), b("hello"))
+        self.assertTrue(self._wait_for(lambda: len(self.server.connections) == 1))
+        other = remotefs.RemoteFS("127.0.0.1", self.server.port)
+        try:
+            self.assertEquals(other.ping(b("hello")), b("hello"))
+        finally:
+            other.close()
+
+    def test_without_socketpair(self):
+        #  As on Windows, where the wakeup sockets are connected over TCP.
+        socketpair = getattr(socket, "socketpair", None)
+        if socketpair is not None:
+            del socket.socketpair
+        try:
+            server = self.server_class("127.0.0.1", 0, fs=self.temp_fs, num_threads=2)
+        finally:
+            if socketpair is not None:
+                socket.socketpair = socketpair
+        server.listen()
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        fs = remotefs.RemoteFS("127.0.0.1", server.port)
+        try:
+            fs.setcontents("a.txt", b("hello"))
+            self.assertEquals(fs.getcontents("a.txt"), b("hello"))
+        finally:
+            fs.close()
+            server.shutdown()
+            thread.join(10)
+        self.assertFalse(thread.isAlive())
+
+
+class TestPacketStream(unittest.TestCase):
+
+    def test_roundtrip(self):
+        packets = [(dict(a=1), b("payload")), ({}, b("")), (dict(b=[1, 2]), b(""))]
+        data = b("pyfs/1.0\n")
+        for (header, payload) in packets:
+            data += packetstream.encode(packetstream.dumps(header) if header else '', payload)
+        decoder = packetstream.JSONDecoder()
+        received = []
+        for i in xrange(len(data)):
+            received.extend(decoder.feed(data[i:i+1]))
+        self.assertEquals(received, packets)
+
+    def test_large_payloads(self):
+        packets = [({}, b("x") * 200000), (dict(a=1), b("y") * 100), ({}, b("z") * 70000)]
+        data = b("pyfs/1.0\n")
+        for (header, payload) in packets:
+            parts = packetstream.encode_vector(packetstream.dumps(header) if header else '', payload)
+            data += b("").join(parts)
+        self.assertEquals(len(packetstream.encode_vector('', b("x") * 200000)), 2)
+        for chunk_size in (1000, 65536, len(data)):
+            decoder = packetstream.JSONDecoder()
+            received = []
+            for i in xrange(0, len(data), chunk_size):
+                received.extend(decoder.feed(data[i:i+chunk_size]))
+            self.assertEquals(received, packets)
+
+    def test_broken_stream(self):
+        decoder = packetstream.Decoder(no_prelude=True)
+        self.assertRaises(packetstream.DecoderError, list, decoder.feed(b("x,y:")))
+        self.assertRaises(packetstream.DecoderError, list, decoder.feed(b("1,1:ab")))
+
+    def test_invalid_sizes(self):
+        for size in ("-5,0:", "0,-1:", "%d,0:" % (packetstream.Decoder.MAX_HEADER_SIZE + 1),
+                     "0,%d:" % (packetstream.Decoder.MAX_PAYLOAD_SIZE + 1)):
+            decoder = packetstream.Decoder(no_prelude=True)
+            self.assertRaises(packetstream.DecoderError, list, decoder.feed(b(size)))
+            self.assertTrue(decoder.stream_broken)
+
+    def test_invalid_header(self):
+        decoder = packetstream.JSONDecoder(no_prelude=True)
+        self.assertRaises(packetstream.DecoderError, list, decoder.feed(b("3,0:abc")))
+        self.assertTrue(decoder.stream_broken)
+
+
+class TestProtocol(unittest.TestCase):
+
+    def test_errors(self):
+        e = decode_error(encode_error(ResourceNotFoundError("a/b")))
+        self.assertTrue(isinstance(e, ResourceNotFoundError))
+        self.assertEquals(e.path, "a/b")
+        e = decode_error(encode_error(ValueError("bad value")))
+        self.assertTrue(isinstance(e, ValueError))
+        #  Builtins that can't be made from a message still give an error.
+        try:
+            u"\xe9".encode("ascii")
+        except UnicodeEncodeError, error:
+            e = decode_error(encode_error(error))
+        self.assertTrue(isinstance(e, OperationFailedError))
+        self.assertTrue("UnicodeEncodeError" in str(e))
@@ -5,6 +5,7 @@ import os, os.path
 import socket
 import threading
 import time
+import xmlrpclib
 
 from fs.tests import FSTestCases, ThreadingTestCases
 from fs.tempfs import TempFS
@@ -14,12 +15,24 @@ from fs.path import *
 from fs.errors import *
 
 from fs import rpcfs
-from fs.expose.xmlrpc import RPCFSServer
+from fs.expose.xmlrpc import RPCFSServer, ThreadedRPCFSServer, RPCFSInterface
 
 import six
 from six import PY3, b
 
 
+class _CountingTransport(xmlrpclib.Transport):
+    """Transport that counts the number of requests made through it."""
+
+    def __init__(self, *args, **kwds):
+        xmlrpclib.Transport.__init__(self, *args, **kwds)
+        self.num_requests = 0
+
+    def request(self, *args, **kwds):
+        self.num_requests += 1
+        return xmlrpclib.Transport.request(self, *args, **kwds)
+
+
 class TestRPCFS(unittest.TestCase, FSTestCases, ThreadingTestCases):
 
     def makeServer(self,fs,addr):
@@ -98,3 +111,165 @@ class TestRPCFS(unittest.TestCase, FSTestCases, ThreadingTestCases):
             finally:
                 if sock is not None:
                     sock.close()
+
+    def test_chunked_transfer(self):
+        data = b("0123456789") * (rpcfs.CHUNK_SIZE // 4)
+        self.fs.setcontents("big.txt", data)
+        self.assertEquals(self.temp_fs.getcontents("big.txt", "rb"), data)
+        self.assertEquals(self.fs.getcontents("big.txt", "rb"), data)
+        with self.fs.open("big.txt", "rb") as f:
+            pos = rpcfs.CHUNK_SIZE + 5
+            f.seek(pos)
+            self.assertEquals(f.read(10), data[pos:pos+10])
+
+    def test_only_dirty_ranges_sent(self):
+        if not isinstance(self.fs, rpcfs.RPCFS):
+            self.skipTest("only applies to RPCFS")
+        data = b("x") * (rpcfs.CHUNK_SIZE * 2)
+        self.temp_fs.setcontents("big.txt", data)
+        f = self.fs.open("big.txt", "r+b")
+        writes = []
+        orig_multicall = self.fs._multicall
+        def _multicall(calls):
+            for (method, args) in calls:
+                if method == "write_file":
+                    writes.append((int(args[1]), args[2].data))
+            return orig_multicall(calls)
+        self.fs._multicall = _multicall
+        f.seek(10)
+        f.write(b("abc"))
+        f.seek(12)
+        f.write(b("def"))
+        f.seek(rpcfs.CHUNK_SIZE)
+        f.write(b("ghi"))
+        f.flush()
+        self.assertEquals(writes, [(10, b("abdef")),
+                                   (rpcfs.CHUNK_SIZE, b("ghi"))])
+        f.seek(8)
+        self.assertEquals(f.read(9), b("xxabdefxx"))
+        f.close()
+        expected = bytearray(data)
+        expected[10:15] = b("abdef")
+        expected[rpcfs.CHUNK_SIZE:rpcfs.CHUNK_SIZE+3] = b("ghi")
+        self.assertEquals(self.temp_fs.getcontents("big.txt", "rb"), bytes(expected))
+
+    def _counting_fs(self):
+        transport = _CountingTransport()
+        fs = rpcfs.RPCFS("http://%s:%d" % self.server_addr, transport)
+        transport.num_requests = 0
+        return (fs, transport)
+
+    def test_batched_metadata(self):
+        if not isinstance(self.fs, rpcfs.RPCFS):
+            self.skipTest("only applies to RPCFS")
+        self.temp_fs.makedir("dir")
+        for i in xrange(10):
+            self.temp_fs.setcontents("dir/file%d.txt" % (i,), b("x") * i)
+        self.temp_fs.makedir("dir/sub")
+        self.temp_fs.setcontents("dir/sub/a.txt", b("a"))
+        (fs, transport) = self._counting_fs()
+        entries = dict(fs.listdirinfo("dir"))
+        self.assertEquals(transport.num_requests, 1)
+        self.assertEquals(len(entries), 11)
+        self.assertEquals(entries["file3.txt"]["size"], 3)
+        self.assertEquals(sorted(fs.listdirinfo("dir", wildcard=lambda n: n.startswith("sub"))),
+                          sorted(self.fs.listdirinfo("dir", wildcard="sub*")))
+        transport.num_requests = 0
+        infos = fs.getinfo_many(["dir/file1.txt", "dir/missing", "dir/sub"])
+        self.assertEquals(transport.num_requests, 1)
+        self.assertEquals(infos[0]["size"], 1)
+        self.assertEquals(infos[1], None)
+        transport.num_requests = 0
+        walked = list(fs.walk("/dir", wildcard="*.txt"))
+        self.assertEquals(transport.num_requests, 1)
+        self.assertEquals(walked, list(self.temp_fs.walk("/dir", wildcard="*.txt")))
+        transport.num_requests = 0
+        with fs.open("dir/new.txt", "wb") as f:
+            for i in xrange(5):
+                f.seek(i * rpcfs.CHUNK_SIZE)
+                f.write(b("y"))
+        self.assertEquals(transport.num_requests, 2)
+        self.assertEquals(self.temp_fs.getsize("dir/new.txt"), 4 * rpcfs.CHUNK_SIZE + 1)
+
+
+class TestThreadedRPCFS(TestRPCFS):
+
+    def makeServer(self,fs,addr):
+        return ThreadedRPCFSServer(fs,addr,logRequests=False,max_workers=4)
+
+    def _connection(self, fs):
+        transport = fs.proxy._obj._ServerProxy__transport
+        return transport._connection[1]
+
+    def test_keep_alive(self):
+        self.fs.getinfo("/")
+        conn = self._connection(self.fs)
+        sock = conn.sock
+        self.assertTrue(sock is not None)
+        self.fs.listdir("/")
+        self.assertTrue(self._connection(self.fs) is conn)
+        self.assertTrue(conn.sock is sock)
+
+    def test_many_clients(self):
+        errors = []
+        def client(n):
+            try:
+                fs = rpcfs.RPCFS("http://%s:%d" % self.server_addr)
+                for i in xrange(5):
+                    path = "client%d_%d.txt" % (n, i)
+                    fs.setcontents(path, b("data%d" % (i,)))
+                    self.assertEquals(fs.getcontents(path, "rb"), b("data%d" % (i,)))
+                fs.close()
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=client, args=(n,)) for n in xrange(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEquals(errors, [])
+        self.assertEquals(len(self.temp_fs.listdir("/")), 40)
+
+    def test_gzip(self):
+        data = b("compressible ") * 100000
+        self.temp_fs.setcontents("a.txt", data)
+        transport = self.fs.proxy._obj._ServerProxy__transport
+        self.assertEquals(transport.encode_threshold, None)
+        self.assertEquals(self.fs.getcontents("a.txt", "rb"), data)
+        self.assertEquals(transport.encode_threshold, rpcfs.GZIP_THRESHOLD)
+        self.fs.setcontents("b.txt", data)
+        self.assertEquals(self.temp_fs.getcontents("b.txt", "rb"), data)
+        fs = rpcfs.RPCFS("http://%s:%d" % self.server_addr, compress=False)
+        self.assertEquals(fs.getcontents("a.txt", "rb"), data)
+        transport = fs.proxy._obj._ServerProxy__transport
+        self.assertEquals(transport.encode_threshold, None)
+
+
+class TestRPCFSInterface(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = MemoryFS()
+        self.interface = RPCFSInterface(self.fs)
+
+    def _open(self, path):
+        (handle, size) = self.interface.open_file(self.interface.encode_path(path), "w")
+        return (handle, self.interface._files[handle][0])
+
+    def test_abandoned_files_closed(self):
+        self.interface.file_timeout = 0.1
+        (handle, f) = self._open("a.txt")
+        (used_handle, used_f) = self._open("b.txt")
+        for i in xrange(4):
+            time.sleep(0.04)
+            self.interface.write_file(used_handle, "0", xmlrpclib.Binary(b("data")))
+        self.assertTrue(f.closed)
+        self.assertFalse(used_f.closed)
+        self.assertRaises(ValueError, self.interface.read_file, handle, "0", "10")
+        self.interface.close_file(used_handle)
+        self.assertTrue(used_f.closed)
+
+    def test_max_files(self):
+        self.interface.max_files = 2
+        opened = [self._open("f%d.txt" % (i,)) for i in xrange(3)]
+        self.assertEquals([f.closed for (handle, f) in opened], [True, False, False])
+        self.assertEquals(sorted(self.interface._files), [opened[1][0], opened[2][0]])
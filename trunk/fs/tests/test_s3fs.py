@@ -12,6 +12,7 @@ import unittest
 
 from fs.tests import FSTestCases, ThreadingTestCases
 from fs.path import *
+from fs.errors import *
 
 from six import PY3
 try:
@@ -57,3 +58,365 @@ class TestS3FS_prefix(TestS3FS):
 
     def tearDown(self):
         self.fs.close()
+
+
+try:
+    from moto import mock_s3_deprecated
+except ImportError:
+    mock_s3_deprecated = None
+
+import os
+import time
+import threading
+import boto
+from boto.s3.connection import S3Connection
+from boto.s3.key import Key
+from six import b
+from fs import utils
+from fs.tempfs import TempFS
+
+
+class _ReadOnlyStream(object):
+    """A non-seekable file-like object, like a socket or pipe."""
+
+    def __init__(self, data, fail_after=None):
+        self.data = data
+        self.pos = 0
+        self.fail_after = fail_after
+
+    def read(self, size=-1):
+        if self.fail_after is not None and self.pos >= self.fail_after:
+            raise IOError("simulated read failure")
+        if size < 0:
+            size = len(self.data) - self.pos
+        data = self.data[self.pos:self.pos+size]
+        self.pos += len(data)
+        return data
+
+
+class _WriteOnlyStream(object):
+    """A non-seekable file-like object that collects what is written."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    def getvalue(self):
+        return b("").join(self.chunks)
+
+
+def _serialize_requests(make_request):
+    """Wrap S3Connection.make_request to send one request at a time."""
+    lock = threading.Lock()
+    def serialized_make_request(self, *args, **kwds):
+        with lock:
+            return make_request(self, *args, **kwds)
+    return serialized_make_request
+
+
+class TestS3FS_moto(unittest.TestCase):
+    """Tests for S3FS features that can be checked against moto's fake S3."""
+
+    __test__ = mock_s3_deprecated is not None
+
+    bucket = "test-s3fs-transfers"
+
+    def setUp(self):
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+        self.mock = mock_s3_deprecated()
+        self.mock.start()
+        #  moto's fake sockets mix up the responses to concurrent requests,
+        #  so the transfer threads must take turns to send them.
+        self.make_request = S3Connection.make_request
+        S3Connection.make_request = _serialize_requests(self.make_request)
+        boto.connect_s3().create_bucket(self.bucket)
+        self.fs = self._makefs()
+
+    def tearDown(self):
+        self.fs.close()
+        S3Connection.make_request = self.make_request
+        self.mock.stop()
+
+    def _makefs(self, **kwds):
+        return s3fs.S3FS(self.bucket, part_size=s3fs.MIN_PART_SIZE, **kwds)
+
+    def _bigdata(self, num_parts=2, extra=1234):
+        size = self.fs._part_size * num_parts + extra
+        return os.urandom(size)
+
+    def _num_parts(self, path):
+        etag = self.fs.getinfo(path)["etag"]
+        if "-" not in etag:
+            return 1
+        return int(etag.split("-")[1])
+
+    def test_setcontents_multipart(self):
+        data = self._bigdata()
+        self.fs.setcontents("big.bin", _ReadOnlyStream(data))
+        self.assertEquals(self.fs.getcontents("big.bin"), data)
+        self.assertEquals(self._num_parts("big.bin"), 3)
+        self.fs.setcontents("big2.bin", data)
+        self.assertEquals(self.fs.getcontents("big2.bin"), data)
+
+    def test_setcontents_small_stream(self):
+        self.fs.setcontents("small.txt", _ReadOnlyStream(b("hello world")))
+        self.assertEquals(self.fs.getcontents("small.txt"), b("hello world"))
+        self.assertEquals(self._num_parts("small.txt"), 1)
+
+    def test_open_streaming_write(self):
+        data = self._bigdata()
+        f = self.fs.open("big.bin", "wb-")
+        try:
+            for i in xrange(0, len(data), 64 * 1024):
+                f.write(data[i:i+64*1024])
+            self.assertEquals(f.tell(), len(data))
+            self.assertFalse(self.fs.exists("big.bin"))
+        finally:
+            f.close()
+        self.assertEquals(self.fs.getcontents("big.bin"), data)
+        self.assertEquals(self._num_parts("big.bin"), 3)
+        self.assertRaises(ParentDirectoryMissingError,
+                          self.fs.open, "missing/big.bin", "wb-")
+
+    def test_multipart_abort(self):
+        data = self._bigdata(num_parts=3)
+        src = _ReadOnlyStream(data, fail_after=self.fs._part_size * 2)
+        self.assertRaises(IOError, self.fs.setcontents, "big.bin", src)
+        self.assertFalse(self.fs.exists("big.bin"))
+        self.assertEquals(self.fs._s3bukt.get_all_multipart_uploads(), [])
+
+    def test_download_ranged(self):
+        data = self._bigdata()
+        self.fs.setcontents("big.bin", data)
+        f = _WriteOnlyStream()
+        self.fs.download("big.bin", f)
+        self.assertEquals(f.getvalue(), data)
+        self.assertEquals(self.fs.getcontents("big.bin"), data)
+        self.fs.setcontents("small.txt", b("hello"))
+        self.assertEquals(self.fs.getcontents("small.txt"), b("hello"))
+        self.assertEquals(self.fs.getcontents("small.txt", "r"), u"hello")
+        self.fs.makedir("dir")
+        self.assertRaises(ResourceInvalidError, self.fs.download, "dir", f)
+        self.assertRaises(ResourceNotFoundError, self.fs.getcontents, "nope")
+
+    def test_download_failed_range(self):
+        data = self._bigdata(num_parts=3)
+        self.fs.setcontents("big.bin", data)
+        self.fs._transfer_threads = 2
+        #  Hold the first part in the queue until the second has failed,
+        #  so that it is skipped rather than fetched.
+        class FirstPartWaits(s3fs._S3WorkerPool):
+            def __init__(pool, *args, **kwds):
+                super(FirstPartWaits, pool).__init__(*args, **kwds)
+                get = pool._jobs.get
+                def get_job():
+                    job = get()
+                    if job is not None and job[1][0] == 0:
+                        while pool._error is None:
+                            time.sleep(0.01)
+                    return job
+                pool._jobs.get = get_job
+        second_part = "bytes=%d-" % (self.fs._part_size,)
+        def get_contents_as_string(key, headers=None, **kwds):
+            if headers and headers["Range"].startswith(second_part):
+                raise IOError("simulated GET failure")
+            return get_contents(key, headers=headers, **kwds)
+        get_contents = Key.get_contents_as_string
+        (pool, s3fs._S3WorkerPool) = (s3fs._S3WorkerPool, FirstPartWaits)
+        Key.get_contents_as_string = get_contents_as_string
+        errors = []
+        def download():
+            try:
+                self.fs.download("big.bin", _WriteOnlyStream())
+            except Exception, e:
+                errors.append(e)
+        try:
+            t = threading.Thread(target=download)
+            t.daemon = True
+            t.start()
+            t.join(30)
+            self.assertFalse(t.isAlive())
+        finally:
+            s3fs._S3WorkerPool = pool
+            Key.get_contents_as_string = get_contents
+        self.assertEquals([str(e) for e in errors], ["simulated GET failure"])
+
+    def test_copyfile_to_local(self):
+        data = self._bigdata(num_parts=1)
+        self.fs.setcontents("big.bin", data)
+        tmp = TempFS()
+        try:
+            utils.copyfile(self.fs, "big.bin", tmp, "big.bin")
+            self.assertEquals(tmp.getcontents("big.bin"), data)
+        finally:
+            tmp.close()
+
+    def test_removemany(self):
+        self.fs.makedir("dir")
+        for i in xrange(5):
+            self.fs.setcontents("dir/f%d" % i, b("data"))
+        failures = self.fs.removemany(["dir/f0", "dir/f1", "dir/f2"])
+        self.assertEquals(failures, [])
+        self.assertEquals(sorted(self.fs.listdir("dir")), ["f3", "f4"])
+        self.fs.makedir("dir/sub")
+        failures = self.fs.removemany(["dir/f3", "dir/sub", "dir/f9", "nodir/f"],
+                                      ignore_errors=True)
+        self.assertEquals([(path, type(error)) for (path, error) in failures],
+                          [("dir/sub", ResourceInvalidError),
+                           ("dir/f9", ResourceNotFoundError),
+                           ("nodir/f", ResourceNotFoundError)])
+        self.assertEquals(sorted(self.fs.listdir("dir")), ["f4", "sub"])
+
+    def test_removedir_force_batched(self):
+        #  moto mangles delimited listings of more than 1000 keys, so this
+        #  needs the unsharded listing used with a single transfer thread.
+        fs = self._makefs(transfer_threads=1)
+        fs.makedir("dir/sub", recursive=True)
+        paths = ["dir/f%04d" % i for i in xrange(s3fs.MAX_DELETE_KEYS + 10)]
+        paths.append("dir/sub/file")
+        for path in paths:
+            fs._s3bukt.new_key(fs._s3path(path)).set_contents_from_string("x")
+        fs.removedir("dir", force=True)
+        self.assertFalse(fs.exists("dir"))
+        self.assertEquals(list(fs._s3bukt.list()), [])
+
+    def _maketree(self):
+        paths = []
+        for i in xrange(6):
+            for j in xrange(3):
+                self.fs.makedir("dir/d%d/s%d" % (i, j), recursive=True)
+                for k in xrange(4):
+                    path = "dir/d%d/s%d/f%d.txt" % (i, j, k)
+                    self.fs.setcontents(path, b(path))
+                    paths.append("/" + path)
+        self.fs.setcontents("dir/top.txt", b("top"))
+        self.fs.setcontents("dir2/other.txt", b("other"))
+        paths.append("/dir/top.txt")
+        return paths
+
+    def test_list_keys_sharded(self):
+        self._maketree()
+        serial = set(k.name for k in self.fs._s3bukt.list(prefix="dir/"))
+        sharded = [k.name for k in self.fs._list_keys("dir/")]
+        self.assertEquals(len(sharded), len(serial))
+        self.assertEquals(set(sharded), serial)
+
+    def test_list_keys_sharded_pages(self):
+        #  Two sub-prefixes are enough shards for two threads, so each is
+        #  listed in full, and the first needs more than one page.
+        fs = self._makefs(transfer_threads=2)
+        names = set(fs._s3path("dir/d0/f%04d" % i) for i in xrange(1100))
+        names.update(fs._s3path("dir/d1/s%d/f%d" % (i % 3, i)) for i in xrange(150))
+        for name in names:
+            fs._s3bukt.new_key(name).set_contents_from_string("x")
+        threads = set()
+        make_request = S3Connection.make_request
+        def recording_make_request(*args, **kwds):
+            threads.add(threading.currentThread())
+            return make_request(*args, **kwds)
+        S3Connection.make_request = recording_make_request
+        try:
+            keys = [k.name for k in fs._list_keys("dir/")]
+        finally:
+            S3Connection.make_request = make_request
+        self.assertEquals(len(keys), len(names))
+        self.assertEquals(set(keys), names)
+        self.assertTrue(len(threads) <= 2)
+
+    def test_walkfiles_sharded(self):
+        paths = self._maketree()
+        self.assertEquals(sorted(self.fs.walkfiles("/dir")), sorted(paths))
+        self.assertEquals(sorted(self.fs.walkfiles("/dir", wildcard="f1.txt")),
+                          sorted(p for p in paths if p.endswith("f1.txt")))
+        infos = dict(self.fs.walkfilesinfo("/dir"))
+        self.assertEquals(sorted(infos), sorted(paths))
+        self.assertEquals(infos["/dir/top.txt"]["size"], 3)
+        #  Directory entries are included by walkinfo
+        self.assertTrue("/dir/d0/s0" in dict(self.fs.walkinfo("/dir")))
+
+    def test_list_keys_early_close(self):
+        self._maketree()
+        keys = self.fs._list_keys("dir/")
+        keys.next()
+        keys.close()
+        self.assertEquals(len(list(self.fs._list_keys("dir/"))), 6*3*5 + 6 + 2)
+
+    def test_removedir_force_sharded(self):
+        self._maketree()
+        self.fs.removedir("dir", force=True)
+        self.assertFalse(self.fs.exists("dir"))
+        self.assertTrue(self.fs.exists("dir2/other.txt"))
+
+    def test_copydir(self):
+        paths = self._maketree()
+        self.fs.copydir("dir", "copy")
+        copies = [p.replace("/dir/", "/copy/", 1) for p in paths]
+        self.assertEquals(sorted(self.fs.walkfiles("/copy")), sorted(copies))
+        self.assertEquals(self.fs.getcontents("copy/d1/s2/f3.txt"),
+                          b("dir/d1/s2/f3.txt"))
+        self.assertTrue(self.fs.isdir("copy/d5/s0"))
+        self.assertTrue(self.fs.exists("dir/top.txt"))
+        self.assertRaises(DestinationExistsError, self.fs.copydir, "dir", "copy")
+        self.assertRaises(ResourceInvalidError, self.fs.copydir, "dir/top.txt", "x")
+
+    def test_movedir(self):
+        paths = self._maketree()
+        self.fs.movedir("dir", "moved")
+        self.assertFalse(self.fs.exists("dir"))
+        moved = [p.replace("/dir/", "/moved/", 1) for p in paths]
+        self.assertEquals(sorted(self.fs.walkfiles("/moved")), sorted(moved))
+        self.assertEquals(self.fs.listdir("dir2"), ["other.txt"])
+        self.assertRaises(ResourceNotFoundError, self.fs.movedir, "dir", "x")
+
+    def test_copydir_multipart(self):
+        data = self._bigdata()
+        self.fs.makedir("dir")
+        self.fs.setcontents("dir/big.bin", data)
+        self.fs.setcontents("dir/small.txt", b("small"))
+        old_sizes = (s3fs.MAX_COPY_SIZE, s3fs.COPY_PART_SIZE)
+        s3fs.MAX_COPY_SIZE = s3fs.COPY_PART_SIZE = s3fs.MIN_PART_SIZE
+        try:
+            self.fs.movedir("dir", "moved")
+        finally:
+            (s3fs.MAX_COPY_SIZE, s3fs.COPY_PART_SIZE) = old_sizes
+        self.assertEquals(self._num_parts("moved/big.bin"), 3)
+        self.assertEquals(self.fs.getcontents("moved/big.bin"), data)
+        self.assertEquals(self.fs.getcontents("moved/small.txt"), b("small"))
+        self.assertFalse(self.fs.exists("dir"))
+
+    def test_consistency_strict(self):
+        self.fs.setcontents("a.txt", b("hello"))
+        self.fs.remove("a.txt")
+        stats = self.fs.getsyncstats()
+        self.assertEquals(stats["checks"], 2)
+        self.assertEquals(stats["timeouts"], 0)
+
+    def test_consistency_none(self):
+        fs = self._makefs(consistency="none")
+        fs.setcontents("a.txt", b("hello"))
+        fs.makedir("dir")
+        self.assertEquals(fs.getcontents("a.txt"), b("hello"))
+        self.assertEquals(fs.getsyncstats()["checks"], 0)
+        fs = self._makefs(key_sync_timeout=None)
+        fs.setcontents("a.txt", b("hello"))
+        self.assertEquals(fs.getsyncstats()["checks"], 0)
+        self.assertRaises(ValueError, self._makefs, consistency="sometimes")
+
+    def test_consistency_lazy(self):
+        fs = self._makefs(consistency="lazy", key_sync_timeout=0.2)
+        fs.setcontents("a.txt", b("hello"))
+        fs.checkconsistency()
+        self.assertEquals(fs.getsyncstats()["checks"], 1)
+        #  Pretend we wrote something that never shows up in S3
+        k = fs._s3bukt.new_key(fs._s3path("a.txt"))
+        k.etag = '"not-the-real-etag"'
+        fs._sync_key(k)
+        self.assertRaises(OperationTimeoutError, fs.checkconsistency)
+        stats = fs.getsyncstats()
+        self.assertEquals(stats["timeouts"], 1)
+        self.assertEquals(stats["waits"], 1)
+        fs.checkconsistency()
+        fs.close()
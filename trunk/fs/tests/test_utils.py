@@ -3,6 +3,7 @@ import unittest
 from fs.tempfs import TempFS
 from fs.memoryfs import MemoryFS
 from fs import utils
+from fs.errors import ResourceNotFoundError
 
 from six import b
 
@@ -40,6 +41,19 @@ class TestUtils(unittest.TestCase):
         utils.copydir(fs1, fs2)        
         self._check_fs(fs2)
     
+    def test_copyfile_to_local(self):
+        """Test copyfile into a filesystem with system paths"""
+        fs1 = MemoryFS()
+        self._make_fs(fs1)
+        fs2 = TempFS()
+        fs2.setcontents("dst", b("old"))
+        utils.copyfile(fs1, "foo/bar/fruit", fs2, "dst")
+        self.assertEqual(fs2.getcontents("dst", "rb"), b("apple"))
+        self.assertRaises(ResourceNotFoundError, utils.copyfile,
+                          fs1, "missing", fs2, "dst")
+        self.assertEqual(fs2.getcontents("dst", "rb"), b("apple"))
+        fs2.close()
+
     def test_copydir_indir(self):
         """Test copydir in a directory"""        
         fs1 = MemoryFS()
@@ -0,0 +1,147 @@
+"""
+
+  fs.tests.test_wsgi:  testcases for fs.expose.wsgi
+
+"""
+
+import unittest
+
+from fs.tests import CountingFS
+from fs.tempfs import TempFS
+from fs.memoryfs import MemoryFS
+from fs.watch import WatchableFS
+from fs.expose.httputil import parse_range
+
+from six import b
+
+try:
+    from fs.expose.wsgi import serve_fs
+except ImportError:
+    serve_fs = None
+
+
+class _FileWrapper(object):
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        return iter(lambda: self.f.read(self.chunk_size), b(""))
+
+    def close(self):
+        self.f.close()
+
+
+class TestWSGI(unittest.TestCase):
+
+    def setUp(self):
+        if serve_fs is None:
+            self.skipTest("mako is not installed")
+        self.fs = MemoryFS()
+        self.data = b("").join(b("%05d\n") % (i,) for i in xrange(2000))
+        self.fs.setcontents("data.txt", self.data)
+        self.app = serve_fs(self.fs)
+
+    def request(self, path, app=None, **headers):
+        environ = dict(PATH_INFO=path, REQUEST_METHOD=headers.pop("method", "GET"),
+                       QUERY_STRING=headers.pop("query", ""))
+        for (name, value) in headers.items():
+            environ["HTTP_" + name.upper()] = value
+        response = {}
+        def start_response(status, headers):
+            response["status"] = int(status.split()[0])
+            response["headers"] = dict(headers)
+        body = b("").join((app or self.app)(environ, start_response))
+        return (response["status"], response["headers"], body)
+
+    def test_validators(self):
+        (status, headers, body) = self.request("/data.txt")
+        self.assertEquals(status, 200)
+        self.assertEquals(body, self.data)
+        self.assertEquals(headers["Accept-Ranges"], "bytes")
+        etag = headers["ETag"]
+        last_modified = headers["Last-Modified"]
+        (status, headers, body) = self.request("/data.txt", if_none_match=etag)
+        self.assertEquals((status, body), (304, b("")))
+        (status, headers, body) = self.request("/data.txt", if_modified_since=last_modified)
+        self.assertEquals((status, body), (304, b("")))
+        (status, headers, body) = self.request("/data.txt", if_none_match='"other"',
+                                               if_modified_since=last_modified)
+        self.assertEquals(status, 200)
+        (status, headers, body) = self.request("/data.txt", method="HEAD")
+        self.assertEquals((status, body), (200, b("")))
+        self.assertEquals(headers["Content-Length"], str(len(self.data)))
+
+    def test_ranges(self):
+        (status, headers, body) = self.request("/data.txt", range="bytes=6-11")
+        self.assertEquals((status, body), (206, self.data[6:12]))
+        self.assertEquals(headers["Content-Range"], "bytes 6-11/%d" % (len(self.data),))
+        (status, headers, body) = self.request("/data.txt", range="bytes=-6")
+        self.assertEquals((status, body), (206, self.data[-6:]))
+        (status, headers, body) = self.request("/data.txt", range="bytes=99999-")
+        self.assertEquals(status, 416)
+        (status, headers, body) = self.request("/data.txt", range="bytes=0-5",
+                                               if_range='"stale"')
+        self.assertEquals((status, body), (200, self.data))
+        (status, headers, body) = self.request("/data.txt", range="bytes=0-5,-6")
+        self.assertEquals(status, 206)
+        boundary = headers["Content-Type"].split("boundary=")[1]
+        self.assertEquals(len(body), int(headers["Content-Length"]))
+        parts = body.split(b("--") + boundary)
+        self.assertEquals(parts[-1], b("--\r\n"))
+        self.assertTrue(parts[1].endswith(b("\r\n\r\n") + self.data[:6] + b("\r\n")))
+        self.assertTrue(parts[2].endswith(b("\r\n\r\n") + self.data[-6:] + b("\r\n")))
+
+    def test_file_wrapper(self):
+        temp_fs = TempFS()
+        try:
+            temp_fs.setcontents("data.txt", self.data)
+            app = serve_fs(temp_fs)
+            environ = {"PATH_INFO": "/data.txt", "wsgi.file_wrapper": _FileWrapper}
+            body = app(environ, lambda status, headers: None)
+            self.assertTrue(isinstance(body, _FileWrapper))
+            self.assertEquals(b("").join(body), self.data)
+            body.close()
+        finally:
+            temp_fs.close()
+
+    def test_dir_pages(self):
+        fs = CountingFS(methods=("listdirinfo",))
+        fs.makedir("dir")
+        for i in xrange(25):
+            fs.setcontents("dir/f%02d" % (i,), b(""))
+        fs.makedir("dir/sub")
+        app = serve_fs(fs, page_size=10)
+        (status, headers, page1) = self.request("/dir", app)
+        self.assertEquals(status, 200)
+        self.assertTrue(b("sub/") in page1 and b("../") in page1)
+        self.assertTrue(b('href="?page=3"') in page1)
+        (status, headers, page3) = self.request("/dir", app, query="page=3")
+        self.assertEquals(page3.count(b('class="link-file"')), 6)
+        self.assertEquals(fs.calls["listdirinfo"], 1)
+        (status, headers, again) = self.request("/dir", app)
+        self.assertEquals(again, page1)
+        self.assertEquals(headers["Content-Length"], str(len(page1)))
+        (status, headers, body) = self.request("/dir", app, if_none_match=headers["ETag"])
+        self.assertEquals(status, 304)
+        self.assertEquals(fs.calls["listdirinfo"], 1)
+
+    def test_dir_watch(self):
+        fs = WatchableFS(CountingFS(methods=("listdirinfo",)))
+        fs.makedir("dir")
+        app = serve_fs(fs, watch=True, cache_ttl=0)
+        (status, headers, body) = self.request("/dir", app)
+        (status, headers, body) = self.request("/dir", app)
+        self.assertEquals(fs.wrapped_fs.calls["listdirinfo"], 1)
+        fs.setcontents("dir/new.txt", b("hello"))
+        (status, headers, body) = self.request("/dir", app)
+        self.assertEquals(fs.wrapped_fs.calls["listdirinfo"], 2)
+        self.assertTrue(b("new.txt") in body)
+
+    def test_parse_range(self):
+        self.assertEquals(parse_range("bytes=0-0,5-", 10), [(0, 1), (5, 10)])
+        self.assertEquals(parse_range("bytes=-20", 10), [(0, 10)])
+        self.assertEquals(parse_range("bytes=10-", 10), [])
+        self.assertEquals(parse_range("bytes=5-2", 10), None)
+        self.assertEquals(parse_range("items=0-1", 10), None)
+        self.assertEquals(parse_range(None, 10), None)
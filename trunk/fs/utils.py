@@ -62,6 +62,16 @@ def copyfile(src_fs, src_path, dst_fs, dst_path, overwrite=True, chunk_size=64*1
         src_lock.acquire()
 
     try:
+        # Download straight into a local file, which some filesystems
+        # (e.g. S3FS) can do faster than reading a chunk at a time.  A
+        # missing source is left to open() below, so it can't clobber dst.
+        if dst_syspath is not None and src_fs.isfile(src_path):
+            dst = dst_fs.open(dst_path, 'wb')
+            try:
+                src_fs.download(src_path, dst, chunk_size=chunk_size)
+            finally:
+                dst.close()
+            return
         src = None
         try:
             src = src_fs.open(src_path, 'rb')
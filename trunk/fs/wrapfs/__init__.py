@@ -166,6 +166,14 @@ class WrapFS(FS):
         else:
             return super(WrapFS, self).setcontents(path, data, encoding=encoding, errors=errors, chunk_size=chunk_size)
 
+    @rewrite_errors
+    def download(self, path, dst_file, chunk_size=64*1024):
+        #  As for setcontents(), this would bypass any _file_wrap method.
+        if getattr(self.__class__, '_file_wrap', None) is getattr(WrapFS, '_file_wrap', None):
+            return self.wrapped_fs.download(self._encode(path), dst_file, chunk_size=chunk_size)
+        else:
+            return super(WrapFS, self).download(path, dst_file, chunk_size=chunk_size)
+
     @rewrite_errors
     def createfile(self, path, wipe=False):
         return self.wrapped_fs.createfile(self._encode(path), wipe=wipe)